@@ -0,0 +1,124 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from aiogram import BaseMiddleware
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Допуск апдейтов к обработке.
+#
+# Одновременно выполняется не больше `workers` хендлеров, остальные апдейты ждут
+# своей очереди по порядку поступления. Сколько апдейтов может ждать, ограничивает
+# поллинг (tasks_concurrency_limit): когда очередь полна, бот перестаёт забирать
+# апдейты у Telegram, и память не растёт.
+#
+# Апдейты админа идут вне очереди и без ограничения: «готово» по заказу и
+# подтверждения не ждут клиентский трафик.
+#
+# Дешёвые повторяемые нажатия (перерисовка экранов вроде `categories`) отбрасываются:
+# повтор того же нажатия, пока прежнее ждёт в очереди, — всегда, любое такое
+# нажатие — когда очередь длиннее shed_depth. На отброшенный callback сразу
+# отвечаем, чтобы у кнопки не крутились часики.
+#
+# workers=0 выключает ограничение.
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    def __init__(self, workers=32, shed_depth=200, admin_ids=(), sheddable=(), sheddable_prefixes=()):
+        self.workers = workers
+        self.shed_depth = shed_depth
+        self.admin_ids = set(admin_ids)
+        self.sheddable = set(sheddable)
+        self.sheddable_prefixes = tuple(sheddable_prefixes)
+        self.running = 0
+        self.waiting = deque()
+        # (user_id, callback_data) отбрасываемых нажатий, которые ждут в очереди
+        self.waiting_keys = {}
+
+    def _shed_key(self, update):
+        call = update.callback_query
+        if call is None or not call.data:
+            return None
+        if call.data in self.sheddable or call.data.startswith(self.sheddable_prefixes):
+            return call.from_user.id, call.data
+        return None
+
+    def _report(self):
+        metrics.set_gauge('admission_queue_depth', len(self.waiting))
+        metrics.set_gauge('admission_running', self.running)
+
+    async def __call__(self, handler, event, data):
+        if not self.workers:
+            return await handler(event, data)
+
+        user = getattr(event.event, 'from_user', None)
+        if user is not None and user.id in self.admin_ids:
+            metrics.inc('admission_admitted_total', lane='admin')
+            return await handler(event, data)
+
+        key = self._shed_key(event)
+        if key is not None:
+            reason = None
+            if key in self.waiting_keys:
+                reason = 'repeat'
+            elif len(self.waiting) >= self.shed_depth:
+                reason = 'depth'
+            if reason:
+                metrics.inc('admission_shed_total', reason=reason)
+                await self._answer_shed(event.callback_query)
+                return None
+
+        started = time.perf_counter()
+        await self._acquire(key)
+        metrics.observe('admission_wait_seconds', time.perf_counter() - started)
+        metrics.inc('admission_admitted_total', lane='user')
+        try:
+            return await handler(event, data)
+        finally:
+            self._release()
+
+    async def _acquire(self, key):
+        if self.running < self.workers and not self.waiting:
+            self.running += 1
+            self._report()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append(future)
+        if key is not None:
+            self.waiting_keys[key] = self.waiting_keys.get(key, 0) + 1
+        self._report()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Место уже передали этому апдейту — отдаём его следующему
+                self._release()
+            else:
+                self.waiting.remove(future)
+                self._report()
+            raise
+        finally:
+            if key is not None:
+                self.waiting_keys[key] -= 1
+                if not self.waiting_keys[key]:
+                    del self.waiting_keys[key]
+
+    def _release(self):
+        # Место освободившегося хендлера переходит первому ждущему апдейту
+        while self.waiting:
+            future = self.waiting.popleft()
+            if not future.done():
+                future.set_result(None)
+                self._report()
+                return
+        self.running -= 1
+        self._report()
+
+    async def _answer_shed(self, call):
+        try:
+            await call.answer()
+        except Exception as e:
+            logger.debug("Не удалось ответить на отброшенный callback: %s", e)
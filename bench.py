@@ -0,0 +1,634 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import shutil
+import tempfile
+import subprocess
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Бенчмарки бота. Все прогоны идут против заглушки Telegram (fake_telegram.FakeSession)
+# и временной папки данных, рабочая папка data/ не трогается.
+#
+#   python bench.py startup --orders 100000
+#   python bench.py browse --users 20
+#   python bench.py flood --users 500 --workers 32
+#   python bench.py memory --orders 100000
+#   python bench.py stress --users 40 --updates 5000
+#   python bench.py recommend --orders 100000
+
+BASE_DIR = Path(__file__).parent
+FAKE_ENV = {
+    'TELEGRAM_BOT_TOKEN': '123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA',
+    'ADMIN_ID': '1',
+    'LOG_LEVEL': 'WARNING',
+}
+
+
+def bench_env(**extra):
+    env = dict(os.environ)
+    for key, value in FAKE_ENV.items():
+        env.setdefault(key, value)
+    env.update({k: str(v) for k, v in extra.items()})
+    return env
+
+
+def synthetic_orders(menu, count, seed=42):
+    rnd = random.Random(seed)
+    lines = [
+        (cat_id, item_id, item)
+        for cat_id, items in menu.items()
+        for item_id, item in items.items()
+    ]
+    started = datetime(2025, 7, 20)
+    result = {}
+    for n in range(count):
+        items = {}
+        for cat_id, item_id, item in rnd.sample(lines, k=min(len(lines), rnd.randint(1, 4))):
+            items[item_id] = {
+                'category': cat_id,
+                'name': item['name'],
+                'price': item['price'],
+                'count': rnd.randint(1, 5)
+            }
+        result[f"B{n:07d}"] = {
+            'user_id': str(rnd.randint(10 ** 8, 10 ** 8 + 5000)),
+            'items': items,
+            'created_at': (started + timedelta(minutes=n)).isoformat(),
+            'status': rnd.choice(('new', 'done'))
+        }
+    return result
+
+
+def prepare_data_dir(path, orders_count, compact=True):
+    import json_codec
+    path = Path(path)
+    (path / 'photos').mkdir(parents=True, exist_ok=True)
+    menu = json_codec.read_file(BASE_DIR / 'data' / 'menu.json')
+    json_codec.write_file(path / 'menu.json', menu, compact)
+    json_codec.write_file(path / 'orders.json', synthetic_orders(menu, orders_count), compact)
+    json_codec.write_file(path / 'active_orders.json', {}, compact)
+    return path
+
+
+def import_bot():
+    # Бот импортируется только после подстановки окружения
+    for key, value in FAKE_ENV.items():
+        os.environ.setdefault(key, value)
+    sys.path.insert(0, str(BASE_DIR))
+    import bot as bot_module
+    from fake_telegram import FakeSession
+    bot_module.bot.session = FakeSession()
+    return bot_module
+
+
+# ====================== STARTUP ======================
+
+async def _startup_child():
+    started = time.perf_counter()
+    bot_module = import_bot()
+    imported = time.perf_counter()
+
+    from fake_telegram import message_update
+    await bot_module.dp.emit_startup(bot=bot_module.bot)
+    ready = time.perf_counter()
+
+    await bot_module.dp.feed_update(bot_module.bot, message_update(42, '/start', bot=bot_module.bot))
+    first_update = time.perf_counter()
+
+    print(json.dumps({
+        'import_ms': round((imported - started) * 1000, 1),
+        'startup_ms': round((ready - imported) * 1000, 1),
+        'first_update_ms': round((first_update - ready) * 1000, 1),
+        'time_to_first_update_ms': round((first_update - started) * 1000, 1),
+        'orders': len(bot_module.orders),
+    }))
+
+
+def cmd_startup(args):
+    try:
+        import orjson  # noqa: F401
+        codecs = ['orjson', 'stdlib']
+    except ImportError:
+        codecs = ['stdlib']
+
+    print(f"Синтетических заказов: {args.orders}")
+    print(f"{'кодек':<8} {'формат':<8} {'orders.json':>12} {'импорт':>9} {'старт':>9} {'1-й апдейт':>11} {'итого':>9}")
+    for compact in (True, False):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = prepare_data_dir(tmp, args.orders, compact)
+            size_mb = (data_dir / 'orders.json').stat().st_size / 2 ** 20
+            for codec in codecs:
+                env = bench_env(DATA_DIR=data_dir, JSON_CODEC=codec, DB_COMPACT=int(compact))
+                out = subprocess.run(
+                    [sys.executable, __file__, '_startup_child'],
+                    env=env, capture_output=True, text=True, check=True
+                ).stdout.strip().splitlines()[-1]
+                r = json.loads(out)
+                print(
+                    f"{codec:<8} {'compact' if compact else 'indent':<8} {size_mb:>10.1f}MB "
+                    f"{r['import_ms']:>7.1f}мс {r['startup_ms']:>7.1f}мс "
+                    f"{r['first_update_ms']:>9.1f}мс {r['time_to_first_update_ms']:>7.1f}мс"
+                )
+
+
+# ====================== BROWSE ======================
+
+def browse_script(menu, regular):
+    # Типичная сессия: /start, обход всех позиций обычных категорий с возвратом
+    # в меню, корзина и несколько специальных категорий
+    steps = [('message', '/start'), ('callback', 'categories')]
+    for cat_id in regular:
+        for item_id in menu.get(cat_id, {}):
+            steps += [
+                ('callback', f"category_{cat_id}"),
+                ('callback', f"item_{cat_id}_{item_id[len('item_'):]}"),
+                ('callback', 'categories'),
+            ]
+    first_cat = next(c for c in regular if menu.get(c))
+    first_item = next(iter(menu[first_cat]))[len('item_'):]
+    steps += [
+        ('callback', f"category_{first_cat}"),
+        ('callback', f"item_{first_cat}_{first_item}"),
+        ('callback', f"add_{first_cat}_{first_item}"),
+        ('callback', 'my_order'),
+        ('callback', 'edit_order'),
+        ('callback', 'my_order'),
+        ('callback', 'categories'),
+        ('callback', 'category_outdoor'),
+        ('callback', 'categories'),
+        ('callback', 'category_bichis'),
+        ('callback', 'bichis_shawarma'),
+        ('callback', 'categories'),
+        ('callback', 'category_delivery'),
+        ('callback', 'delivery_continue'),
+        ('callback', 'delivery_green'),
+        ('callback', 'categories'),
+    ]
+    return steps
+
+
+async def _browse(users):
+    bot_module = import_bot()
+    from fake_telegram import message_update, callback_update
+    session = bot_module.bot.session
+    await bot_module.dp.emit_startup(bot=bot_module.bot)
+    regular = [c for c in bot_module.CATEGORIES if c not in bot_module.UNEDITABLE_CATEGORIES]
+    steps = browse_script(bot_module.menu, regular)
+    session.reset()
+
+    async def customer(user_id):
+        for kind, data in steps:
+            if kind == 'message':
+                update = message_update(user_id, data, bot=bot_module.bot)
+            else:
+                # Кнопку нажимают на последнем сообщении бота в этом чате
+                message_id = session.last_message.get(user_id)
+                photo = session.messages.get((user_id, message_id))
+                update = callback_update(
+                    user_id, data, bot=bot_module.bot, message_id=message_id, photo=bool(photo)
+                )
+            await bot_module.dp.feed_update(bot_module.bot, update)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(customer(10 ** 6 + n) for n in range(users)))
+    elapsed = time.perf_counter() - started
+    await bot_module.dp.emit_shutdown(bot=bot_module.bot)
+
+    # Сообщения в чате пользователя, оставшиеся после сессии
+    left = sum(1 for chat_id, _ in session.messages if chat_id != int(bot_module.ADMIN_ID))
+    return {
+        'steps': len(steps),
+        'calls': dict(session.calls),
+        'bytes': dict(session.bytes_sent),
+        'messages_left': left,
+        'elapsed': elapsed,
+    }
+
+
+def cmd_browse(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = prepare_data_dir(tmp, 0)
+        shutil.rmtree(data_dir / 'photos')
+        shutil.copytree(BASE_DIR / 'data' / 'photos', data_dir / 'photos')
+        os.environ['DATA_DIR'] = str(data_dir)
+        r = asyncio.run(_browse(args.users))
+
+    # Ответы на callback не зависят от навигации, считаем их отдельно
+    answers = r['calls'].pop('answerCallbackQuery', 0)
+    r['bytes'].pop('answerCallbackQuery', None)
+    total_calls = sum(r['calls'].values())
+    total_bytes = sum(r['bytes'].values())
+    print(f"Пользователей: {args.users}, шагов в сессии: {r['steps']}")
+    print(f"{'метод':<24} {'вызовов':>8} {'байт':>12}")
+    for method in sorted(r['calls']):
+        print(f"{method:<24} {r['calls'][method]:>8} {r['bytes'].get(method, 0):>12}")
+    print(f"{'итого':<24} {total_calls:>8} {total_bytes:>12}")
+    print(
+        f"На сессию: {total_calls / args.users:.1f} вызовов, {total_bytes / args.users / 1024:.1f} КБ, "
+        f"сообщений в чате после сессии: {r['messages_left'] / args.users:.1f}, "
+        f"answerCallbackQuery: {answers / args.users:.1f}"
+    )
+
+
+# ====================== FLOOD ======================
+
+async def _flood(users, taps, latency):
+    bot_module = import_bot()
+    import metrics
+    from fake_telegram import FakeSession, message_update, callback_update
+    bot_module.bot.session = FakeSession(latency=latency)
+    await bot_module.dp.emit_startup(bot=bot_module.bot)
+    admin_id = int(bot_module.ADMIN_ID)
+    cat_id = next(c for c in bot_module.CATEGORIES if bot_module.menu.get(c))
+    item_id = next(iter(bot_module.menu[cat_id]))[len('item_'):]
+
+    # Заказ, который админ отметит готовым посреди наплыва
+    for data in (f"add_{cat_id}_{item_id}", 'final_confirm'):
+        await bot_module.dp.feed_update(bot_module.bot, callback_update(7, data, bot=bot_module.bot))
+    order_id = next(reversed(bot_module.orders))
+
+    latencies = {'user': [], 'admin': []}
+    peak_depth = 0
+    started_users = 0
+    flood_started = asyncio.Event()
+
+    async def timed(lane, update):
+        nonlocal peak_depth
+        started = time.perf_counter()
+        await bot_module.dp.feed_update(bot_module.bot, update)
+        latencies[lane].append(time.perf_counter() - started)
+        peak_depth = max(peak_depth, len(bot_module.admission.waiting))
+
+    async def customer(user_id):
+        # Нетерпеливый клиент: открывает категорию и жмёт «меню» несколько раз подряд
+        nonlocal started_users
+        await timed('user', message_update(user_id, '/start', bot=bot_module.bot))
+        started_users += 1
+        if started_users == users // 2:
+            flood_started.set()
+        steps = [f"category_{cat_id}"] + ['categories'] * taps
+        await asyncio.gather(*(
+            timed('user', callback_update(user_id, data, bot=bot_module.bot)) for data in steps
+        ))
+
+    async def admin():
+        # Админ жмёт кнопку в разгар наплыва
+        await flood_started.wait()
+        await timed('admin', callback_update(admin_id, f"order_cooking_{order_id}", bot=bot_module.bot))
+        await timed('admin', message_update(admin_id, '/queue', bot=bot_module.bot))
+
+    started = time.perf_counter()
+    await asyncio.gather(admin(), *(customer(10 ** 6 + n) for n in range(users)))
+    elapsed = time.perf_counter() - started
+    await bot_module.dp.emit_shutdown(bot=bot_module.bot)
+
+    shed = sum(value for key, value in metrics.series('admission_shed_total'))
+    return latencies, shed, peak_depth, elapsed, dict(bot_module.bot.session.calls)
+
+
+def cmd_flood(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = prepare_data_dir(tmp, 0)
+        os.environ.update(DATA_DIR=str(data_dir), ADMISSION_WORKERS=str(args.workers))
+        latencies, shed, peak_depth, elapsed, calls = asyncio.run(_flood(args.users, args.taps, args.latency))
+
+    def pct(values, q):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else 0.0
+
+    print(f"Пользователей: {args.users}, нажатий «меню» подряд: {args.taps}, воркеров: {args.workers or 'без ограничения'}")
+    print(f"{'кто':<6} {'апдейтов':>9} {'p50':>9} {'p99':>9} {'max':>9}")
+    for lane, values in latencies.items():
+        print(f"{lane:<6} {len(values):>9} {pct(values, 0.5):>7.1f}мс {pct(values, 0.99):>7.1f}мс {pct(values, 1):>7.1f}мс")
+    print(
+        f"Отброшено: {int(shed)}, пик очереди: {peak_depth}, вызовов API: {sum(calls.values())}, "
+        f"время: {elapsed:.2f} с"
+    )
+
+
+# ====================== MEMORY ======================
+
+def _measure(build):
+    import gc
+    import tracemalloc
+    # Время — отдельным прогоном: tracemalloc замедляет выделение памяти в разы
+    gc.collect()
+    started = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def cmd_memory(args):
+    import json_codec
+    from models import load_orders
+    menu = json_codec.read_file(BASE_DIR / 'data' / 'menu.json')
+    # Заказы читаются из JSON, как при запуске бота: у каждого свои копии строк
+    raw = json_codec.dumps(synthetic_orders(menu, args.orders))
+
+    dicts, dict_size, dict_time = _measure(lambda: json_codec.loads(raw))
+    models, model_size, model_time = _measure(lambda: load_orders(json_codec.loads(raw)))
+    lossless = all(models[order_id].to_dict() == order for order_id, order in dicts.items())
+    del models, dicts
+
+    print(f"Заказов: {args.orders}, JSON: {len(raw) / 2 ** 20:.1f} МБ, кодек: {json_codec.CODEC_NAME}")
+    print(f"{'представление':<14} {'память':>10} {'на заказ':>10} {'загрузка':>10}")
+    for title, size, elapsed in (('словари', dict_size, dict_time), ('models.py', model_size, model_time)):
+        print(f"{title:<14} {size / 2 ** 20:>8.1f}МБ {size / args.orders:>9.0f}Б {elapsed * 1000:>8.0f}мс")
+    print(f"JSON после to_dict() совпадает с исходным: {'да' if lossless else 'НЕТ'}")
+
+
+# ====================== STRESS ======================
+
+def stress_script(users, items, updates, seed):
+    # Половина клиентов только добавляет и оформляет: у них каждая добавленная
+    # единица обязана оказаться в заказе или в корзине. Остальные ещё удаляют
+    # позиции, чистят корзину и смотрят её
+    rnd = random.Random(seed)
+    exact = set(users[::2])
+    script = []
+    for _ in range(updates):
+        user_id = rnd.choice(users)
+        cat_id, item_id = rnd.choice(items)
+        r = rnd.random()
+        if user_id in exact:
+            data = 'final_confirm' if r < 0.2 else f"add_{cat_id}_{item_id[len('item_'):]}"
+        elif r < 0.55:
+            data = f"add_{cat_id}_{item_id[len('item_'):]}"
+        elif r < 0.7:
+            data = f"remove_{item_id}"
+        elif r < 0.8:
+            data = 'clear_cart'
+        elif r < 0.95:
+            data = 'final_confirm'
+        else:
+            data = 'my_order'
+        script.append((user_id, data))
+    return script, exact
+
+
+async def _stress(users, updates, latency, seed, stock=None):
+    import logging
+    import re
+    bot_module = import_bot()
+    from fake_telegram import FakeSession, callback_update
+    session = bot_module.bot.session = FakeSession(latency=latency)
+    await bot_module.dp.emit_startup(bot=bot_module.bot)
+    admin_id = int(bot_module.ADMIN_ID)
+
+    # Уведомления админу: по ним сверяется «Итого» с позициями сохранённого заказа
+    notices = {}
+    make_request = session.make_request
+
+    async def recording(bot, method, timeout=None):
+        if method.__api_method__ == 'sendMessage' and method.chat_id == admin_id and method.reply_markup:
+            order_id = method.reply_markup.inline_keyboard[0][0].callback_data.split('_', 2)[2]
+            notices[order_id] = int(re.search(r"Итого:\*\s*(\d+)", method.text).group(1))
+        return await make_request(bot, method, timeout)
+
+    session.make_request = recording
+
+    # Ошибки хендлеров ловятся и пишутся в лог: считаем их
+    errors = []
+
+    class ErrorCounter(logging.Handler):
+        def emit(self, record):
+            errors.append(record.getMessage())
+
+    counter = ErrorCounter(logging.ERROR)
+    logging.getLogger().addHandler(counter)
+
+    items = [
+        (cat_id, item_id)
+        for cat_id in bot_module.CATEGORIES if cat_id not in bot_module.UNEDITABLE_CATEGORIES
+        for item_id in bot_module.menu.get(cat_id, {}) if item_id.startswith('item_')
+    ][:6]
+    # --stock: первая позиция ограничена, её добавления могут получить отказ,
+    # поэтому в проверке «ни одно добавление не потеряно» она не участвует
+    limited = {}
+    if stock is not None:
+        limited[items[0][1]] = stock
+        bot_module.inventory.set_level(items[0][1], stock)
+    limited_adds = {f"add_{cat_id}_{item_id[len('item_'):]}" for cat_id, item_id in items if item_id in limited}
+    user_ids = [10 ** 6 + n for n in range(users)]
+    script, exact = stress_script(user_ids, items, updates, seed)
+    orders_before = set(bot_module.orders)
+
+    latencies = []
+
+    async def feed(user_id, data):
+        started = time.perf_counter()
+        await bot_module.dp.feed_update(bot_module.bot, callback_update(user_id, data, bot=bot_module.bot))
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(user_id, data) for user_id, data in script))
+    elapsed = time.perf_counter() - started
+    await bot_module.dp.emit_shutdown(bot=bot_module.bot)
+    logging.getLogger().removeHandler(counter)
+
+    orders = {k: v for k, v in bot_module.orders.items() if k not in orders_before}
+    carts = bot_module.active_orders
+    added = {}
+    for user_id, data in script:
+        if data.startswith('add_') and data not in limited_adds:
+            added[str(user_id)] = added.get(str(user_id), 0) + 1
+    units = {}
+    for user_id in map(str, user_ids):
+        in_orders = sum(
+            line.count for o in orders.values() if o.user_id == user_id
+            for item_id, line in o.items.items() if item_id not in limited
+        )
+        in_cart = sum(
+            line.count for item_id, line in carts[user_id].items.items() if item_id not in limited
+        ) if user_id in carts else 0
+        units[user_id] = in_orders + in_cart
+
+    inventory = bot_module.inventory
+    in_carts, sold = Counter(), Counter()
+    for cart in carts.values():
+        for item_id, line in cart.items.items():
+            in_carts[item_id] += line.count
+    for order in orders.values():
+        for item_id, line in order.items.items():
+            sold[item_id] += line.count
+
+    prices = {item_id: bot_module.menu[cat_id][item_id]['price'] for cat_id, item_id in items}
+    stored_menu, stored_orders, stored_carts = bot_module.create_store().load()
+    item_dicts = [id(o.items) for o in orders.values()] + [id(c.items) for c in carts.values()]
+    checks = [
+        ("хендлеры отработали без ошибок", not errors),
+        ("ни одно добавление не потеряно", all(
+            units[str(u)] == added.get(str(u), 0) for u in exact
+        )),
+        ("единиц в заказах и корзинах не больше добавленных", all(
+            units[u] <= added.get(u, 0) for u in units
+        )),
+        ("нет заказов без позиций", all(o.items for o in orders.values())),
+        ("нет пустых корзин и позиций с нулём", all(
+            c.items and all(line.count > 0 for line in c.items.values()) for c in carts.values()
+        ) and all(line.count > 0 for o in orders.values() for line in o.items.values())),
+        ("цены позиций совпадают с меню", all(
+            line.price == prices[item_id] for o in orders.values() for item_id, line in o.items.items()
+        )),
+        ("«Итого» у админа равно сумме позиций заказа", len(notices) == len(orders) and all(
+            notices.get(order_id) == order.total == sum(line.price * line.count for line in order.items.values())
+            for order_id, order in orders.items()
+        )),
+        ("заказы и корзины не делят словари позиций", len(set(item_dicts)) == len(item_dicts)),
+        ("индексы очереди и истории знают все заказы", all(
+            bot_module.order_index.status_of(order_id) is not None for order_id in orders
+        ) and sum(bot_module.history_index.count(str(u)) for u in user_ids) == len(orders)),
+        ("резервы остатков равны содержимому корзин", +inventory.reserved == +in_carts),
+        ("продано и зарезервировано не больше остатка", all(
+            sold[item_id] + in_carts[item_id] <= level and inventory.stock[item_id] == level - sold[item_id]
+            for item_id, level in limited.items()
+        )),
+        ("на диске то же, что в памяти", bot_module.store.load_stock() == inventory.stock and {
+            k: v.to_dict() for k, v in stored_orders.items()
+        } == {k: v.to_dict() for k, v in bot_module.orders.items()} and {
+            k: v.to_dict() for k, v in stored_carts.items()
+        } == {k: v.to_dict() for k, v in carts.items()}),
+    ]
+    return {
+        'checks': checks,
+        'errors': errors[:5],
+        'orders': len(orders),
+        'carts': len(carts),
+        'latencies': latencies,
+        'elapsed': elapsed,
+        'calls': sum(session.calls.values()),
+    }
+
+
+def cmd_stress(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = prepare_data_dir(tmp, 0)
+        os.environ.update(DATA_DIR=str(data_dir), ADMISSION_WORKERS=str(args.workers), STORE_BACKEND=args.store)
+        r = asyncio.run(_stress(args.users, args.updates, args.latency, args.seed, args.stock))
+
+    latencies = sorted(r['latencies'])
+    print(
+        f"Клиентов: {args.users}, апдейтов: {args.updates}, хранилище: {args.store}, "
+        f"воркеров: {args.workers or 'без ограничения'}"
+    )
+    print(f"Заказов: {r['orders']}, корзин: {r['carts']}, вызовов API: {r['calls']}")
+    print(
+        f"Пропускная способность: {args.updates / r['elapsed']:.0f} апд/с за {r['elapsed']:.2f} с, "
+        f"p50 {latencies[len(latencies) // 2] * 1000:.1f}мс, "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}мс"
+    )
+    for title, ok in r['checks']:
+        print(f"{'OK  ' if ok else 'FAIL'} {title}")
+    for message in r['errors']:
+        print(f"  ошибка: {message}")
+    if not all(ok for _, ok in r['checks']):
+        sys.exit(1)
+
+
+# ====================== RECOMMEND ======================
+
+def cmd_recommend(args):
+    import json_codec
+    import recommender
+    from models import load_orders
+    menu = json_codec.read_file(BASE_DIR / 'data' / 'menu.json')
+    orders = load_orders(synthetic_orders(menu, args.orders))
+    allowed = {item_id for items in menu.values() for item_id in items}
+    extra = list(load_orders(synthetic_orders(menu, args.adds, seed=7)).values())
+
+    backends = [False] + ([True] if recommender.np is not None else [])
+    results = {}
+    print(f"Заказов: {args.orders}, позиций в меню: {len(allowed)}, top_k: {args.top}")
+    print(f"{'движок':<8} {'построение':>11} {'новый заказ':>12} {'поиск':>9}")
+    for use_numpy in backends:
+        model = recommender.Recommender(top_k=args.top, use_numpy=use_numpy)
+        started = time.perf_counter()
+        model.rebuild(orders, allowed)
+        rebuild = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for order in extra:
+            model.add(order)
+        add = (time.perf_counter() - started) / len(extra)
+
+        item_ids = list(allowed) * 1000
+        started = time.perf_counter()
+        for item_id in item_ids:
+            model.suggest(item_id)
+        lookup = (time.perf_counter() - started) / len(item_ids)
+
+        name = 'numpy' if use_numpy else 'python'
+        results[name] = model.suggestions
+        print(f"{name:<8} {rebuild * 1000:>9.0f}мс {add * 1e6:>10.0f}мкс {lookup * 1e9:>7.0f}нс")
+
+    if recommender.np is None:
+        print("NumPy не установлен: считает только python")
+    else:
+        print(f"Рекомендации движков совпадают: {'да' if results['numpy'] == results['python'] else 'НЕТ'}")
+    # Пополнение даёт то же, что построение с нуля
+    merged = dict(orders, **{f"X{n:07d}": order for n, order in enumerate(extra)})
+    fresh = recommender.Recommender(top_k=args.top)
+    fresh.rebuild(merged, allowed)
+    print(f"Пополнение совпадает с перестроением: {'да' if fresh.suggestions == results[recommender.BACKEND_NAME] else 'НЕТ'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки бота кафе «Кацулька»")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('startup', help="время до первого апдейта с большим orders.json")
+    p.add_argument('--orders', type=int, default=100_000)
+    p.set_defaults(func=cmd_startup)
+
+    p = sub.add_parser('browse', help="вызовы API и трафик за сессию просмотра меню")
+    p.add_argument('--users', type=int, default=20)
+    p.set_defaults(func=cmd_browse)
+
+    p = sub.add_parser('flood', help="задержка админа и клиентов при наплыве нажатий")
+    p.add_argument('--users', type=int, default=500)
+    p.add_argument('--taps', type=int, default=3)
+    p.add_argument('--workers', type=int, default=32, help="ADMISSION_WORKERS, 0 — без ограничения")
+    p.add_argument('--latency', type=float, default=0.02, help="задержка заглушки Telegram, с")
+    p.set_defaults(func=cmd_flood)
+
+    p = sub.add_parser('memory', help="память на заказ: словари против models.py")
+    p.add_argument('--orders', type=int, default=100_000)
+    p.set_defaults(func=cmd_memory)
+
+    p = sub.add_parser('stress', help="наплыв добавлений, удалений и оформлений с проверкой инвариантов")
+    p.add_argument('--users', type=int, default=40)
+    p.add_argument('--updates', type=int, default=5000)
+    p.add_argument('--workers', type=int, default=32, help="ADMISSION_WORKERS, 0 — без ограничения")
+    p.add_argument('--latency', type=float, default=0.002, help="задержка заглушки Telegram, с")
+    p.add_argument('--store', choices=('json', 'sqlite'), default='json')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--stock', type=int, default=None, help="остаток первой позиции: проверка резервов и списаний")
+    p.set_defaults(func=cmd_stress)
+
+    p = sub.add_parser('recommend', help="построение рекомендаций «часто берут вместе»")
+    p.add_argument('--orders', type=int, default=100_000)
+    p.add_argument('--adds', type=int, default=1000, help="заказов для замера пополнения")
+    p.add_argument('--top', type=int, default=3)
+    p.set_defaults(func=cmd_recommend)
+
+    p = sub.add_parser('_startup_child')
+    p.set_defaults(func=lambda args: asyncio.run(_startup_child()))
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,19 @@
 import os
-import json
+import html
 import asyncio
-import random
-import string
 import logging
 import time
+import secrets
 from datetime import datetime
 from pathlib import Path
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import Bot, Dispatcher, BaseMiddleware, types, F
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.types import (
-    FSInputFile,
+    BufferedInputFile,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     KeyboardButton,
@@ -21,28 +21,61 @@ from aiogram.types import (
     ReplyKeyboardRemove
 )
 from aiogram.enums import ParseMode
-from aiogram.filters import Command, StateFilter
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject, StateFilter
 from dotenv import load_dotenv
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+import json_codec
+import metrics
+from stores import JsonStore, SqliteStore
+from photo_store import PhotoStore
+from navigation import Navigator
+from callback_ack import FastAckMiddleware
+from admission import AdmissionMiddleware
+from dedup import UpdateDeduplicator
+from recorder import UpdateRecorder
+from loop_watchdog import LoopWatchdog
+from events import EventBus
+import dashboard
+import catalog
+from scenarios import ScenarioEngine, CONFIRM_PREFIX as SCENARIO_CONFIRM_PREFIX
+from models import Cart, CartLine, Order
+from order_history import HistoryIndex, reorder_items
+from inventory import Inventory
+from recommender import Recommender, BACKEND_NAME as RECOMMENDER_BACKEND
+from order_queue import (
+    OrderIndex, can_move, NEW, COOKING, READY, DONE, CANCELLED,
+    STATUSES, OPEN_STATUSES, TRANSITIONS, NEXT_STATUS, STATUS_TITLES, STATUS_LABELS, ACTION_TITLES
 )
-logger = logging.getLogger(__name__)
+from resilient_session import ResilientSession, idempotent
+from menu_bulk import BundleError, import_bundle, build_export
+from broadcast import Broadcaster, format_report as format_broadcast_report
+from log_pipeline import setup_logging, log_user_id, log_route
 
 # Загрузка переменных окружения
 load_dotenv()
 
+# Настройка логирования: запись в очередь, вывод делает фоновый поток
+setup_logging()
+logger = logging.getLogger(__name__)
+
 # Настройки бота
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ADMIN_ID = int(os.getenv('ADMIN_ID'))
 
-bot = Bot(token=TOKEN)
+# Свой адрес Bot API: локальный сервер Bot API или заглушка для проверок
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+# Сессия с пулом keep-alive соединений и повторами после 429 и сетевых сбоев
+bot = Bot(
+    token=TOKEN,
+    session=ResilientSession.from_env(
+        **({'api': TelegramAPIServer.from_base(TELEGRAM_API_URL)} if TELEGRAM_API_URL else {})
+    )
+)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
-# Категории меню
+# Категории меню (CATEGORIES_FILE — свой набор для другого кафе, см. tenants.py)
 CATEGORIES = {
     "breakfast": "Завтрак 🍳",
     "lunchdinner": "Обед и ужин 🥘",
@@ -58,25 +91,36 @@ CATEGORIES = {
 # Специальные категории
 UNEDITABLE_CATEGORIES = ['outdoor', 'delivery', 'guests', 'compote', 'bichis', 'banquet']
 
+# {"categories": {id: название}, "uneditable": [id специальных категорий из scenarios.json]}
+CATEGORIES_FILE = os.getenv('CATEGORIES_FILE')
+if CATEGORIES_FILE:
+    categories_config = json_codec.read_file(CATEGORIES_FILE)
+    CATEGORIES = categories_config['categories']
+    UNEDITABLE_CATEGORIES = categories_config.get('uneditable', [])
+
 # Пути к файлам
 BASE_DIR = Path(__file__).parent
-DATA_DIR = BASE_DIR / 'data'
+DATA_DIR = Path(os.getenv('DATA_DIR', BASE_DIR / 'data'))
 PHOTOS_DIR = DATA_DIR / 'photos'
+# Компактная запись JSON (без отступов); DB_COMPACT=0 включает читаемый формат
+DB_COMPACT = os.getenv('DB_COMPACT', '1') != '0'
 
-# Генератор ID заказа
-def generate_order_id():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+# Хранилище: json — один процесс, sqlite — общая база для воркеров кластера (cluster.py).
+# У каждого воркера свои корзины и свой файл с ними.
+STORE_BACKEND = os.getenv('STORE_BACKEND', 'json')
+WORKER_ID = os.getenv('WORKER_ID')
+ACTIVE_ORDERS_FILE = f"active_orders.w{WORKER_ID}.json" if WORKER_ID else 'active_orders.json'
+DB_FILES = ('menu.json', 'orders.json', ACTIVE_ORDERS_FILE)
 
 # Инициализация папок
 def init_folders():
     try:
         os.makedirs(PHOTOS_DIR, exist_ok=True)
-        for file in ['menu.json', 'orders.json', 'active_orders.json']:
+        for file in DB_FILES:
             if not (DATA_DIR / file).exists():
-                with open(DATA_DIR / file, 'w') as f:
-                    json.dump({}, f)
+                json_codec.write_file(DATA_DIR / file, {}, DB_COMPACT)
     except Exception as e:
-        logger.error(f"Ошибка инициализации папок: {e}")
+        logger.error("Ошибка инициализации папок: %s", e)
 
 # Состояния
 class MenuStates(StatesGroup):
@@ -97,55 +141,464 @@ class AdminStates(StatesGroup):
     add_item_price = State()
     add_item_photo = State()
     delete_item = State()
+    bulk_import = State()
+
+# Хранилище данных
+def create_store():
+    if STORE_BACKEND == 'sqlite':
+        return SqliteStore(
+            DATA_DIR / 'shared.sqlite3', DATA_DIR,
+            compact=DB_COMPACT, active_file=ACTIVE_ORDERS_FILE
+        )
+    return JsonStore(DATA_DIR, compact=DB_COMPACT, active_file=ACTIVE_ORDERS_FILE)
 
-# Загрузка данных
-def load_db():
-    init_folders()
+store = create_store()
+
+# Сохранение данных; order_ids — заказы, изменённые этим вызовом
+def save_db(menu, orders, active_orders, order_ids=()):
     try:
-        with open(DATA_DIR / 'menu.json', 'r') as f:
-            menu = json.load(f)
-            for cat in CATEGORIES:
-                if cat not in menu:
-                    menu[cat] = {}
+        store.save(menu, orders, active_orders, order_ids)
     except Exception as e:
-        logger.error(f"Ошибка загрузки menu.json: {e}")
-        menu = {cat: {} for cat in CATEGORIES}
-    
+        logger.error("Ошибка сохранения данных: %s", e)
+
+# Заказ мог создать другой воркер: ищем в общем хранилище
+def find_order(order_id):
+    if order_id not in orders:
+        order = store.fetch_order(order_id)
+        if order is None:
+            return None
+        orders[order_id] = order
+    return orders[order_id]
+
+# Подписчики на изменение меню: получают множество изменившихся категорий
+# и сбрасывают всё, что из них построено (клавиатуры, индексы, кэши фото)
+menu_listeners = []
+
+def on_menu_change(listener):
+    menu_listeners.append(listener)
+    return listener
+
+def notify_menu_changed(categories):
+    if not categories:
+        return
+    for listener in menu_listeners:
+        try:
+            listener(set(categories))
+        except Exception as e:
+            logger.error("Ошибка сброса кэша меню в %s: %s", listener.__name__, e)
+
+def apply_menu(new_menu):
+    # Подмена без await между шагами, поэтому хендлеры видят либо старое, либо новое меню
+    for cat in CATEGORIES:
+        new_menu.setdefault(cat, {})
+    changed = {cat for cat in set(menu) | set(new_menu) if menu.get(cat) != new_menu.get(cat)}
+    for cat in changed:
+        if cat in new_menu:
+            menu[cat] = new_menu[cat]
+        else:
+            del menu[cat]
+    notify_menu_changed(changed)
+    return changed
+
+# Данные заполняются в startup_pipeline(); сами объекты не подменяются,
+# поэтому ссылки на них из других модулей остаются валидными
+menu, orders, active_orders = {}, {}, {}
+
+# Реестр пользователей, писавших боту: user_id -> профиль
+users = {}
+
+# События для панели администратора: новые заказы, смена статусов, корзины, заявки
+events = EventBus()
+
+def register_user(user: types.User):
+    user_id = str(user.id)
+    profile = {
+        'username': user.username,
+        'full_name': user.full_name,
+        'first_seen': users.get(user_id, {}).get('first_seen') or datetime.now().isoformat()
+    }
+    # Пишем только новых пользователей и смену имени, а не каждый /start
+    if users.get(user_id) == profile:
+        return
+    users[user_id] = profile
     try:
-        with open(DATA_DIR / 'orders.json', 'r') as f:
-            orders = json.load(f)
+        store.save_user(users, user_id)
     except Exception as e:
-        logger.error(f"Ошибка загрузки orders.json: {e}")
-        orders = {}
-    
+        logger.error("Ошибка сохранения пользователя: %s", e)
+
+# ====================== ФОТО ======================
+
+photo_store = PhotoStore(PHOTOS_DIR)
+# Экран пользователя редактируется на месте; текстовые экраны поверх фото показываются на обложке
+navigator = Navigator(bot, photo_store, cover=os.getenv('NAV_COVER_PHOTO', 'bonapetit.jpg') or None)
+PHOTO_GC_INTERVAL = float(os.getenv('PHOTO_GC_INTERVAL', '21600'))
+
+@on_menu_change
+def rebuild_photo_refs(categories):
+    photo_store.rebuild_refs(menu)
+
+async def photo_maintenance():
+    while True:
+        try:
+            # Ссылки на фото — из текущего меню: в кластере его мог поменять
+            # другой воркер, пока в этот не приходили апдейты
+            if store.name == 'sqlite' and await asyncio.to_thread(store.menu_changed):
+                await reload_shared_menu()
+            removed = await asyncio.to_thread(photo_store.gc)
+            await asyncio.to_thread(photo_store.save_index)
+            if removed:
+                logger.info("Удалено фото без ссылок: %d", removed)
+        except Exception as e:
+            logger.error("Ошибка очистки фото: %s", e)
+        await asyncio.sleep(PHOTO_GC_INTERVAL)
+
+# ====================== ОСТАТКИ ======================
+
+# Остатки позиций считаются в памяти (inventory.py): порции резервируются при
+# добавлении в корзину, возвращаются при удалении и истечении корзины и
+# списываются при оформлении. На диск — раз в STOCK_FLUSH_INTERVAL секунд
+STOCK_FLUSH_INTERVAL = float(os.getenv('STOCK_FLUSH_INTERVAL', '5'))
+
+def stock_changed(item_id):
+    # Закончившаяся позиция сразу пропадает из клавиатуры категории, вернувшаяся — появляется
+    cat_id = item_categories.get(item_id)
+    if cat_id is not None:
+        category_keyboards.pop(cat_id, None)
+        rebuild_catalog({cat_id})
+    metrics.inc('stock_changes_total', state='sold_out' if inventory.sold_out(item_id) else 'available')
+
+inventory = Inventory(on_change=stock_changed)
+
+async def flush_stock():
+    # В кластере пишем и без своих изменений: заодно узнаём продажи других воркеров
+    if not inventory.dirty and store.name == 'json':
+        return
+    stock, levels, sold = inventory.take()
     try:
-        with open(DATA_DIR / 'active_orders.json', 'r') as f:
-            active_orders = json.load(f)
-    except Exception as e:
-        logger.error(f"Ошибка загрузки active_orders.json: {e}")
-        active_orders = {}
-    
-    return menu, orders, active_orders
+        saved = await asyncio.to_thread(store.save_stock, stock, levels, sold)
+    except Exception:
+        inventory.restore(levels, sold)
+        raise
+    inventory.apply(saved)
+
+async def stock_flusher():
+    while True:
+        await asyncio.sleep(STOCK_FLUSH_INTERVAL)
+        try:
+            await flush_stock()
+        except Exception as e:
+            logger.error("Ошибка сохранения остатков: %s", e)
+
+# ====================== КОРЗИНЫ ======================
+
+# active_orders хранится в порядке последнего изменения: изменённая корзина
+# переезжает в конец словаря, поэтому самые давно не тронутые — в начале
+CART_TTL = float(os.getenv('CART_TTL_HOURS', '72')) * 3600
+CART_MAX = int(os.getenv('CART_MAX', '10000'))
+CART_SWEEP_INTERVAL = float(os.getenv('CART_SWEEP_INTERVAL', '300'))
+
+def cart_last_modified(cart):
+    stamp = cart.updated_at or cart.created_at
+    try:
+        return datetime.fromisoformat(stamp).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+def touch_cart(user_id):
+    cart = active_orders.pop(user_id, None)
+    now = datetime.now().isoformat()
+    if cart is None:
+        cart = Cart(items={}, created_at=now)
+    cart.updated_at = now
+    active_orders[user_id] = cart
+    enforce_cart_limit()
+    return cart
+
+def evict_cart(user_id, reason):
+    cart = active_orders.pop(user_id, None)
+    if cart is not None:
+        inventory.release_cart(cart)
+        metrics.inc('carts_evicted_total', reason=reason)
+        publish_cart(user_id)
+    return cart
+
+def cart_event(user_id, cart):
+    return {
+        'user_id': user_id,
+        'items': [[line.name, line.count] for line in cart.items.values()] if cart else [],
+        'total': cart.total if cart else 0,
+        'updated_at': cart.updated_at if cart else None,
+    }
 
-# Сохранение данных
-def save_db(menu, orders, active_orders):
+def publish_cart(user_id):
+    # Корзины, которой больше нет, в событии нет позиций
+    events.publish('cart', cart_event(user_id, active_orders.get(user_id)))
+
+def enforce_cart_limit():
+    evicted = 0
+    while len(active_orders) > CART_MAX:
+        evict_cart(next(iter(active_orders)), 'lru')
+        evicted += 1
+    return evicted
+
+def sweep_carts(now=None):
+    now = now or time.time()
+    evicted = 0
+    for user_id, cart in list(active_orders.items()):
+        if not cart.items:
+            evict_cart(user_id, 'empty')
+            evicted += 1
+        elif now - cart_last_modified(cart) > CART_TTL:
+            evict_cart(user_id, 'ttl')
+            evicted += 1
+    evicted += enforce_cart_limit()
+    metrics.set_gauge('carts_live', len(active_orders))
+    return evicted
+
+async def cart_sweeper():
+    while True:
+        await asyncio.sleep(CART_SWEEP_INTERVAL)
+        try:
+            evicted = sweep_carts()
+            if evicted:
+                save_db(menu, orders, active_orders)
+                logger.info("Удалено устаревших корзин: %d", evicted)
+        except Exception as e:
+            logger.error("Ошибка очистки корзин: %s", e)
+
+# ====================== ГОРЯЧАЯ ПЕРЕЗАГРУЗКА МЕНЮ ======================
+
+# menu.json можно править снаружи (скрипты наполнения): бот замечает новую
+# версию по mtime/размеру и подменяет только изменившиеся категории
+MENU_WATCH_INTERVAL = float(os.getenv('MENU_WATCH_INTERVAL', '2'))
+
+def menu_file_signature():
     try:
-        with open(DATA_DIR / 'menu.json', 'w') as f:
-            json.dump(menu, f, indent=2)
-        with open(DATA_DIR / 'orders.json', 'w') as f:
-            json.dump(orders, f, indent=2)
-        with open(DATA_DIR / 'active_orders.json', 'w') as f:
-            json.dump(active_orders, f, indent=2)
-    except Exception as e:
-        logger.error(f"Ошибка сохранения данных: {e}")
+        stat = (DATA_DIR / 'menu.json').stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def validate_menu(data):
+    if not isinstance(data, dict):
+        raise ValueError("меню должно быть объектом")
+    for cat_id, items in data.items():
+        if not isinstance(items, dict):
+            raise ValueError(f"категория {cat_id} должна быть объектом")
+        for item_id, item in items.items():
+            if not isinstance(item, dict) or 'name' not in item or not isinstance(item.get('price'), int):
+                raise ValueError(f"позиция {cat_id}/{item_id} без названия или цены")
+    return data
+
+async def menu_watcher():
+    signature = await asyncio.to_thread(menu_file_signature)
+    while True:
+        await asyncio.sleep(MENU_WATCH_INTERVAL)
+        if store.name == 'sqlite':
+            # Воркер с фоновыми задачами (чистка фото, каталог) держит меню свежим
+            # и без апдейтов
+            try:
+                if await asyncio.to_thread(store.menu_changed):
+                    await reload_shared_menu()
+            except Exception as e:
+                logger.error("Ошибка чтения меню из общего хранилища: %s", e)
+        current = await asyncio.to_thread(menu_file_signature)
+        # Файл, который бот записал сам, перечитывать незачем
+        if current is None or current in (signature, store.menu_signature):
+            signature = current or signature
+            continue
+        signature = current
+        try:
+            # Разбор файла вне цикла событий
+            new_menu = await asyncio.to_thread(
+                lambda: validate_menu(json_codec.read_file(DATA_DIR / 'menu.json'))
+            )
+        except Exception as e:
+            # Файл могли поймать на середине записи: дождёмся следующего изменения
+            logger.error("menu.json не применён: %s", e)
+            continue
+
+        changed = apply_menu(new_menu)
+        store.remember_menu(menu, current)
+        if changed:
+            logger.info("menu.json перечитан, изменены категории: %s", sorted(changed))
+            if store.name == 'sqlite':
+                # В кластере изменения расходятся по остальным воркерам через общее хранилище
+                save_db(menu, orders, active_orders)
+
+async def startup_pipeline():
+    timings = {}
+    started = phase = time.perf_counter()
+
+    def mark(name):
+        nonlocal phase
+        now = time.perf_counter()
+        timings[name] = round((now - phase) * 1000, 1)
+        phase = now
+
+    await asyncio.to_thread(init_folders)
+    mark('init_folders')
+
+    # Файлы разбираются в пуле потоков, цикл событий не блокируется
+    loaded_menu, loaded_orders, loaded_active = await asyncio.to_thread(store.load)
+    mark('load_files')
+
+    apply_menu(loaded_menu)
+    orders.clear()
+    orders.update(loaded_orders)
+    active_orders.clear()
+    # Восстанавливаем порядок LRU: от давно не менявшихся корзин к свежим
+    active_orders.update(sorted(loaded_active.items(), key=lambda kv: cart_last_modified(kv[1])))
+    # Резервы — из корзин; до очистки, чтобы удалённые корзины вернули свои порции
+    inventory.load(await asyncio.to_thread(store.load_stock), active_orders)
+    sweep_carts()
+    mark('apply')
+
+    order_index.rebuild(orders)
+    history_index.rebuild(orders)
+    mark('order_index')
+
+    await asyncio.to_thread(recommender.rebuild, orders, item_categories)
+    mark('recommender')
+
+    users.clear()
+    users.update(await asyncio.to_thread(store.load_users))
+    mark('load_users')
+
+    await asyncio.to_thread(scenarios.load)
+    mark('scenarios')
+
+    await asyncio.to_thread(dedup.load)
+    mark('dedup')
+
+    await asyncio.to_thread(photo_store.load_index)
+    # В кластере старые фото переносит фронт до запуска воркеров (cluster.migrate_store)
+    if WORKER_ID is None:
+        migrated = await asyncio.to_thread(photo_store.migrate_legacy, menu)
+        if migrated:
+            save_db(menu, orders, active_orders)
+            notify_menu_changed(migrated)
+    mark('photos')
+
+    timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(
+        "Данные загружены (%s, %s, рекомендации %s): заказов %d, корзин %d, тайминги мс %s",
+        store.name, json_codec.CODEC_NAME, RECOMMENDER_BACKEND, len(orders), len(active_orders), timings
+    )
+    return timings
 
-menu, orders, active_orders = load_db()
+# ====================== МИДЛВАРИ ======================
+
+# Сторож цикла событий: лаг в метриках, остановки дольше LOOP_LAG_THRESHOLD
+# секунд пишутся в лог со стеком и хендлером. LOOP_WATCHDOG=0 выключает
+LOOP_WATCHDOG = os.getenv('LOOP_WATCHDOG', '1') != '0'
+loop_watchdog = LoopWatchdog(
+    interval=float(os.getenv('LOOP_WATCHDOG_INTERVAL', '0.1')),
+    threshold=float(os.getenv('LOOP_LAG_THRESHOLD', '0.25'))
+)
+
+class LogContextMiddleware(BaseMiddleware):
+    # Проставляет user_id и имя хендлера в контекст логов и пишет время обработки
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        route = handler_object.callback.__name__ if handler_object else type(event).__name__
+        user = getattr(event, 'from_user', None)
+
+        user_token = log_user_id.set(user.id if user else None)
+        route_token = log_route.set(route)
+        loop_watchdog.enter(route=route, user_id=user.id if user else None)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            loop_watchdog.leave()
+            logger.info(
+                "Апдейт обработан",
+                extra={'latency_ms': round((time.perf_counter() - started) * 1000, 2)}
+            )
+            log_route.reset(route_token)
+            log_user_id.reset(user_token)
+
+async def reload_shared_menu():
+    new_menu, version = await asyncio.to_thread(store.load_menu)
+    apply_menu(new_menu)
+    logger.info("Меню перечитано из общего хранилища, версия %s", version)
+
+class SharedMenuMiddleware(BaseMiddleware):
+    # В режиме кластера меню меняет админ в своём воркере; остальные видят новую
+    # версию в общем хранилище и перечитывают меню перед обработкой апдейта
+    async def __call__(self, handler, event, data):
+        if store.menu_changed():
+            await reload_shared_menu()
+        return await handler(event, data)
+
+# Ответ на нажатие кнопки уходит не позже CALLBACK_ACK_DEADLINE секунд, даже если хендлер занят
+CALLBACK_ACK_DEADLINE = float(os.getenv('CALLBACK_ACK_DEADLINE', '0.3'))
+fast_ack = FastAckMiddleware(CALLBACK_ACK_DEADLINE)
+
+# Не больше ADMISSION_WORKERS хендлеров одновременно и не больше ADMISSION_QUEUE
+# апдейтов в ожидании; админ идёт вне очереди, повторные перерисовки экранов
+# при глубокой очереди отбрасываются
+ADMISSION_WORKERS = int(os.getenv('ADMISSION_WORKERS', '32'))
+ADMISSION_QUEUE = int(os.getenv('ADMISSION_QUEUE', '1000'))
+admission = AdmissionMiddleware(
+    workers=ADMISSION_WORKERS,
+    shed_depth=int(os.getenv('ADMISSION_SHED_DEPTH', '200')),
+    admin_ids=(ADMIN_ID,),
+    sheddable=('categories', 'my_order'),
+    sheddable_prefixes=('history_',)
+)
+
+# Повторы апдейтов (тот же update_id или повторное нажатие «оформить»/«сменить
+# статус» на той же версии сообщения) отсекаются раньше всего остального.
+# DEDUP_PERSIST=1 сохраняет недавние ключи в файл, чтобы пережить перезапуск
+DEDUP_TTL = float(os.getenv('DEDUP_TTL', '600'))
+DEDUP_FLUSH_INTERVAL = float(os.getenv('DEDUP_FLUSH_INTERVAL', '5'))
+DEDUP_FILE = f"seen_updates.w{WORKER_ID}.json" if WORKER_ID else 'seen_updates.json'
+dedup = UpdateDeduplicator(
+    ttl=DEDUP_TTL,
+    max_size=int(os.getenv('DEDUP_MAX', '50000')),
+    once_callbacks=('final_confirm',),
+    once_prefixes=('order_', 'q_bulk_', 'announce_', SCENARIO_CONFIRM_PREFIX),
+    path=DATA_DIR / DEDUP_FILE if os.getenv('DEDUP_PERSIST', '0') != '0' else None
+)
+
+async def dedup_flusher():
+    while True:
+        await asyncio.sleep(DEDUP_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(dedup.save)
+        except Exception as e:
+            logger.error("Ошибка сохранения ключей повторов: %s", e)
+
+# Запись входящих апдейтов для replay.py: RECORD_DIR=recordings включает.
+# Пишется всё, что пришло от Telegram, включая повторы, поэтому мидлварь первая
+RECORD_DIR = os.getenv('RECORD_DIR')
+recorder = UpdateRecorder(
+    RECORD_DIR,
+    max_bytes=int(os.getenv('RECORD_MAX_MB', '16')) * 2 ** 20,
+    keep=int(os.getenv('RECORD_KEEP', '20')),
+    salt=os.getenv('RECORD_SALT') or None,
+    admin_ids=(ADMIN_ID,)
+) if RECORD_DIR else None
+
+if recorder is not None:
+    dp.update.outer_middleware(recorder)
+dp.update.outer_middleware(dedup)
+# Дедлайн ответа на нажатие идёт и пока апдейт ждёт в очереди допуска
+dp.update.outer_middleware(fast_ack.arm)
+dp.update.outer_middleware(admission)
+dp.update.outer_middleware(SharedMenuMiddleware())
+dp.message.middleware(LogContextMiddleware())
+dp.callback_query.middleware(LogContextMiddleware())
+dp.callback_query.middleware(fast_ack)
 
 # ====================== ОСНОВНЫЕ ХЕНДЛЕРЫ ======================
 
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
     await state.clear()
+    register_user(message.from_user)
     if message.from_user.id == ADMIN_ID:
         await admin_panel(message, state)
     else:
@@ -167,8 +620,113 @@ async def show_user_menu(message: types.Message):
         text="🍽 Меню",
         callback_data="categories"
     ))
+    builder.add(types.InlineKeyboardButton(
+        text="📜 Мои заказы",
+        callback_data="history_0"
+    ))
     
-    await message.answer(welcome_text, reply_markup=builder.as_markup())
+    await navigator.show(message, welcome_text, reply_markup=builder.as_markup())
+    if WEBAPP_URL:
+        await message.answer("🛍 Всё меню с фото — в каталоге, кнопка внизу экрана", reply_markup=catalog_keyboard)
+
+# ====================== КАТАЛОГ (WEB APP) ======================
+
+# Меню статической страницей для Telegram Web App: листание без запросов к боту,
+# корзина собирается в браузере и приходит одним web_app_data.
+# WEBAPP_URL — публичный https-адрес каталога (прокси на CATALOG_PORT или сама
+# папка CATALOG_DIR за веб-сервером); без него каталог не собирается.
+WEBAPP_URL = os.getenv('WEBAPP_URL')
+CATALOG_DIR = Path(os.getenv('CATALOG_DIR', DATA_DIR / 'catalog'))
+CATALOG_PORT = int(os.getenv('CATALOG_PORT', '0'))
+CATALOG_HOST = os.getenv('CATALOG_HOST', '127.0.0.1')
+# Пауза перед пересборкой: серия правок админа собирается один раз
+CATALOG_DEBOUNCE = float(os.getenv('CATALOG_DEBOUNCE', '1'))
+CATALOG_LINE_MAX = 50
+
+catalog_builder = catalog.CatalogBuilder(
+    CATALOG_DIR, PHOTOS_DIR,
+    thumb_size=int(os.getenv('CATALOG_THUMB', '320')),
+    skip=UNEDITABLE_CATEGORIES
+)
+catalog_app = catalog.build_app(CATALOG_DIR)
+catalog_runner = None
+catalog_task = None
+
+# web_app_data приходит только от кнопки обычной клавиатуры, у inline-кнопки его нет
+catalog_keyboard = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="🛍 Каталог", web_app=types.WebAppInfo(url=WEBAPP_URL))]],
+    resize_keyboard=True,
+    is_persistent=True
+) if WEBAPP_URL else None
+
+@on_menu_change
+def rebuild_catalog(categories):
+    global catalog_task
+    # В кластере папку каталога пишет один воркер
+    if not WEBAPP_URL or WORKER_ID not in (None, '0'):
+        return
+    catalog_builder.invalidate(categories)
+    if catalog_task is None or catalog_task.done():
+        catalog_task = start_background(catalog_rebuilder())
+
+async def catalog_rebuilder():
+    # Правки, пришедшие во время сборки, подхватываются следующим кругом
+    while catalog_builder.dirty:
+        await asyncio.sleep(CATALOG_DEBOUNCE)
+        changed = catalog_builder.take(menu, hidden=inventory.sold_out)
+        started = time.perf_counter()
+        try:
+            result = await asyncio.to_thread(catalog_builder.build, changed, CATEGORIES)
+        except Exception as e:
+            logger.error("Ошибка сборки каталога: %s", e)
+            catalog_builder.invalidate(changed)
+            return
+        metrics.observe('catalog_build_seconds', time.perf_counter() - started)
+        logger.info(
+            "Каталог пересобран: категорий %d, новых миниатюр %d, удалено %d",
+            result['sections'], result['thumbs'], result['removed']
+        )
+
+@dp.message(F.web_app_data)
+async def catalog_order(message: types.Message):
+    user_id = str(message.from_user.id)
+    cart, lines, sold_out, missing = None, [], [], 0
+    for cat_id, item_id, count in catalog.parse_batch(message.web_app_data.data, CATALOG_LINE_MAX):
+        # Цена и название — из меню, а не со страницы
+        item = menu.get(cat_id, {}).get(item_id)
+        if item is None:
+            missing += 1
+            continue
+        reserved = inventory.reserve(item_id, count)
+        if not reserved:
+            sold_out.append(item['name'])
+            continue
+        if cart is None:
+            cart = touch_cart(user_id)
+        if item_id not in cart.items:
+            cart.items[item_id] = CartLine.from_menu(cat_id, item, reserved)
+        else:
+            cart.items[item_id].count += reserved
+        lines.append(f"▪ {item['name']} ×{reserved}" + (" — всё, что осталось" if reserved < count else ""))
+
+    if cart is None:
+        if sold_out:
+            await message.answer("😔 Закончилось: " + ", ".join(sold_out))
+        else:
+            await message.answer("❌ Этих позиций уже нет в меню, откройте каталог заново")
+        return
+    save_db(menu, orders, active_orders)
+    publish_cart(user_id)
+    metrics.inc('catalog_batches_total')
+
+    text = "✅ Добавлено в заказ:\n" + "\n".join(lines)
+    if sold_out:
+        text += "\n\n😔 Закончилось: " + ", ".join(sold_out)
+    if missing:
+        text += f"\n\nНе найдено в меню: {missing} (каталог обновился)"
+    builder = InlineKeyboardBuilder()
+    builder.row(types.InlineKeyboardButton(text="🛒 Мой заказ", callback_data="my_order"))
+    await navigator.show(message, text, reply_markup=builder.as_markup())
 
 # ====================== ПОЛЬЗОВАТЕЛЬСКИЙ ФУНКЦИОНАЛ ======================
 
@@ -193,36 +751,39 @@ async def show_categories(call: types.CallbackQuery):
     
     builder.adjust(2)  # Размещаем категории по 2 в ряд
     
-    try:
-        await call.message.edit_text(
-            "🍽 Выберите категорию:",
-            reply_markup=builder.as_markup()
-        )
-    except Exception:
-        await call.message.answer(
-            "🍽 Выберите категорию:",
-            reply_markup=builder.as_markup()
-        )
+    await navigator.show(call, "🍽 Выберите категорию:", reply_markup=builder.as_markup())
 
 @dp.callback_query(F.data.startswith('category_'))
-async def show_category_items(call: types.CallbackQuery):
-    await call.answer()
+async def show_category_items(call: types.CallbackQuery, state: FSMContext):
     try:
         cat_id = call.data.split('_')[1]
         
         if cat_id in UNEDITABLE_CATEGORIES:
-            await handle_special_category(call, cat_id)
+            await scenarios.run(call, state)
             return
             
         cat_name = CATEGORIES[cat_id]
-        category_menu = menu.get(cat_id, {})
         
-        if not category_menu:
+        if not menu.get(cat_id):
             await call.answer("В этой категории пока нет позиций")
             return
         
+        await navigator.show(call, f"🍽 {cat_name}:", reply_markup=category_markup(cat_id))
+        
+    except Exception as e:
+        logger.error("Ошибка показа категории: %s", e)
+        await call.message.answer("❌ Ошибка загрузки категории")
+
+# Клавиатуры категорий строятся один раз и сбрасываются при изменении меню
+category_keyboards = {}
+
+def category_markup(cat_id):
+    markup = category_keyboards.get(cat_id)
+    if markup is None:
         builder = InlineKeyboardBuilder()
-        for item_id, item in category_menu.items():
+        for item_id, item in menu.get(cat_id, {}).items():
+            if inventory.sold_out(item_id):
+                continue
             builder.add(types.InlineKeyboardButton(
                 text=item['name'],
                 callback_data=f"item_{cat_id}_{item_id}"
@@ -239,425 +800,35 @@ async def show_category_items(call: types.CallbackQuery):
                 callback_data="my_order"
             )
         )
-        
-        await call.message.edit_text(
-            f"🍽 {cat_name}:",
-            reply_markup=builder.as_markup()
-        )
-        
-    except Exception as e:
-        logger.error(f"Ошибка показа категории: {e}")
-        await call.message.answer("❌ Ошибка загрузки категории")
-
-async def handle_special_category(call: types.CallbackQuery, category: str):
-    try:
-        if category == 'outdoor':
-            text = (
-                "Дорогой дневник!\n"
-                "Мне не описать эту боль….да кого я обманываю?\n"
-                "Едем!\n"
-                "Я пока меняю фартук на наряд, ты подыскивай место 😍\n"
-                "Оплата: комплимент от шеф-повара - 1 страстный поцелуй и любое желание hot 🔥🔞"
-            )
-            photo_path = str(PHOTOS_DIR / 'outdoor.jpg')
-    
-            builder = InlineKeyboardBuilder()
-            builder.add(types.InlineKeyboardButton(
-                text="⬅️ Назад",
-                callback_data="categories"
-            ))
-    
-    # Отправляем сообщение пользователю
-            await call.message.answer_photo(
-                FSInputFile(photo_path),
-                caption=text,
-                reply_markup=builder.as_markup()
-            )
-    
-    # Уведомление админу с кнопкой
-            if ADMIN_ID:
-                admin_builder = InlineKeyboardBuilder()
-                admin_builder.add(types.InlineKeyboardButton(
-                    text="🟢 Погнали!",
-                    callback_data=f"outdoor_confirm_{call.from_user.id}"
-                ))
-        
-                await bot.send_message(
-                    ADMIN_ID,
-                    f"🍽 Кто-то хочет по ресторанам!\n",
-                    reply_markup=admin_builder.as_markup()
-                )
-
-            
-        elif category == 'delivery':
-            text = (
-                "Ммм, несмотря на то, что вы решили дать отдохнуть заМУРРРчательному повару, "
-                "Вы все равно любимая жопа 😏"
-            )
-            
-            builder = InlineKeyboardBuilder()
-            builder.add(types.InlineKeyboardButton(
-                text="Продолжить",
-                callback_data="delivery_continue"
-            ))
-            
-            await call.message.answer(text, reply_markup=builder.as_markup())
-            
-        elif category == 'guests':
-            text = "Дорогой Любимка, ты решил наебать систему 😈"
-            
-            builder = InlineKeyboardBuilder()
-            builder.add(types.InlineKeyboardButton(
-                text="Продолжить",
-                callback_data="guests_continue"
-            ))
-            
-            await call.message.answer(text, reply_markup=builder.as_markup())
-            
-        elif category == 'compote':
-            text = (
-                "Давай нахуяримся!\n"
-                "Выбирай настоичную или бар и погнали в ебета 🚀"
-            )
-            photo_path = str(PHOTOS_DIR / 'compote.jpg')
-            
-            builder = InlineKeyboardBuilder()
-            builder.add(types.InlineKeyboardButton(
-                text="Продолжить",
-                callback_data="compote_continue"
-            ))
-            
-            await call.message.answer_photo(
-                FSInputFile(photo_path),
-                caption=text,
-                reply_markup=builder.as_markup()
-            )
-            
-        elif category == 'bichis':
-            text = "Ну что, сладкий мой, по дошику или шавухе?😵‍💫"
-            
-            builder = InlineKeyboardBuilder()
-            builder.add(types.InlineKeyboardButton(
-                text="Шавуха",
-                callback_data="bichis_shawarma"
-            ))
-            builder.add(types.InlineKeyboardButton(
-                text="Дошик",
-                callback_data="bichis_doshik"
-            ))
-            
-            await call.message.answer(text, reply_markup=builder.as_markup())
-            
-        elif category == 'banquet':
-            text = "Отлично, любимый, готовимся к приему гостей😈"
-            
-            builder = InlineKeyboardBuilder()
-            builder.add(types.InlineKeyboardButton(
-                text="Далее",
-                callback_data="banquet_continue"
-            ))
-            
-            await call.message.answer(text, reply_markup=builder.as_markup())
-        
-    except Exception as e:
-        logger.error(f"Ошибка обработки специальной категории: {e}")
-        await call.message.answer("❌ Ошибка загрузки категории")
-
-@dp.callback_query(F.data == "delivery_continue")
-async def delivery_continue_handler(call: types.CallbackQuery):
-    try:
-        # Отправляем первую картинку с вопросом
-        photo_path = str(PHOTOS_DIR / 'delivery.jpg')
-        
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            types.InlineKeyboardButton(text="🟡", callback_data="delivery_yellow"),
-            types.InlineKeyboardButton(text="🟢", callback_data="delivery_green")
-        )
-        
-        await call.message.answer_photo(
-            FSInputFile(photo_path),
-            caption="Как думаете, кто победит в этой схватке?",
-            reply_markup=builder.as_markup()
-        )
-        
-    except Exception as e:
-        logger.error(f"Ошибка в delivery_continue: {e}")
-        await call.answer("❌ Ошибка загрузки, попробуйте позже")
+        markup = category_keyboards[cat_id] = builder.as_markup()
+    return markup
 
-@dp.callback_query(F.data.startswith("delivery_") & ~F.data.startswith("delivery_confirm_"))
-async def delivery_final(call: types.CallbackQuery):
-    try:
-        # Отправляем финальную картинку пользователю
-        await call.message.answer_photo(
-            FSInputFile(PHOTOS_DIR / 'nedoljno.jpg'),
-            caption="Оплата: комплимент от шеф-повара - 10 чмоков и минетик 👄🔞",
-            reply_markup=InlineKeyboardBuilder()
-                .button(text="🍽 В меню", callback_data="categories")
-                .as_markup()
-        )
-        
-        # Уведомление админу с кнопкой
-        if ADMIN_ID:
-            builder = InlineKeyboardBuilder()
-            builder.add(types.InlineKeyboardButton(
-                text="🟢 Отлично!",
-                callback_data=f"delivery_confirm_{call.from_user.id}"
-            ))
-            
-            await bot.send_message(
-                ADMIN_ID,
-                f"🚚 Кто-то хочет доставку!\n",
-                reply_markup=builder.as_markup()
-            )
-            
-    except Exception as e:
-        logger.error(f"Ошибка в delivery_final: {e}")
-        await call.answer("❌ Ошибка загрузки")
+@on_menu_change
+def reset_category_keyboards(categories):
+    for cat_id in categories:
+        category_keyboards.pop(cat_id, None)
 
-@dp.callback_query(F.data == "guests_continue")
-async def guests_continue_handler(call: types.CallbackQuery):
-    try:
-        # Уведомление админу (отправляется сразу)
-        if ADMIN_ID:
-            await bot.send_message(
-                ADMIN_ID,
-                f"🍕 Кто-то хочет в гостях пожрать!\n"
-                f"User: @{call.from_user.username or call.from_user.full_name}"
-            )
+# ====================== СПЕЦИАЛЬНЫЕ КАТЕГОРИИ ======================
 
-        # Остальная логика для пользователя
-        await call.message.answer_photo(
-            FSInputFile(PHOTOS_DIR / 'guests.jpg'),
-            caption="Любой из друзей, кого ты выберешь"
-        )
-        
-        await asyncio.sleep(3)
-        msg = await call.message.answer_photo(
-            FSInputFile(PHOTOS_DIR / 'guests_reality.jpg'),
-            caption="Поэтому будет так"
-        )
-        
-        await asyncio.sleep(3)
-        await msg.reply(
-            "Так что, хитрожопый кот, возвращайся в меню 🥲\n"
-            "Оплата: 100 рублей по номеру телефона 🤣🖕🏻",
-            reply_markup=InlineKeyboardBuilder()
-                .button(text="🍽 В меню", callback_data="categories")
-                .as_markup()
-        )
-        
-    except Exception as e:
-        logger.error(f"Ошибка в guests_continue: {e}")
-        await call.answer("❌ Ошибка загрузки")
+class ScenarioStates(StatesGroup):
+    waiting_input = State()
 
-@dp.callback_query(F.data == "compote_continue")
-async def compote_handler(call: types.CallbackQuery):
-    try:
-        # Удаляем кнопку "Продолжить" редактированием сообщения
-        await call.message.edit_reply_markup(reply_markup=None)
-        
-        # Ждем 4 секунды
-        await asyncio.sleep(2)
-        
-        # Отправляем картинку пользователю
-        await call.message.answer_photo(
-            FSInputFile(PHOTOS_DIR / 'nubla.jpg'),
-            caption="Оплата: громкий протяженный крик «Ну бляяяя!» 🫨",
-            reply_markup=InlineKeyboardBuilder()
-                .button(text="🍽 В меню", callback_data="categories")
-                .as_markup()
-        )
-        
-        # Уведомление админу с кнопкой
-        if ADMIN_ID:
-            builder = InlineKeyboardBuilder()
-            builder.add(types.InlineKeyboardButton(
-                text="🍻 Давай нахуяримся!",
-                callback_data=f"compote_confirm_{call.from_user.id}"
-            ))
-            
-            await bot.send_message(
-                ADMIN_ID,
-                f"🌳 Кто-то хочет в дрова!\n",
-                reply_markup=builder.as_markup()
-            )
-            
-    except Exception as e:
-        logger.error(f"Ошибка в compote_handler: {e}")
-        await call.answer("❌ Что-то пошло не так...")
-
-@dp.callback_query(F.data == "bichis_shawarma")
-async def shawarma_handler(call: types.CallbackQuery):
-    try:
-        # Отправляем шаурму пользователю
-        await call.message.answer_photo(
-            FSInputFile(PHOTOS_DIR / 'shawarma.jpg'),
-            caption="Че смотришь? Одевайся, идём за шавухой.\nОплата: 1 обнимашка 🤗",
-            reply_markup=InlineKeyboardBuilder()
-                .button(text="🍽 В меню", callback_data="categories")
-                .as_markup()
-        )
-        
-        # Уведомление админу
-        if ADMIN_ID:
-            user = call.from_user
-            await bot.send_message(
-                ADMIN_ID,
-                "🥙 Кто-то хочет шавуху!"
-            )
-            
-    except Exception as e:
-        logger.error(f"Ошибка в shawarma_handler: {e}")
-        await call.answer("❌ Шаурма закончилась...")
+# Сценарии специальных категорий (тексты, фото, кнопки, уведомления) лежат в scenarios.json
+scenarios = ScenarioEngine(
+    Path(os.getenv('SCENARIOS_FILE', BASE_DIR / 'scenarios.json')),
+    navigator, bot, ADMIN_ID, ScenarioStates.waiting_input, events=events
+)
 
-@dp.callback_query(F.data == "bichis_shawarma")
-async def shawarma_handler(call: types.CallbackQuery):
-    try:
-        # Отправляем шаурму пользователю
-        await call.message.answer_photo(
-            FSInputFile(PHOTOS_DIR / 'shawarma.jpg'),
-            caption="Че смотришь? Одевайся, идём за шавухой.\nОплата: 1 обнимашка 🤗",
-            reply_markup=InlineKeyboardBuilder()
-                .button(text="🍽 В меню", callback_data="categories")
-                .as_markup()
-        )
-        
-        # Уведомление админу с кнопкой
-        if ADMIN_ID:
-            builder = InlineKeyboardBuilder()
-            builder.add(types.InlineKeyboardButton(
-                text="🟢 Сифооооон!",
-                callback_data=f"bichis_confirm_{call.from_user.id}_shawarma"
-            ))
-            
-            await bot.send_message(
-                ADMIN_ID,
-                f"🥙 Кто-то хочет шавуху!\n",
-                reply_markup=builder.as_markup()
-            )
-            
-    except Exception as e:
-        logger.error(f"Ошибка в shawarma_handler: {e}")
-        await call.answer("❌ Шаурма закончилась...")
+@dp.callback_query(F.data.func(scenarios.handles))
+async def scenario_step(call: types.CallbackQuery, state: FSMContext):
+    await scenarios.run(call, state)
 
-@dp.callback_query(F.data == "bichis_doshik")
-async def doshik_handler(call: types.CallbackQuery):
-    try:
-        # Отправляем дошик пользователю
-        await call.message.answer_photo(
-            FSInputFile(PHOTOS_DIR / 'doshik.jpg'),
-            caption="Оплата: 1 обнимашка 🤗",
-            reply_markup=InlineKeyboardBuilder()
-                .button(text="🍽 В меню", callback_data="categories")
-                .as_markup()
-        )
-        
-        # Уведомление админу с кнопкой
-        if ADMIN_ID:
-            builder = InlineKeyboardBuilder()
-            builder.add(types.InlineKeyboardButton(
-                text="🟢 Сифооооон!",
-                callback_data=f"bichis_confirm_{call.from_user.id}_doshik"
-            ))
-            
-            await bot.send_message(
-                ADMIN_ID,
-                f"🍜 Кто-то хочет дошик!\n",
-                reply_markup=builder.as_markup()
-            )
-            
-    except Exception as e:
-        logger.error(f"Ошибка в doshik_handler: {e}")
-        await call.answer("❌ Дошик разлили...")
-
-class BanquetStates(StatesGroup):
-    waiting_for_guests = State()
-    waiting_for_level = State()
-
-@dp.callback_query(F.data == "banquet_continue")
-async def start_banquet(call: types.CallbackQuery, state: FSMContext):
-    await call.message.answer(
-        "Чтобы я могла накормить гостей, напиши, пожалуйста, количество гостей:",
-        reply_markup=ReplyKeyboardRemove()
-    )
-    await state.set_state(BanquetStates.waiting_for_guests)
-
-@dp.message(BanquetStates.waiting_for_guests)
-async def process_guests_count(message: types.Message, state: FSMContext):
-    if not message.text.isdigit():
-        await message.answer("Пожалуйста, введите число:")
-        return
-    
-    await state.update_data(guests_count=int(message.text))
-    
-    # Создаем inline-клавиатуру
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        types.InlineKeyboardButton(
-            text="Можно и по дошику",
-            callback_data="banquet_level_doshik"
-        ),
-        types.InlineKeyboardButton(
-            text="Норм по домашнему",
-            callback_data="banquet_level_home"
-        )
-    )
-    builder.row(
-        types.InlineKeyboardButton(
-            text="Тяжелый люкс",
-            callback_data="banquet_level_lux"
-        )
-    )
-    
-    await message.answer(
-        "Выберите уровень сложности готовки:",
-        reply_markup=builder.as_markup()
-    )
-    await state.set_state(BanquetStates.waiting_for_level)
-
-@dp.callback_query(F.data.startswith("banquet_level_"), BanquetStates.waiting_for_level)
-async def process_level(call: types.CallbackQuery, state: FSMContext):
-    level_mapping = {
-        "banquet_level_doshik": "Можно и по дошику",
-        "banquet_level_home": "Норм по домашнему",
-        "banquet_level_lux": "Тяжелый люкс"
-    }
-    
-    level = level_mapping.get(call.data)
-    if not level:
-        await call.answer("Неизвестный уровень сложности")
-        return
-    
-    data = await state.get_data()
-    guests_count = data['guests_count']
-    
-    # Редактируем сообщение с кнопками, убирая их
-    await call.message.edit_reply_markup(reply_markup=None)
-    
-    # Отправляем результат
-    await call.message.answer_photo(
-        FSInputFile(PHOTOS_DIR / 'banquet.jpg'),
-        caption=f"Банкет на {guests_count} гостей!\nУровень: {level}",
-        reply_markup=InlineKeyboardBuilder()
-            .button(text="🍽 В меню", callback_data="categories")
-            .as_markup()
-    )
-    
-    # Уведомление админу
-    if ADMIN_ID:
-        await bot.send_message(
-            ADMIN_ID,
-            f"🎉 Ахтунг! Банкет!\n\n"
-            f"👥 Гостей: {guests_count}\n"
-            f"⚡ Уровень: {level}"
-        )
-    
-    await state.clear()
+@dp.message(ScenarioStates.waiting_input)
+async def scenario_input(message: types.Message, state: FSMContext):
+    await scenarios.receive(message, state)
 
 @dp.callback_query(F.data.startswith('item_'))
 async def show_item_details(call: types.CallbackQuery):
-    await call.answer()
     try:
         _, cat_id, item_id = call.data.split('_', 2)
         full_item_id = f"item_{item_id}" if not item_id.startswith('item_') else item_id
@@ -673,6 +844,9 @@ async def show_item_details(call: types.CallbackQuery):
 <i>{item['desc']}</i>
 Цена: {item['price']} 💋
         """
+        available = inventory.available(full_item_id)
+        if available is not None:
+            text += "😔 Закончилось\n" if available == 0 else f"Осталось: {available} шт.\n"
         
         builder = InlineKeyboardBuilder()
         builder.row(
@@ -685,26 +859,20 @@ async def show_item_details(call: types.CallbackQuery):
                 callback_data="categories" 
             )
         )
+        # «С этим часто берут»: соседи посчитаны заранее, здесь только поиск по словарю
+        for button in suggestion_buttons(full_item_id):
+            builder.row(button)
         
-        if item.get('photo'):
-            photo_path = PHOTOS_DIR / item['photo']
-            if photo_path.exists():
-                await call.message.answer_photo(
-                    FSInputFile(photo_path),
-                    caption=text,
-                    reply_markup=builder.as_markup(),
-                    parse_mode=ParseMode.HTML
-                )
-                return
-        
-        await call.message.answer(
+        await navigator.show(
+            call,
             text,
             reply_markup=builder.as_markup(),
+            photo=item.get('photo'),
             parse_mode=ParseMode.HTML
         )
         
     except Exception as e:
-        logger.error(f"Ошибка показа товара: {e}")
+        logger.error("Ошибка показа товара: %s", e)
         await call.answer("❌ Не удалось загрузить информацию о товаре", show_alert=True)
 
 @dp.callback_query(F.data.startswith("add_"))
@@ -732,44 +900,46 @@ async def add_to_order(call: types.CallbackQuery):
         item_data = menu[cat_id][item_id]
         user_id = str(call.from_user.id)
 
+        # Проверка и резерв порции — без await между ними
+        if not inventory.reserve(item_id):
+            metrics.inc('stock_rejected_total')
+            await call.answer(f"😔 {item_data['name']} закончилось", show_alert=True)
+            return
+
         # Инициализируем заказ
-        if user_id not in active_orders:
-            active_orders[user_id] = {'items': {}, 'created_at': datetime.now().isoformat()}
+        cart = touch_cart(user_id)
 
         # Добавляем товар
-        if item_id not in active_orders[user_id]['items']:
-            active_orders[user_id]['items'][item_id] = {
-                'name': item_data['name'],
-                'price': item_data['price'],
-                'count': 1
-            }
+        if item_id not in cart.items:
+            cart.items[item_id] = CartLine.from_menu(cat_id, item_data)
         else:
-            active_orders[user_id]['items'][item_id]['count'] += 1
+            cart.items[item_id].count += 1
 
         save_db(menu, orders, active_orders)
+        publish_cart(user_id)
         # await call.answer(f"✅ {item_data['name']} добавлен в заказ!")
         await call.answer(f"✅ {item_data['name']} добавлен в заказ!", show_alert=True)
 
     except Exception as e:
-        logger.error(f"Ошибка добавления: {str(e)}", exc_info=True)
+        logger.error("Ошибка добавления: %s", e, exc_info=True)
         await call.answer("❌ Ошибка сервера", show_alert=True)
 
 @dp.callback_query(F.data == "my_order")
 async def show_my_order(call: types.CallbackQuery, state: FSMContext = None):
     user_id = str(call.from_user.id)
     
-    if user_id not in active_orders or not active_orders[user_id]['items']:
-        await call.message.edit_text("🛒 Ваш заказ пуст!")
+    if user_id not in active_orders or not active_orders[user_id].items:
+        await navigator.show(call, "🛒 Ваш заказ пуст!")
         return
     
     order = active_orders[user_id]
     total = 0
     items_text = []
     
-    for item_id, item in order['items'].items():
-        item_total = item['count'] * item['price']
+    for item_id, item in order.items.items():
+        item_total = item.total
         total += item_total
-        items_text.append(f"▪ {item['name']} ×{item['count']} = {item_total}💋")
+        items_text.append(f"▪ {item.name} ×{item.count} = {item_total}💋")
     
     text = "🛒 *Ваш заказ:*\n\n" + "\n".join(items_text) + f"\n\n*Итого:* {total}💋"
     
@@ -801,18 +971,7 @@ async def show_my_order(call: types.CallbackQuery, state: FSMContext = None):
         )
     )
     
-    try:
-        await call.message.edit_text(
-            text,
-            reply_markup=builder.as_markup(),
-            parse_mode="Markdown"
-        )
-    except Exception:
-        await call.message.answer(
-            text,
-            reply_markup=builder.as_markup(),
-            parse_mode="Markdown"
-        )
+    await navigator.show(call, text, reply_markup=builder.as_markup(), parse_mode="Markdown")
 
 @dp.callback_query(F.data == "clear_cart")
 async def clear_cart_handler(call: types.CallbackQuery):
@@ -820,9 +979,10 @@ async def clear_cart_handler(call: types.CallbackQuery):
     
     if user_id in active_orders:
         # Сохраняем копию для сообщения
-        items_count = len(active_orders[user_id]['items'])
-        active_orders[user_id]['items'] = {}  # Очищаем корзину
+        items_count = len(active_orders[user_id].items)
+        inventory.release_cart(active_orders.pop(user_id))  # Пустую корзину не храним
         save_db(menu, orders, active_orders)
+        publish_cart(user_id)
         
         await call.answer(f"🗑 Удалено {items_count} позиций!")
         
@@ -836,7 +996,7 @@ async def confirm_order_handler(call: types.CallbackQuery):
     user_id = str(call.from_user.id)
     
     # Проверяем, есть ли активный заказ
-    if user_id not in active_orders or not active_orders[user_id]['items']:
+    if user_id not in active_orders or not active_orders[user_id].items:
         await call.answer("❌ Ваш заказ пуст!", show_alert=True)
         return
     
@@ -846,10 +1006,10 @@ async def confirm_order_handler(call: types.CallbackQuery):
     order_text = "🍽 *Ваш заказ:*\n\n"
     total = 0
     
-    for item_id, item in order['items'].items():
-        item_total = item['count'] * item['price']
+    for item_id, item in order.items.items():
+        item_total = item.total
         total += item_total
-        order_text += f"▪ {item['name']} ×{item['count']} = {item_total} 💋\n"
+        order_text += f"▪ {item.name} ×{item.count} = {item_total} 💋\n"
     
     order_text += f"\n*Итого:* {total} 💋"
     
@@ -866,11 +1026,7 @@ async def confirm_order_handler(call: types.CallbackQuery):
         )
     )
     
-    await call.message.edit_text(
-        order_text,
-        reply_markup=builder.as_markup(),
-        parse_mode="Markdown"
-    )
+    await navigator.show(call, order_text, reply_markup=builder.as_markup(), parse_mode="Markdown")
 
 @dp.callback_query(F.data == "final_confirm")
 async def final_confirmation(call: types.CallbackQuery):
@@ -885,67 +1041,66 @@ async def final_confirmation(call: types.CallbackQuery):
     order_text = "🍽 *Ваш заказ:*\n\n"
     total = 0
     
-    for item_id, item in order['items'].items():
-        item_total = item['count'] * item['price']
+    for item_id, item in order.items.items():
+        item_total = item.total
         total += item_total
-        order_text += f"▪ {item['name']} ×{item['count']} = {item_total} 💋\n"
+        order_text += f"▪ {item.name} ×{item.count} = {item_total} 💋\n"
     
     order_text += f"\n*Итого:* {total} 💋"
-    order_id = generate_order_id()
+    order_id = store.allocate_order_id(orders)
     
     # Сохраняем заказ
-    orders[order_id] = {
-        'user_id': user_id,
-        'items': order['items'],
-        'created_at': datetime.now().isoformat(),
-        'status': 'new'
-    }
+    orders[order_id] = Order(
+        items=order.items,
+        created_at=datetime.now().isoformat(),
+        user_id=user_id,
+        status=NEW
+    )
+    order_index.add(order_id, orders[order_id])
+    history_index.add(order_id, orders[order_id])
+    recommender.add(orders[order_id])
+    inventory.commit_cart(order)
     active_orders.pop(user_id)
-    save_db(menu, orders, active_orders)
-    
-    # Путь к картинке
-    photo_path = PHOTOS_DIR / 'bonapetit.jpg'
-    
-    # Уведомление пользователю с картинкой
-    await call.message.delete()  # Удаляем предыдущее сообщение с кнопками
-    await call.message.answer_photo(
-        FSInputFile(photo_path),
-        caption="💝 *Заказ оформлен!*\n\n" +
-               order_text +
-               "\n\nШеф-повар уже бежит на кухню...",
+    save_db(menu, orders, active_orders, order_ids=(order_id,))
+    publish_order(order_id)
+    publish_cart(user_id)
+    
+    # Уведомление пользователю с картинкой на месте экрана с кнопками
+    await navigator.show(
+        call,
+        "💝 *Заказ оформлен!*\n\n" +
+        order_text +
+        "\n\nШеф-повар уже бежит на кухню...",
+        photo='bonapetit.jpg',
         parse_mode="Markdown"
     )
     
-    # Уведомление админу с кнопкой
+    # Уведомление админу с кнопками статусов
     if ADMIN_ID:
-        builder = InlineKeyboardBuilder()
-        builder.add(types.InlineKeyboardButton(
-            text="✅ Готово",
-            callback_data=f"order_done_{order_id}"
-        ))
-        
-        await bot.send_message(
-            ADMIN_ID,
-            f"📦 *Новый заказ от Любимки*\n" +
-            order_text,
-            parse_mode="Markdown",
-            reply_markup=builder.as_markup()
-        )
+        # Дубль уведомления лучше потерянного заказа: отправку можно повторять
+        with idempotent():
+            await bot.send_message(
+                ADMIN_ID,
+                f"📦 *Новый заказ от Любимки*\n" +
+                order_text,
+                parse_mode="Markdown",
+                reply_markup=order_status_keyboard(order_id, NEW)
+            )
 
 @dp.callback_query(F.data == "edit_order")
 async def edit_order_handler(call: types.CallbackQuery):
     user_id = str(call.from_user.id)
     
-    if user_id not in active_orders or not active_orders[user_id]['items']:
+    if user_id not in active_orders or not active_orders[user_id].items:
         await call.answer("❌ Заказ пуст!", show_alert=True)
         return
     
     builder = InlineKeyboardBuilder()
     
     # Формируем кнопки для удаления позиций
-    for item_id, item in active_orders[user_id]['items'].items():
+    for item_id, item in active_orders[user_id].items.items():
         builder.add(types.InlineKeyboardButton(
-            text=f"❌ Удалить {item['name']} (×{item['count']})",
+            text=f"❌ Удалить {item.name} (×{item.count})",
             callback_data=f"remove_{item_id}"  # Важно: передаём полный item_id
         ))
     
@@ -957,7 +1112,8 @@ async def edit_order_handler(call: types.CallbackQuery):
         )
     )
     
-    await call.message.edit_text(
+    await navigator.show(
+        call,
         "✏️ *Редактирование заказа:*\nВыберите позицию для удаления:",
         reply_markup=builder.as_markup(),
         parse_mode="Markdown"
@@ -972,20 +1128,153 @@ async def remove_item_handler(call: types.CallbackQuery, state: FSMContext):
         await call.answer("❌ Заказ не найден!", show_alert=True)
         return
     
-    if full_item_id not in active_orders[user_id]['items']:
+    if full_item_id not in active_orders[user_id].items:
         await call.answer("❌ Позиция не найдена в заказе!", show_alert=True)
         return
     
     # Удаляем позицию
-    item_name = active_orders[user_id]['items'][full_item_id]['name']
-    del active_orders[user_id]['items'][full_item_id]
+    cart = touch_cart(user_id)
+    item_name = cart.items[full_item_id].name
+    inventory.release(full_item_id, cart.items.pop(full_item_id).count)
+    if not cart.items:
+        active_orders.pop(user_id)
     save_db(menu, orders, active_orders)
+    publish_cart(user_id)
     
     await call.answer(f"❌ {item_name} удалён из заказа!")
     
     # Возвращаемся к просмотру заказа с передачей state
     await show_my_order(call, state)
 
+# ====================== ИСТОРИЯ ЗАКАЗОВ ======================
+
+# Заказы каждого пользователя, заполняется в startup_pipeline()
+history_index = HistoryIndex()
+
+HISTORY_PAGE = 5
+
+# item_id -> категория: в позициях корзины категория не хранится
+item_categories = {}
+
+@on_menu_change
+def rebuild_item_categories(categories):
+    item_categories.clear()
+    item_categories.update({item_id: cat_id for cat_id, items in menu.items() for item_id in items})
+
+# ====================== РЕКОМЕНДАЦИИ ======================
+
+# «Часто берут вместе» по истории заказов; строится в startup_pipeline(),
+# пополняется в final_confirmation
+RECOMMEND_TOP = int(os.getenv('RECOMMEND_TOP', '3'))
+recommender = Recommender(top_k=RECOMMEND_TOP)
+
+@on_menu_change
+def refresh_recommendations(categories):
+    recommender.set_allowed(item_categories)
+
+def suggestion_buttons(item_id):
+    buttons = []
+    for other_id in recommender.suggest(item_id):
+        cat_id = item_categories.get(other_id)
+        item = menu.get(cat_id, {}).get(other_id)
+        if item is not None and not inventory.sold_out(other_id):
+            buttons.append(types.InlineKeyboardButton(
+                text=f"✨ {item['name']} — {item['price']} 💋",
+                callback_data=f"item_{cat_id}_{other_id}"
+            ))
+    return buttons
+
+def history_screen(user_id, page):
+    total = history_index.count(user_id)
+    pages = max(1, -(-total // HISTORY_PAGE))
+    page = min(max(page, 0), pages - 1)
+    builder = InlineKeyboardBuilder()
+    if not total:
+        text = "📜 Вы ещё ничего не заказывали"
+    else:
+        blocks = []
+        for order_id in history_index.page(user_id, page, HISTORY_PAGE):
+            order = orders[order_id]
+            created = datetime.fromisoformat(order.created_at)
+            blocks.append(
+                f"*{created:%d.%m %H:%M}* · {STATUS_LABELS.get(order.status or NEW, '')}\n" +
+                order_items_text(order) +
+                f"\nИтого: {order.total} 💋"
+            )
+            builder.row(types.InlineKeyboardButton(
+                text=f"🔁 Повторить {created:%d.%m %H:%M}",
+                callback_data=f"reorder_{order_id}"
+            ))
+        text = f"📜 *Ваши заказы* ({page + 1}/{pages})\n\n" + "\n\n".join(blocks)
+    navigation = []
+    if page > 0:
+        navigation.append(types.InlineKeyboardButton(text="⬅️ Новее", callback_data=f"history_{page - 1}"))
+    if page < pages - 1:
+        navigation.append(types.InlineKeyboardButton(text="Старее ➡️", callback_data=f"history_{page + 1}"))
+    if navigation:
+        builder.row(*navigation)
+    builder.row(types.InlineKeyboardButton(text="🍽 В меню", callback_data="categories"))
+    return text, builder.as_markup()
+
+@dp.message(Command("history"))
+async def cmd_history(message: types.Message):
+    text, markup = history_screen(str(message.from_user.id), 0)
+    await navigator.show(message, text, reply_markup=markup, parse_mode="Markdown")
+
+@dp.callback_query(F.data.startswith("history_"))
+async def history_handler(call: types.CallbackQuery):
+    page = call.data[len("history_"):]
+    text, markup = history_screen(str(call.from_user.id), int(page) if page.isdigit() else 0)
+    await navigator.show(call, text, reply_markup=markup, parse_mode="Markdown")
+
+@dp.callback_query(F.data.startswith("reorder_"))
+async def reorder_handler(call: types.CallbackQuery, state: FSMContext):
+    user_id = str(call.from_user.id)
+    order = orders.get(call.data[len("reorder_"):])
+    if order is None or str(order.user_id) != user_id:
+        await call.answer("❌ Заказ не найден!", show_alert=True)
+        return
+
+    items, missing = reorder_items(order, menu, item_categories)
+    if not items:
+        await call.answer("😔 Этих блюд больше нет в меню", show_alert=True)
+        return
+
+    # Корзина собирается целиком по текущим ценам и заменяет прежнюю;
+    # чего не хватает на кухне, кладётся сколько осталось. Порции прежней
+    # корзины освободятся при замене, поэтому тоже считаются доступными
+    cart = active_orders.get(user_id)
+    held = {item_id: line.count for item_id, line in cart.items.items()} if cart else {}
+    sold_out = []
+    for item_id, line in list(items.items()):
+        available = inventory.available(item_id)
+        if available is not None:
+            line.count = min(line.count, available + held.get(item_id, 0))
+        if line.count <= 0:
+            sold_out.append(line.name)
+            del items[item_id]
+    if not items:
+        # Прежняя корзина остаётся как была
+        await call.answer("😔 Ничего из этого заказа сейчас нет", show_alert=True)
+        return
+
+    cart = touch_cart(user_id)
+    inventory.release_cart(cart)
+    for item_id, line in items.items():
+        inventory.reserve(item_id, line.count)
+    cart.items = items
+    save_db(menu, orders, active_orders)
+    publish_cart(user_id)
+
+    notes = []
+    if missing:
+        notes.append("Больше нет в меню: " + ", ".join(missing))
+    if sold_out:
+        notes.append("Закончилось: " + ", ".join(sold_out))
+    if notes:
+        await call.answer("\n".join(notes), show_alert=True)
+    await show_my_order(call, state)
+
 
 # ====================== АДМИН ПАНЕЛЬ (без изменений) ======================
 
@@ -993,7 +1282,8 @@ async def admin_panel(message: types.Message, state: FSMContext):
     await state.clear()
     kb = [
         [KeyboardButton(text="➕ Добавить позицию")],
-        [KeyboardButton(text="🗑 Удалить позицию")]
+        [KeyboardButton(text="🗑 Удалить позицию")],
+        [KeyboardButton(text="📦 Импорт меню"), KeyboardButton(text="📤 Экспорт меню")]
     ]
     markup = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
     await message.answer("👑 Админ-панель", reply_markup=markup)
@@ -1013,7 +1303,6 @@ async def admin_add_item(message: types.Message, state: FSMContext):
 
 @dp.callback_query(F.data.startswith("admin_add_to_"))
 async def process_add_category(call: types.CallbackQuery, state: FSMContext):
-    await call.answer()
     try:
         cat_id = call.data.replace("admin_add_to_", "")
         
@@ -1029,7 +1318,7 @@ async def process_add_category(call: types.CallbackQuery, state: FSMContext):
         await state.set_state(AdminStates.add_item_name)
         
     except Exception as e:
-        logger.error(f"Ошибка выбора категории: {e}")
+        logger.error("Ошибка выбора категории: %s", e)
         await call.message.answer("❌ Произошла ошибка при выборе категории")
         await state.clear()
 
@@ -1078,14 +1367,15 @@ async def process_item_photo_with_photo(message: types.Message, state: FSMContex
         cat_id = data['category']
         item_id = f"item_{int(time.time())}"
         
+        # Повторно загруженную картинку не скачиваем: её file_unique_id уже в индексе
         photo = message.photo[-1]
-        file = await bot.get_file(photo.file_id)
-        
-        ext = file.file_path.split('.')[-1] if '.' in file.file_path else 'jpg'
-        photo_name = f"{cat_id}_{item_id}.{ext}"
-        photo_path = PHOTOS_DIR / photo_name
-        
-        await bot.download_file(file.file_path, photo_path)
+        photo_name = photo_store.lookup_unique(photo.file_unique_id)
+        if photo_name is None:
+            buffer = await bot.download(photo.file_id)
+            photo_name, _ = await asyncio.to_thread(
+                photo_store.put_bytes, buffer.getvalue(), 'jpg', photo.file_unique_id
+            )
+        photo_store.remember(photo_name, message)
         
         menu[cat_id][item_id] = {
             'name': data['name'],
@@ -1094,16 +1384,18 @@ async def process_item_photo_with_photo(message: types.Message, state: FSMContex
             'photo': photo_name
         }
         save_db(menu, orders, active_orders)
+        notify_menu_changed({cat_id})
         
         await message.answer_photo(
             photo.file_id,
             caption=f"✅ {data['name']} добавлено!\nЦена: {data['price']} 💋",
             reply_markup=ReplyKeyboardRemove()
         )
+        await offer_announcement(message, cat_id, item_id)
         await admin_panel(message, state)
         
     except Exception as e:
-        logger.error(f"Ошибка обработки фото: {e}")
+        logger.error("Ошибка обработки фото: %s", e)
         await message.answer(f"❌ Ошибка: {str(e)}")
         await admin_panel(message, state)
 
@@ -1121,15 +1413,17 @@ async def process_item_photo_without_photo(message: types.Message, state: FSMCon
             'photo': None
         }
         save_db(menu, orders, active_orders)
+        notify_menu_changed({cat_id})
         
         await message.answer(
             f"✅ {data['name']} добавлено без фото!\nЦена: {data['price']} 💋",
             reply_markup=ReplyKeyboardRemove()
         )
+        await offer_announcement(message, cat_id, item_id)
         await admin_panel(message, state)
         
     except Exception as e:
-        logger.error(f"Ошибка добавления позиции: {e}")
+        logger.error("Ошибка добавления позиции: %s", e)
         await message.answer(f"❌ Ошибка: {str(e)}")
         await admin_panel(message, state)
 
@@ -1162,13 +1456,12 @@ async def admin_delete_item(message: types.Message, state: FSMContext):
         await state.set_state(AdminStates.delete_item)
     
     except Exception as e:
-        logger.error(f"Ошибка: {e}")
+        logger.error("Ошибка: %s", e)
         await message.answer(f"❌ Ошибка: {str(e)}")
         await admin_panel(message, state)
 
 @dp.callback_query(F.data.startswith("delete_item_"), AdminStates.delete_item)
 async def process_delete_item(call: types.CallbackQuery, state: FSMContext):
-    await call.answer()
     try:
         parts = call.data.split('_')
         if len(parts) < 4:
@@ -1182,26 +1475,88 @@ async def process_delete_item(call: types.CallbackQuery, state: FSMContext):
             return
             
         item_name = menu[cat_id][item_id]['name']
-        
-        if menu[cat_id][item_id].get('photo'):
-            photo_path = PHOTOS_DIR / menu[cat_id][item_id]['photo']
-            try:
-                if photo_path.exists():
-                    photo_path.unlink()
-            except Exception as e:
-                logger.error(f"Ошибка удаления фото: {e}")
+        photo_name = menu[cat_id][item_id].get('photo')
         
         del menu[cat_id][item_id]
         save_db(menu, orders, active_orders)
+        notify_menu_changed({cat_id})
+        
+        # Файл удаляется, только если на него не ссылаются другие позиции
+        try:
+            await asyncio.to_thread(photo_store.release, photo_name)
+        except Exception as e:
+            logger.error("Ошибка удаления фото: %s", e)
         
         await call.message.answer(f"✅ Позиция '{item_name}' удалена")
         await admin_panel(call.message, state)
         
     except Exception as e:
-        logger.error(f"Ошибка удаления: {e}")
+        logger.error("Ошибка удаления: %s", e)
         await call.message.answer(f"❌ Ошибка: {str(e)}")
         await admin_panel(call.message, state)
 
+@dp.message(F.text == "📦 Импорт меню", MenuStates.admin_panel)
+async def admin_bulk_import(message: types.Message, state: FSMContext):
+    await message.answer(
+        "Отправьте ZIP-архив документом: manifest.json или manifest.csv "
+        "(category, name, desc, price, photo, id) и фотографии.\n"
+        "Формат удобно взять из «📤 Экспорт меню».",
+        reply_markup=ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="❌ Отмена")]], resize_keyboard=True)
+    )
+    await state.set_state(AdminStates.bulk_import)
+
+@dp.message(AdminStates.bulk_import, F.document)
+async def process_bulk_import(message: types.Message, state: FSMContext):
+    try:
+        buffer = await bot.download(message.document)
+        editable = [cat for cat in CATEGORIES if cat not in UNEDITABLE_CATEGORIES]
+        mode, staged = await import_bundle(buffer.getvalue(), menu, editable, photo_store)
+    except BundleError as e:
+        shown = "\n".join(f"▪ {error}" for error in e.errors[:10])
+        more = f"\n…и ещё {len(e.errors) - 10}" if len(e.errors) > 10 else ""
+        await message.answer(f"❌ Архив не принят:\n{shown}{more}")
+        return
+    except Exception as e:
+        logger.error("Ошибка импорта меню: %s", e, exc_info=True)
+        await message.answer(f"❌ Ошибка: {str(e)}")
+        await admin_panel(message, state)
+        return
+
+    # Вся пачка применяется к меню и сохраняется одним коммитом
+    stale_photos = []
+    added = updated = 0
+    for cat_id, items in staged.items():
+        if mode == 'replace':
+            stale_photos += [
+                old['photo'] for item_id, old in menu[cat_id].items()
+                if old.get('photo') and item_id not in items
+            ]
+            menu[cat_id] = {}
+        for item_id, item in items.items():
+            old = menu[cat_id].get(item_id)
+            if old is None:
+                added += 1
+            else:
+                updated += 1
+                if old.get('photo') and old['photo'] != item['photo']:
+                    stale_photos.append(old['photo'])
+            menu[cat_id][item_id] = item
+    save_db(menu, orders, active_orders)
+    notify_menu_changed(set(staged))
+
+    await asyncio.to_thread(lambda: [photo_store.release(name) for name in stale_photos])
+    await message.answer(f"✅ Меню обновлено: добавлено {added}, изменено {updated}")
+    await admin_panel(message, state)
+
+@dp.message(F.text == "📤 Экспорт меню", MenuStates.admin_panel)
+async def admin_bulk_export(message: types.Message):
+    editable = [cat for cat in CATEGORIES if cat not in UNEDITABLE_CATEGORIES]
+    data, count = await asyncio.to_thread(build_export, menu, editable, PHOTOS_DIR)
+    await message.answer_document(
+        BufferedInputFile(data, filename=f"menu_{datetime.now():%Y%m%d_%H%M}.zip"),
+        caption=f"📤 Позиций в меню: {count}"
+    )
+
 @dp.message(F.text == "❌ Отмена", StateFilter("*"))
 async def cancel_handler(message: types.Message, state: FSMContext):
     await state.clear()
@@ -1210,147 +1565,505 @@ async def cancel_handler(message: types.Message, state: FSMContext):
     else:
         await show_user_menu(message)
 
-@dp.callback_query(F.data.startswith("order_done_"))
-async def mark_order_done(call: types.CallbackQuery):
-    order_id = call.data.split('_')[2]
-    
-    if order_id not in orders:
-        await call.answer("❌ Заказ не найден!", show_alert=True)
+# Одна кнопка подтверждения у админа для всех сценариев
+@dp.callback_query(F.data.func(ScenarioEngine.is_confirm))
+async def scenario_confirm(call: types.CallbackQuery):
+    await scenarios.confirm(call)
+
+@dp.message(Command("metrics"), F.from_user.id == ADMIN_ID)
+async def cmd_metrics(message: types.Message):
+    await message.answer(f"📈 Метрики:\n<pre>{metrics.render()}</pre>", parse_mode=ParseMode.HTML)
+
+@dp.message(Command("health"), F.from_user.id == ADMIN_ID)
+async def cmd_health(message: types.Message):
+    report = loop_watchdog.report()
+    lag = report['lag_ms']
+    lines = [
+        "🩺 <b>Состояние бота</b>",
+        "",
+        f"Лаг цикла событий: p50 {lag.get(0.5, 0)} мс, p90 {lag.get(0.9, 0)} мс, "
+        f"p99 {lag.get(0.99, 0)} мс, максимум {report['max_lag_ms']} мс",
+        f"Остановок дольше {loop_watchdog.threshold * 1000:.0f} мс: {report['stalls']}",
+    ]
+    stall = report['last_stall']
+    if stall:
+        lines.append(f"Последняя: {stall['at']}, {stall['lag_ms']} мс, {html.escape(stall['where'])}")
+        lines.append(f"<code>{html.escape(stall['call'] or stall['innermost'])}</code>")
+    lines += [
+        "",
+        f"Задач в цикле: {len(asyncio.all_tasks())}, в очереди апдейтов: {len(admission.waiting)}",
+        f"Заказов: {len(orders)}, корзин: {len(active_orders)}",
+        f"Хранилище: {store.name}, JSON: {json_codec.CODEC_NAME}, рекомендации: {RECOMMENDER_BACKEND}",
+    ]
+    if not LOOP_WATCHDOG:
+        lines.insert(2, "⚠️ Сторож цикла выключен (LOOP_WATCHDOG=0)")
+    await message.answer("\n".join(lines), parse_mode=ParseMode.HTML)
+
+@dp.message(Command("stock"), F.from_user.id == ADMIN_ID)
+async def cmd_stock(message: types.Message, command: CommandObject):
+    # /stock — остатки; /stock позиция 5 — задать; /stock позиция - — без ограничения.
+    # Позиция — item_id или название
+    args = (command.args or '').rsplit(maxsplit=1)
+    if len(args) < 2:
+        lines = [
+            f"<code>{item_id}</code> {html.escape(item['name'])}: {inventory.stock[item_id]}"
+            f" (в корзинах {inventory.reserved[item_id]})"
+            for items in menu.values() for item_id, item in items.items()
+            if inventory.tracked(item_id)
+        ]
+        await message.answer(
+            ("📦 <b>Остатки</b>\n" + "\n".join(lines) if lines else "📦 Остатки не заданы: все позиции без ограничений") +
+            "\n\n/stock позиция 5 — задать, /stock позиция - — снять ограничение",
+            parse_mode=ParseMode.HTML
+        )
         return
-    
-    # Обновляем статус заказа
-    orders[order_id]['status'] = 'done'
-    orders[order_id]['completed_at'] = datetime.now().isoformat()
-    save_db(menu, orders, active_orders)
-    
-    # Уведомляем пользователя
-    user_id = orders[order_id]['user_id']
-    order_items = orders[order_id]['items']
-    
-    items_text = "\n".join(
-        f"▪ {item['name']} ×{item['count']}" 
-        for item in order_items.values()
+
+    key, value = args
+    found = [
+        (item_id, item) for items in menu.values() for item_id, item in items.items()
+        if key in (item_id, item_id[len('item_'):]) or item['name'].casefold() == key.casefold()
+    ]
+    if len(found) != 1:
+        await message.answer("❌ Позиция не найдена" if not found else "❌ Несколько позиций с таким названием, укажите id")
+        return
+    if value != '-' and not value.isdigit():
+        await message.answer("❌ Остаток — целое число или «-»")
+        return
+    item_id, item = found[0]
+    inventory.set_level(item_id, None if value == '-' else int(value))
+    available = inventory.available(item_id)
+    await message.answer(
+        f"📦 {item['name']}: " +
+        ("без ограничения" if available is None else f"на кухне {inventory.stock[item_id]}, доступно {available}")
     )
-    
-    try:
-        await bot.send_message(
-            user_id,
-            f"🎉 *Ваш заказ готов!*\n\n" +
-            items_text +
-            "\n\nПриятного аппетита! 💋",
-            parse_mode="Markdown"
-        )
-        await call.answer("✅ Пользователь уведомлён")
-    except Exception as e:
-        await call.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
-    
-    # Обновляем сообщение админу
-    await call.message.edit_text(
-        f"✅ Заказ выполнен\n" +
-        call.message.text,
-        parse_mode="Markdown"
+
+# ====================== ОЧЕРЕДЬ ЗАКАЗОВ ======================
+
+# Индекс заказов по статусам, заполняется в startup_pipeline()
+order_index = OrderIndex()
+
+QUEUE_PAGE = 10
+
+# Сообщения клиенту при смене статуса
+STATUS_MESSAGES = {
+    COOKING: "👩‍🍳 *Шеф-повар уже готовит ваш заказ!*\n\n{items}",
+    READY: "🎉 *Ваш заказ готов!*\n\n{items}\n\nПриятного аппетита! 💋",
+    CANCELLED: "😔 *Заказ отменён*\n\n{items}",
+}
+
+# Когда заказ перешёл в статус; completed_at — прежнее имя для «выдан»
+STATUS_STAMPS = {
+    COOKING: 'cooking_at',
+    READY: 'ready_at',
+    DONE: 'completed_at',
+    CANCELLED: 'cancelled_at',
+}
+
+# Список заказов, показанный админу: массовая кнопка действует ровно на него,
+# даже если очередь успела измениться. token -> (статус, order_ids)
+queue_selections = {}
+QUEUE_SELECTIONS_LIMIT = 50
+
+def order_event(order_id, order):
+    return {
+        'id': order_id,
+        'status': order.status or NEW,
+        'user_id': order.user_id,
+        'created_at': order.created_at,
+        'items': [[line.name, line.count] for line in order.items.values()],
+        'total': order.total,
+    }
+
+def publish_order(order_id):
+    events.publish('order', order_event(order_id, orders[order_id]))
+
+def order_items_text(order):
+    return "\n".join(
+        f"▪ {item.name} ×{item.count}"
+        for item in order.items.values()
     )
 
-# Обработчик кнопки "Погнали" у админа
-@dp.callback_query(F.data.startswith("outdoor_confirm_"))
-async def outdoor_confirmation(call: types.CallbackQuery):
-    await call.answer()
-    user_id = int(call.data.split('_')[2])
-    
+def set_order_status(order_id, status):
+    # Статус, метка времени и индекс меняются без await между шагами
+    order = orders[order_id]
+    previous = order.status or NEW
+    if not can_move(previous, status):
+        return None
+    order.status = status
+    setattr(order, STATUS_STAMPS[status], datetime.now().isoformat())
+    order_index.add(order_id, order)
+    metrics.inc('order_status_changes_total', status=status)
+    publish_order(order_id)
+    return previous
+
+def status_message(previous, status):
+    if status == DONE:
+        # Если клиенту уже написали «готов», о выдаче не пишем
+        return None if previous == READY else STATUS_MESSAGES[READY]
+    return STATUS_MESSAGES.get(status)
+
+async def notify_status(order_id, previous, status):
+    order = orders[order_id]
+    template = status_message(previous, status)
+    # У самых старых заказов клиент не записан — уведомлять некого
+    if template is None or not order.user_id:
+        return True
     try:
-        # Отправляем уведомление пользователю
-        await bot.send_message(
-            user_id,
-            "🎉 Шеф-повар подтвердил - погнали по ресторанам! 🚗💨"
-        )
-        
-        # Обновляем сообщение админу
-        await call.message.edit_text(
-            f"✅ Вы подтвердили поход по ресторанам с пользователем\n"
-            f"{call.message.text}",
-            reply_markup=None
-        )
+        with idempotent():
+            await bot.send_message(
+                order.user_id,
+                template.format(items=order_items_text(order)),
+                parse_mode="Markdown"
+            )
+        return True
     except Exception as e:
-        logger.error(f"Ошибка подтверждения похода по ресторанам: {e}")
-        await call.answer("❌ Не удалось отправить подтверждение")
+        logger.error("Не удалось уведомить о заказе %s: %s", order_id, e)
+        return False
+
+async def move_orders(order_ids, status):
+    # Все переходы сохраняются одной записью, клиенты уведомляются параллельно.
+    # Возвращает (сколько заказов перешло, сколько уведомлений не доставлено)
+    moved = []
+    for order_id in order_ids:
+        if find_order(order_id) is None:
+            continue
+        previous = set_order_status(order_id, status)
+        if previous is not None:
+            moved.append((order_id, previous))
+    if not moved:
+        return 0, 0
+    save_db(menu, orders, active_orders, order_ids=[order_id for order_id, _ in moved])
+    delivered = await asyncio.gather(*(
+        notify_status(order_id, previous, status) for order_id, previous in moved
+    ))
+    return len(moved), delivered.count(False)
+
+async def sync_orders():
+    # В кластере заказы оформляют все воркеры, а очередь смотрит админ в одном из них
+    fresh = await asyncio.to_thread(store.poll_new_orders)
+    for order_id, order in fresh.items():
+        if order_id not in orders:
+            orders[order_id] = order
+            order_index.add(order_id, order)
+            recommender.add(order)
+            publish_order(order_id)
+
+def order_status_keyboard(order_id, status):
+    builder = InlineKeyboardBuilder()
+    for next_status in TRANSITIONS[status]:
+        builder.add(types.InlineKeyboardButton(
+            text=ACTION_TITLES[next_status],
+            callback_data=f"order_{next_status}_{order_id}"
+        ))
+    builder.adjust(2)
+    return builder.as_markup() if TRANSITIONS[status] else None
+
+def remember_selection(status, order_ids):
+    while len(queue_selections) >= QUEUE_SELECTIONS_LIMIT:
+        queue_selections.pop(next(iter(queue_selections)))
+    token = secrets.token_hex(4)
+    queue_selections[token] = (status, order_ids)
+    return token
+
+def queue_overview():
+    counts = order_index.counts()
+    text = "📋 Очередь заказов\n\n" + "\n".join(
+        f"{STATUS_TITLES[status]}: {counts[status]}" for status in STATUSES
+    )
+    builder = InlineKeyboardBuilder()
+    for status in OPEN_STATUSES:
+        builder.add(types.InlineKeyboardButton(
+            text=f"{STATUS_TITLES[status]} ({counts[status]})",
+            callback_data=f"q_list_{status}"
+        ))
+    builder.adjust(1)
+    return text, builder.as_markup()
 
-@dp.callback_query(F.data.startswith("delivery_confirm_"))
-async def confirm_delivery(call: types.CallbackQuery):
-    try:
-        await call.answer()
-        user_id = int(call.data.split('_')[2])
-        
-        # Отправляем уведомление пользователю
-        await bot.send_message(
-            user_id,
-            "🚀 Ура, не готовить!"
-        )
-        
-        # Редактируем сообщение админа
-        await call.message.edit_text(
-            f"✅ Подтверждено: {call.message.text}",
-            reply_markup=None
-        )
-        
-    except Exception as e:
-        logger.error(f"Ошибка подтверждения доставки: {e}")
-        await call.answer("❌ Не удалось отправить подтверждение", show_alert=True)
+def queue_page(status):
+    order_ids = order_index.oldest(status, QUEUE_PAGE)
+    total = order_index.count(status)
+    lines = [f"{STATUS_TITLES[status]}: {total}" + (f", самые старые {len(order_ids)}" if total > len(order_ids) else "")]
+    builder = InlineKeyboardBuilder()
+    next_status = NEXT_STATUS[status]
+    for order_id in order_ids:
+        order = orders[order_id]
+        items = ", ".join(f"{item.name} ×{item.count}" for item in order.items.values())
+        lines.append(f"\n{order_id} · {order.created_at[11:16]}\n{items}")
+        builder.row(types.InlineKeyboardButton(
+            text=f"{ACTION_TITLES[next_status]} · {order_id}",
+            callback_data=f"q_move_{order_id}_{next_status}_{status}"
+        ))
+    if order_ids:
+        token = remember_selection(status, order_ids)
+        bulk = [next_status] if next_status == DONE else [next_status, DONE]
+        builder.row(*(
+            types.InlineKeyboardButton(
+                text=f"⏩ Все {len(order_ids)}: {ACTION_TITLES[target]}",
+                callback_data=f"q_bulk_{token}_{target}"
+            )
+            for target in bulk
+        ))
+    builder.row(types.InlineKeyboardButton(text="⬅️ К очереди", callback_data="q_overview"))
+    return "\n".join(lines), builder.as_markup()
 
-# Обработчик кнопки подтверждения
-@dp.callback_query(F.data.startswith("compote_confirm_"))
-async def confirm_compote(call: types.CallbackQuery):
+async def show_queue_screen(call: types.CallbackQuery, text, markup):
     try:
-        await call.answer()
-        user_id = int(call.data.split('_')[2])
-        
-        # Отправляем уведомление пользователю
-        await bot.send_message(
-            user_id,
-            "🍾 Го квасить! 🍻"
-        )
-        
-        # Обновляем сообщение админа
-        await call.message.edit_text(
-            f"✅ Подтверждено: {call.message.text}\n"
-            f"Ответ отправлен пользователю",
-            reply_markup=None
-        )
-        
-    except Exception as e:
-        logger.error(f"Ошибка подтверждения: {e}")
-        await call.answer("❌ Не удалось отправить подтверждение", show_alert=True)
+        await call.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest as e:
+        if 'not modified' not in str(e):
+            raise
+
+@dp.message(Command("queue"), F.from_user.id == ADMIN_ID)
+async def cmd_queue(message: types.Message):
+    await sync_orders()
+    text, markup = queue_overview()
+    await message.answer(text, reply_markup=markup)
+
+@dp.callback_query(F.data == "q_overview", F.from_user.id == ADMIN_ID)
+async def queue_overview_handler(call: types.CallbackQuery):
+    await sync_orders()
+    await show_queue_screen(call, *queue_overview())
+
+@dp.callback_query(F.data.startswith("q_list_"), F.from_user.id == ADMIN_ID)
+async def queue_list_handler(call: types.CallbackQuery):
+    status = call.data[len("q_list_"):]
+    if status not in NEXT_STATUS:
+        await call.answer("❌ Неизвестный статус", show_alert=True)
+        return
+    await sync_orders()
+    await show_queue_screen(call, *queue_page(status))
+
+@dp.callback_query(F.data.startswith("q_move_"), F.from_user.id == ADMIN_ID)
+async def queue_move_handler(call: types.CallbackQuery):
+    order_id, status, view = call.data[len("q_move_"):].split('_')
+    moved, failed = await move_orders([order_id], status)
+    if not moved:
+        await call.answer("ℹ️ Заказ уже в другом статусе")
+    elif failed:
+        await call.answer("⚠️ Статус изменён, но клиент не уведомлён", show_alert=True)
+    await show_queue_screen(call, *queue_page(view))
+
+@dp.callback_query(F.data.startswith("q_bulk_"), F.from_user.id == ADMIN_ID)
+async def queue_bulk_handler(call: types.CallbackQuery):
+    token, status = call.data[len("q_bulk_"):].split('_')
+    selection = queue_selections.pop(token, None)
+    if selection is None:
+        await call.answer("❌ Список устарел, откройте очередь заново", show_alert=True)
+        return
+    view, order_ids = selection
+    moved, failed = await move_orders(order_ids, status)
+    await call.answer(
+        f"{STATUS_LABELS[status]}: {moved} из {len(order_ids)}" +
+        (f", не уведомлено {failed}" if failed else ""),
+        show_alert=bool(failed)
+    )
+    await show_queue_screen(call, *queue_page(view))
 
-# Общий обработчик подтверждения для бичи-меню
-@dp.callback_query(F.data.startswith("bichis_confirm_"))
-async def confirm_bichis(call: types.CallbackQuery):
+# Кнопки под уведомлением о новом заказе: order_<статус>_<ID>
+@dp.callback_query(F.data.regexp(r"^order_(cooking|ready|done|cancelled)_"), F.from_user.id == ADMIN_ID)
+async def order_status_handler(call: types.CallbackQuery):
+    _, status, order_id = call.data.split('_', 2)
+
+    if find_order(order_id) is None:
+        await call.answer("❌ Заказ не найден!", show_alert=True)
+        return
+
+    moved, failed = await move_orders([order_id], status)
+    current = orders[order_id].status
+    if not moved:
+        await call.answer(f"ℹ️ Заказ уже: {STATUS_LABELS[current]}")
+    elif failed:
+        await call.answer("❌ Статус изменён, но клиент не уведомлён", show_alert=True)
+    else:
+        await call.answer(f"{STATUS_LABELS[current]}")
+
+    # Первая строка сообщения админу — текущий статус заказа
+    body = call.message.text or ""
+    first_line, _, rest = body.partition('\n')
+    if first_line in STATUS_LABELS.values():
+        body = rest
     try:
-        await call.answer()
-        _, _, user_id, item_type = call.data.split('_')
-        user_id = int(user_id)
-        
-        # Отправляем уведомление пользователю
-        await bot.send_message(
-            user_id,
-            "🚀 Сифоооон! " + ("Шавуха уже в пути!" if item_type == "shawarma" else "Дошик замачивается!")
-        )
-        
-        # Обновляем сообщение админа
         await call.message.edit_text(
-            f"✅ Подтверждено: {call.message.text}\n"
-            f"Тип: {'Шаурма' if item_type == 'shawarma' else 'Дошик'}",
-            reply_markup=None
+            f"{STATUS_LABELS[current]}\n{body}",
+            reply_markup=order_status_keyboard(order_id, current)
         )
-        
-    except Exception as e:
-        logger.error(f"Ошибка подтверждения: {e}")
-        await call.answer("❌ Не удалось отправить подтверждение", show_alert=True)
+    except TelegramBadRequest as e:
+        if 'not modified' not in str(e):
+            raise
+
+# ====================== РАССЫЛКИ ======================
+
+broadcaster = Broadcaster(
+    bot,
+    DATA_DIR / 'broadcasts',
+    owner=WORKER_ID,
+    concurrency=int(os.getenv('BROADCAST_CONCURRENCY', '20')),
+    rate=float(os.getenv('BROADCAST_RATE', '25'))
+)
+
+async def broadcast_recipients():
+    # В кластере пользователей регистрируют разные воркеры, поэтому берём реестр из хранилища
+    registry = await asyncio.to_thread(store.load_users)
+    return [user_id for user_id in registry if user_id != str(ADMIN_ID)]
+
+async def offer_announcement(message: types.Message, cat_id: str, item_id: str):
+    builder = InlineKeyboardBuilder()
+    builder.add(types.InlineKeyboardButton(
+        text="📣 Рассказать клиентам",
+        callback_data=f"announce_{cat_id}_{item_id}"
+    ))
+    await message.answer("Разослать новинку всем клиентам?", reply_markup=builder.as_markup())
+
+@dp.callback_query(F.data.startswith("announce_"), F.from_user.id == ADMIN_ID)
+async def announce_item(call: types.CallbackQuery):
+    _, cat_id, item_id = call.data.split('_', 2)
+    item = menu.get(cat_id, {}).get(item_id)
+    if not item:
+        await call.answer("❌ Позиция не найдена", show_alert=True)
+        return
+
+    photo_path = PHOTOS_DIR / item['photo'] if item.get('photo') else None
+    job = await broadcaster.start(
+        await broadcast_recipients(),
+        text=f"🆕 Новинка в меню: {item['name']}\n{item['desc']}\nЦена: {item['price']} 💋",
+        photo=photo_path if photo_path and photo_path.exists() else None,
+        buttons=[("👀 Посмотреть", f"item_{cat_id}_{item_id}")],
+        report_to=ADMIN_ID
+    )
+    await call.answer(f"📣 Рассылка запущена: {len(job['recipients'])} получателей")
+    await call.message.edit_reply_markup(reply_markup=None)
+
+@dp.message(Command("broadcast"), F.from_user.id == ADMIN_ID)
+async def cmd_broadcast(message: types.Message, command: CommandObject):
+    # /broadcast текст — или фото с подписью /broadcast текст
+    if not command.args:
+        await message.answer("Использование: /broadcast текст (можно подписью к фото)")
+        return
+
+    photo_path = None
+    if message.photo:
+        file = await bot.get_file(message.photo[-1].file_id)
+        photo_path = DATA_DIR / 'broadcasts' / f"{message.photo[-1].file_unique_id}.jpg"
+        photo_path.parent.mkdir(parents=True, exist_ok=True)
+        await bot.download_file(file.file_path, photo_path)
+
+    job = await broadcaster.start(
+        await broadcast_recipients(),
+        text=command.args,
+        photo=photo_path,
+        report_to=ADMIN_ID
+    )
+    await message.answer(f"📣 Рассылка {job['id']} запущена: {len(job['recipients'])} получателей")
+
+@dp.message(Command("broadcasts"), F.from_user.id == ADMIN_ID)
+async def cmd_broadcasts(message: types.Message):
+    if not broadcaster.jobs:
+        await message.answer("ℹ️ Рассылок ещё не было")
+        return
+    recent = sorted(broadcaster.jobs.values(), key=lambda job: job['created_at'])[-5:]
+    await message.answer("\n\n".join(format_broadcast_report(job) for job in recent))
+
+@dp.message(Command("broadcast_cancel"), F.from_user.id == ADMIN_ID)
+async def cmd_broadcast_cancel(message: types.Message, command: CommandObject):
+    if command.args and broadcaster.cancel(command.args.strip()):
+        await message.answer(f"⛔ Рассылка {command.args.strip()} остановлена")
+    else:
+        await message.answer("❌ Активная рассылка с таким ID не найдена")
+
+# ====================== ПАНЕЛЬ АДМИНИСТРАТОРА ======================
+
+# Страница в браузере с открытыми заказами, корзинами и заявками; обновляется
+# событиями из шины без опроса. DASHBOARD_PORT=0 — панель выключена
+DASHBOARD_PORT = int(os.getenv('DASHBOARD_PORT', '0'))
+DASHBOARD_HOST = os.getenv('DASHBOARD_HOST', '127.0.0.1')
+DASHBOARD_SPECIALS = 50
+
+def dashboard_snapshot():
+    open_orders = [
+        order_event(order_id, orders[order_id])
+        for status in OPEN_STATUSES
+        for _, order_id in order_index.by_status[status]
+        if order_id in orders
+    ]
+    return {
+        'orders': open_orders,
+        'carts': [cart_event(user_id, cart) for user_id, cart in active_orders.items() if cart.items],
+        'specials': events.latest('special_request', DASHBOARD_SPECIALS),
+    }
+
+dashboard_app = dashboard.build_app(
+    events, dashboard_snapshot,
+    token=os.getenv('DASHBOARD_TOKEN') or None,
+    open_statuses=OPEN_STATUSES,
+    status_labels=STATUS_LABELS
+)
+dashboard_runner = None
 
 # ====================== ЗАПУСК БОТА ======================
 
+# Фоновые задачи процесса, останавливаются в on_shutdown
+background_tasks = set()
+
+def start_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
 async def on_startup(bot: Bot):
-    init_folders()
-    await bot.send_message(ADMIN_ID, "🤖 Бот запущен!")
+    global dashboard_runner, catalog_runner
+    # Мидлварь сессии вешаем здесь: тесты и бенчмарки подменяют сессию до старта
+    fast_ack.install(bot)
+    if LOOP_WATCHDOG:
+        loop_watchdog.start()
+    await startup_pipeline()
+    await broadcaster.resume()
+    start_background(cart_sweeper())
+    start_background(stock_flusher())
+    if dedup.path:
+        start_background(dedup_flusher())
+    if WORKER_ID in (None, '0'):
+        start_background(photo_maintenance())
+    # В кластере menu.json отслеживает один воркер и переносит изменения в общее хранилище
+    if store.name == 'json' or WORKER_ID == '0':
+        start_background(menu_watcher())
+    if recorder is not None:
+        recorder.start()
+    if DASHBOARD_PORT:
+        dashboard_runner = await dashboard.start(dashboard_app, DASHBOARD_HOST, DASHBOARD_PORT)
+    if WEBAPP_URL and CATALOG_PORT:
+        catalog_runner = await catalog.start(catalog_app, CATALOG_HOST, CATALOG_PORT)
+    # В кластере о запуске сообщает только первый воркер
+    if WORKER_ID in (None, '0'):
+        await bot.send_message(ADMIN_ID, "🤖 Бот запущен!")
+
+async def on_shutdown(bot: Bot):
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await broadcaster.close()
+    await asyncio.to_thread(photo_store.save_index)
+    await asyncio.to_thread(dedup.save)
+    try:
+        await flush_stock()
+    except Exception as e:
+        logger.error("Ошибка сохранения остатков: %s", e)
+    events.close()
+    if dashboard_runner is not None:
+        await dashboard_runner.cleanup()
+    if catalog_runner is not None:
+        await catalog_runner.cleanup()
+    if recorder is not None:
+        await asyncio.to_thread(recorder.close)
+    if LOOP_WATCHDOG:
+        await loop_watchdog.stop()
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
 
 if __name__ == '__main__':
-    dp.startup.register(on_startup)
-    dp.run_polling(bot)
\ No newline at end of file
+    # Ограничение задач поллинга и есть длина очереди: дальше апдейты ждут в Telegram
+    dp.run_polling(
+        bot,
+        tasks_concurrency_limit=ADMISSION_WORKERS + ADMISSION_QUEUE if ADMISSION_WORKERS else None
+    )
\ No newline at end of file
@@ -0,0 +1,248 @@
+import time
+import asyncio
+import logging
+import itertools
+from datetime import datetime
+from pathlib import Path
+from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramServerError
+)
+import json_codec
+from resilient_session import no_retries
+
+logger = logging.getLogger(__name__)
+
+# Рассылка одного сообщения всем пользователям бота.
+# Состояние каждой рассылки (статус доставки по каждому пользователю) лежит в
+# DATA_DIR/broadcasts/<id>.json и периодически сохраняется, поэтому после
+# перезапуска рассылка продолжается с неотправленных.
+
+PENDING, SENT, BLOCKED, FAILED = 'pending', 'sent', 'blocked', 'failed'
+
+
+class RateLimiter:
+    # Не больше `rate` отправок в секунду на весь бот; после RetryAfter все ждут
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._lock:
+                now = loop.time()
+                ready = max(self._next, self._paused_until)
+                if ready <= now:
+                    self._next = max(now, self._next) + self.interval
+                    return
+            await asyncio.sleep(ready - now)
+
+
+class Broadcaster:
+    def __init__(self, bot, jobs_dir, owner=None, concurrency=20, rate=25.0,
+                 max_attempts=3, checkpoint_every=2.0):
+        self.bot = bot
+        self.jobs_dir = Path(jobs_dir)
+        self.owner = owner
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.max_attempts = max_attempts
+        self.checkpoint_every = checkpoint_every
+        self.jobs = {}
+        self._tasks = {}
+        self._ids = itertools.count(int(time.time()))
+
+    # ---------- хранение ----------
+
+    def _path(self, job_id):
+        return self.jobs_dir / f"{job_id}.json"
+
+    async def _checkpoint(self, job):
+        snapshot = dict(job, recipients=dict(job['recipients']))
+        await asyncio.to_thread(json_codec.write_file, self._path(job['id']), snapshot)
+
+    def _load_jobs(self):
+        jobs = {}
+        for path in sorted(self.jobs_dir.glob('*.json')):
+            try:
+                job = json_codec.read_file(path)
+            except Exception as e:
+                logger.error("Ошибка чтения рассылки %s: %s", path.name, e)
+                continue
+            jobs[job['id']] = job
+        return jobs
+
+    # ---------- управление ----------
+
+    async def start(self, recipients, text=None, photo=None, buttons=None, report_to=None):
+        job_id = f"b{next(self._ids)}"
+        job = {
+            'id': job_id,
+            'owner': self.owner,
+            'created_at': datetime.now().isoformat(),
+            'status': 'running',
+            'text': text,
+            'photo': str(photo) if photo else None,
+            'photo_id': None,
+            'buttons': buttons or [],
+            'report_to': report_to,
+            'recipients': {str(user_id): PENDING for user_id in recipients},
+            'elapsed': 0.0,
+        }
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.jobs[job_id] = job
+        await self._checkpoint(job)
+        self._tasks[job_id] = asyncio.create_task(self._run(job))
+        return job
+
+    async def resume(self):
+        # Продолжаем только свои незавершённые рассылки (в кластере у каждого воркера свои)
+        if not self.jobs_dir.exists():
+            return []
+        loaded = await asyncio.to_thread(self._load_jobs)
+        resumed = []
+        for job_id, job in loaded.items():
+            self.jobs.setdefault(job_id, job)
+            if job['status'] == 'running' and job.get('owner') == self.owner and job_id not in self._tasks:
+                self._tasks[job_id] = asyncio.create_task(self._run(job))
+                resumed.append(job)
+        if resumed:
+            logger.info("Возобновлено рассылок: %d", len(resumed))
+        return resumed
+
+    def cancel(self, job_id):
+        task = self._tasks.get(job_id)
+        if task is None:
+            return False
+        self.jobs[job_id]['status'] = 'cancelled'
+        task.cancel()
+        return True
+
+    async def close(self):
+        # Остановка без смены статуса: при следующем запуске рассылка продолжится
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    @staticmethod
+    def stats(job):
+        counts = {PENDING: 0, SENT: 0, BLOCKED: 0, FAILED: 0}
+        for status in job['recipients'].values():
+            counts[status] += 1
+        done = counts[SENT] + counts[BLOCKED] + counts[FAILED]
+        rate = done / job['elapsed'] if job['elapsed'] else 0.0
+        return counts, rate
+
+    # ---------- доставка ----------
+
+    def _markup(self, job):
+        if not job['buttons']:
+            return None
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=text, callback_data=data)] for text, data in job['buttons']
+        ])
+
+    async def _send(self, job, user_id, markup, photo_lock):
+        if not job['photo']:
+            await self.bot.send_message(user_id, job['text'], reply_markup=markup)
+            return
+        if job['photo_id'] is None:
+            # Файл загружаем один раз, дальше шлём по file_id
+            async with photo_lock:
+                if job['photo_id'] is None:
+                    message = await self.bot.send_photo(
+                        user_id, FSInputFile(job['photo']), caption=job['text'], reply_markup=markup
+                    )
+                    job['photo_id'] = message.photo[-1].file_id
+                    return
+        await self.bot.send_photo(user_id, job['photo_id'], caption=job['text'], reply_markup=markup)
+
+    async def _deliver(self, job, user_id, markup, photo_lock):
+        attempts = 0
+        while True:
+            await self.limiter.wait()
+            try:
+                # Повторы и паузы по RetryAfter рассылка делает сама, для всех отправок сразу
+                with no_retries():
+                    await self._send(job, user_id, markup, photo_lock)
+                return SENT
+            except TelegramRetryAfter as e:
+                # Флуд-лимит: притормаживаем всю рассылку и повторяем этого же пользователя
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return BLOCKED
+            except TelegramBadRequest as e:
+                logger.warning("Рассылка %s: пользователь %s недоступен: %s", job['id'], user_id, e)
+                return FAILED
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    logger.warning("Рассылка %s: не доставлено %s: %s", job['id'], user_id, e)
+                    return FAILED
+                await asyncio.sleep(min(2 ** attempts, 30))
+
+    async def _run(self, job):
+        queue = asyncio.Queue()
+        for user_id, status in job['recipients'].items():
+            if status == PENDING:
+                queue.put_nowait(user_id)
+
+        markup = self._markup(job)
+        photo_lock = asyncio.Lock()
+        started = time.monotonic()
+        elapsed_before = job['elapsed']
+        last_checkpoint = started
+
+        async def worker():
+            nonlocal last_checkpoint
+            while True:
+                try:
+                    user_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                job['recipients'][user_id] = await self._deliver(job, user_id, markup, photo_lock)
+                now = time.monotonic()
+                if now - last_checkpoint >= self.checkpoint_every:
+                    last_checkpoint = now
+                    job['elapsed'] = elapsed_before + now - started
+                    await self._checkpoint(job)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, queue.qsize() or 1))))
+            job['status'] = 'done'
+        finally:
+            job['elapsed'] = elapsed_before + time.monotonic() - started
+            await asyncio.shield(self._checkpoint(job))
+            self._tasks.pop(job['id'], None)
+
+        counts, rate = self.stats(job)
+        logger.info("Рассылка %s завершена: %s, %.1f сообщ/с", job['id'], counts, rate)
+        if job['report_to']:
+            try:
+                await self.bot.send_message(job['report_to'], format_report(job))
+            except Exception as e:
+                logger.error("Не удалось отправить отчёт о рассылке: %s", e)
+
+
+def format_report(job):
+    counts, rate = Broadcaster.stats(job)
+    status = {'running': "⏳ идёт", 'done': "✅ завершена", 'cancelled': "⛔ отменена"}[job['status']]
+    return (
+        f"📣 Рассылка {job['id']}: {status}\n"
+        f"Доставлено: {counts[SENT]}\n"
+        f"Заблокировали бота: {counts[BLOCKED]}\n"
+        f"Ошибки: {counts[FAILED]}\n"
+        f"В очереди: {counts[PENDING]}\n"
+        f"Скорость: {rate:.1f} сообщ/с за {job['elapsed']:.1f} с"
+    )
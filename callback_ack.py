@@ -0,0 +1,139 @@
+import time
+import asyncio
+import logging
+from functools import partial
+from aiogram import BaseMiddleware
+from aiogram.methods import AnswerCallbackQuery
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ранний ответ на callback-запросы. Пока хендлер работает, клиент Telegram крутит
+# индикатор на кнопке, и пользователь жмёт её ещё раз. Мидлварь гарантирует
+# answerCallbackQuery не позже deadline секунд:
+#
+#   - хендлер ответил сам до дедлайна (в том числе алертом) — его ответ и уходит;
+#   - не ответил — по дедлайну (или по завершении, если успел раньше) уходит пустой ответ;
+#   - ответил после раннего ответа — второй ответ Telegram уже не примет, поэтому
+#     алерт приходит сообщением, а всплывающий текст отбрасывается.
+#
+# Повторное нажатие той же кнопки, пока первое ещё обрабатывается, сразу
+# подтверждается и в хендлер не попадает.
+#
+# Ответы перехватываются мидлварью сессии (request_middleware), поэтому хендлеры
+# по-прежнему просто вызывают call.answer(...). Ставится она через install(bot):
+# на сессии одна мидлварь, которая отдаёт вызов мидлвари его бота, — так
+# несколько ботов на общей сессии (tenants.py) не проходят через чужие.
+#
+# Отсчёт дедлайна начинается в arm() — внешней мидлвари апдейтов, которая стоит
+# перед допуском к обработке (admission.py): нажатие, ждущее своей очереди,
+# подтверждается вовремя. Мидлварь callback_query тогда только узнаёт маршрут;
+# без arm() она сама ведёт весь отсчёт, как раньше.
+
+WAITING, ACKING, ANSWERED = 'waiting', 'acking', 'answered'
+
+
+class FastAckMiddleware(BaseMiddleware):
+    def __init__(self, deadline=0.3):
+        self.deadline = deadline
+        # callback_query_id -> [состояние, маршрут, user_id, время начала]
+        self.pending = {}
+        self.in_flight = set()
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        route = handler_object.callback.__name__ if handler_object else 'unknown'
+        state = self.pending.get(event.id)
+        if state is not None:
+            # Отсчёт уже идёт с arm(): теперь известен хендлер
+            state[1] = route
+            return await handler(event, data)
+        return await self._guard(handler, event, data, event, route)
+
+    async def arm(self, handler, event, data):
+        # Внешняя мидлварь апдейтов: дедлайн считается с прихода апдейта, а не
+        # с момента, когда он дождался очереди
+        if event.callback_query is None:
+            return await handler(event, data)
+        return await self._guard(handler, event, data, event.callback_query, 'unknown')
+
+    async def _guard(self, handler, event, data, call, route):
+        bot = data['bot']
+        message_id = call.message.message_id if call.message else None
+        tap = (call.from_user.id, message_id, call.data)
+        if tap in self.in_flight:
+            metrics.inc('callback_duplicates_total', route=route)
+            await self._ack(bot, call.id, route, 'duplicate')
+            return None
+
+        self.in_flight.add(tap)
+        state = self.pending[call.id] = [WAITING, route, call.from_user.id, time.monotonic()]
+        timer = asyncio.create_task(self._ack_later(bot, call.id))
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight.discard(tap)
+            if state[0] == ACKING:
+                # Ранний ответ уже в пути — дожидаемся его, а не обрываем
+                await asyncio.gather(timer, return_exceptions=True)
+            else:
+                timer.cancel()
+            try:
+                if state[0] == WAITING:
+                    # Хендлер успел раньше дедлайна и не ответил сам
+                    await self._ack(bot, call.id, state[1], 'after')
+            finally:
+                self.pending.pop(call.id, None)
+
+    async def _ack_later(self, bot, query_id):
+        await asyncio.sleep(self.deadline)
+        state = self.pending.get(query_id)
+        if state and state[0] == WAITING:
+            await self._ack(bot, query_id, state[1], 'early')
+
+    async def _ack(self, bot, query_id, route, kind):
+        state = self.pending.get(query_id)
+        if state:
+            state[0] = ACKING
+        try:
+            await bot.answer_callback_query(query_id)
+        except Exception as e:
+            # Запрос мог устареть, пока апдейт стоял в очереди
+            logger.warning("Не удалось ответить на callback %s: %s", route, e)
+            return
+        metrics.inc('callback_acks_total', route=route, kind=kind)
+
+    def install(self, bot):
+        session = bot.session
+        routes = getattr(session, 'fast_ack_routes', None)
+        if routes is None:
+            routes = session.fast_ack_routes = {}
+            session.middleware(partial(_dispatch, routes))
+        routes[bot.id] = self
+
+    async def request_middleware(self, make_request, bot, method):
+        if not isinstance(method, AnswerCallbackQuery):
+            return await make_request(bot, method)
+        state = self.pending.get(method.callback_query_id)
+        if state is None:
+            return await make_request(bot, method)
+        status, route, user_id, started = state
+        if status != ANSWERED:
+            state[0] = ANSWERED
+            metrics.observe('callback_ack_seconds', time.monotonic() - started, route=route)
+            if status == WAITING:
+                metrics.inc('callback_acks_total', route=route, kind='handler')
+            return await make_request(bot, method)
+
+        # Запрос уже подтверждён: повторный answerCallbackQuery Telegram отклонит
+        metrics.inc('callback_late_answers_total', route=route)
+        if method.show_alert and method.text:
+            await bot.send_message(user_id, method.text)
+        return True
+
+
+async def _dispatch(routes, make_request, bot, method):
+    ack = routes.get(bot.id)
+    if ack is None:
+        return await make_request(bot, method)
+    return await ack.request_middleware(make_request, bot, method)
@@ -0,0 +1,291 @@
+import os
+import re
+import shutil
+import hashlib
+import logging
+from html import escape
+from pathlib import Path
+from aiohttp import web
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+# Каталог меню для Telegram Web App: статические файлы, собранные из menu и
+# CATEGORIES, которые отдаются без участия бота.
+#
+#   index.html                 — всё меню одной страницей, корзина собирается в браузере
+#   thumbs/<хеш>-<размер>.jpg  — миниатюры; имя по содержимому исходного фото
+#
+# Миниатюра не меняется, пока не поменялось фото, поэтому отдаётся с вечным
+# кэшем; index.html — с ETag, повторное открытие стоит ответа 304.
+# Пересборка инкрементальная: заново рендерятся только изменившиеся категории,
+# миниатюры делаются только для новых фото, ненужные удаляются.
+#
+# Корзина уходит боту одним web_app_data: [[категория, позиция, количество], ...].
+# Цены и названия бот берёт из меню, страница только показывает их.
+#
+# С Pillow миниатюры уменьшаются до thumb_size точек по большей стороне; без
+# него в thumbs/ кладётся копия исходного фото под тем же именем по содержимому.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+THUMB_NAME = re.compile(r'[0-9a-f]{16}-\d+\.(jpg|jpeg|png|webp)')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+PAGE = """<!doctype html>
+<html lang="ru"><head><meta charset="utf-8">
+<meta name="viewport" content="width=device-width,initial-scale=1">
+<title>Кацулька — меню</title>
+<script src="https://telegram.org/js/telegram-web-app.js"></script>
+<style>
+body{font:15px sans-serif;margin:0;background:var(--tg-theme-bg-color,#fff);color:var(--tg-theme-text-color,#222)}
+nav{position:sticky;top:0;display:flex;gap:6px;overflow-x:auto;padding:8px;background:var(--tg-theme-secondary-bg-color,#f3f3f3)}
+nav a{white-space:nowrap;padding:4px 10px;border-radius:12px;text-decoration:none;color:inherit;background:var(--tg-theme-bg-color,#fff)}
+h2{margin:16px 12px 6px}
+.item{display:flex;gap:10px;padding:8px 12px;border-bottom:1px solid #8882}
+.item img,.item .nophoto{width:84px;height:84px;object-fit:cover;border-radius:8px;flex:none;background:#8882}
+.info{flex:1;min-width:0}.desc{color:var(--tg-theme-hint-color,#888);font-size:13px}
+.qty{display:flex;align-items:center;gap:8px;margin-top:6px}
+.qty button{width:30px;height:30px;border:0;border-radius:15px;font-size:18px;
+background:var(--tg-theme-button-color,#e86a92);color:var(--tg-theme-button-text-color,#fff)}
+.qty .count{min-width:16px;text-align:center}
+</style></head><body>
+CONTENT
+<script>
+const tg = window.Telegram && Telegram.WebApp;
+const cart = new Map();
+
+function summary() {
+  let count = 0, total = 0;
+  for (const [el, n] of cart) { count += n; total += n * +el.dataset.price; }
+  return [count, total];
+}
+
+function update(el) {
+  el.querySelector('.count').textContent = cart.get(el) || '';
+  el.querySelector('.minus').style.visibility = cart.has(el) ? 'visible' : 'hidden';
+  const [count, total] = summary();
+  if (!tg) return;
+  if (count) {
+    tg.MainButton.setText('В заказ: ' + count + ' шт. — ' + total + ' 💋');
+    tg.MainButton.show();
+  } else {
+    tg.MainButton.hide();
+  }
+}
+
+document.querySelectorAll('.item').forEach(el => {
+  el.querySelector('.plus').onclick = () => { cart.set(el, (cart.get(el) || 0) + 1); update(el); };
+  el.querySelector('.minus').onclick = () => {
+    const n = (cart.get(el) || 0) - 1;
+    if (n > 0) cart.set(el, n); else cart.delete(el);
+    update(el);
+  };
+  update(el);
+});
+
+if (tg) {
+  tg.ready();
+  tg.expand();
+  tg.MainButton.onClick(() => {
+    const items = [...cart].map(([el, n]) => [el.dataset.cat, el.dataset.item, n]);
+    if (items.length) tg.sendData(JSON.stringify(items));
+  });
+}
+</script></body></html>
+"""
+
+ITEM = """<div class="item" data-cat="{cat}" data-item="{item}" data-price="{price}">{image}
+<div class="info"><b>{name}</b><div class="desc">{desc}</div><div>{price} 💋</div>
+<div class="qty"><button class="minus">−</button><span class="count"></span><button class="plus">+</button></div></div></div>"""
+
+
+class CatalogBuilder:
+    def __init__(self, directory, photos_dir, thumb_size=320, skip=()):
+        self.directory = Path(directory)
+        self.thumbs_dir = self.directory / 'thumbs'
+        self.photos_dir = Path(photos_dir)
+        self.thumb_size = thumb_size
+        self.skip = set(skip)
+        # Категории, изменившиеся после последней сборки
+        self.dirty = set()
+        # cat_id -> готовый HTML раздела и миниатюры, на которые он ссылается
+        self.sections = {}
+        self.section_thumbs = {}
+        # путь фото -> (mtime_ns, размер, хеш): неизменённые фото не перечитываются
+        self.digests = {}
+        self.page = None
+
+    def invalidate(self, categories):
+        self.dirty.update(categories)
+
+    def take(self, menu, hidden=None):
+        # Копия изменившихся категорий для сборки в потоке: вызывается в цикле
+        # событий, пока меню не может поменяться. hidden(item_id) — не показывать
+        dirty, self.dirty = self.dirty, set()
+        return {
+            cat_id: {
+                item_id: dict(item) for item_id, item in menu.get(cat_id, {}).items()
+                if hidden is None or not hidden(item_id)
+            }
+            for cat_id in dirty
+        }
+
+    # ---------- сборка ----------
+
+    def build(self, changed, categories):
+        # changed — результат take(), categories — {cat_id: название} в порядке показа
+        self.thumbs_dir.mkdir(parents=True, exist_ok=True)
+        created = 0
+        for cat_id, items in changed.items():
+            if cat_id in self.skip or cat_id not in categories or not items:
+                self.sections.pop(cat_id, None)
+                self.section_thumbs.pop(cat_id, None)
+                continue
+            html, thumbs, made = self._render_section(cat_id, categories[cat_id], items)
+            self.sections[cat_id] = html
+            self.section_thumbs[cat_id] = thumbs
+            created += made
+
+        shown = [cat_id for cat_id in categories if cat_id in self.sections]
+        nav = ''.join(f'<a href="#{escape(cat_id)}">{escape(categories[cat_id])}</a>' for cat_id in shown)
+        content = f'<nav>{nav}</nav>\n' + '\n'.join(self.sections[cat_id] for cat_id in shown)
+        page = PAGE.replace('CONTENT', content, 1).encode()
+        written = page != self.page
+        if written:
+            self._write(self.directory / 'index.html', page)
+            self.page = page
+        removed = self._remove_unused()
+        return {'sections': len(changed), 'thumbs': created, 'removed': removed, 'written': written}
+
+    def _render_section(self, cat_id, title, items):
+        parts, thumbs, created = [], set(), 0
+        for item_id, item in items.items():
+            thumb, made = self._thumb(item.get('photo'))
+            created += made
+            if thumb:
+                thumbs.add(thumb)
+                image = f'<img src="thumbs/{thumb}" loading="lazy" alt="">'
+            else:
+                image = '<div class="nophoto"></div>'
+            parts.append(ITEM.format(
+                cat=escape(cat_id), item=escape(item_id), price=int(item['price']), image=image,
+                name=escape(item['name']), desc=escape(item.get('desc') or '')
+            ))
+        html = f'<h2 id="{escape(cat_id)}">{escape(title)}</h2>\n' + '\n'.join(parts)
+        return html, thumbs, created
+
+    # ---------- миниатюры ----------
+
+    def _digest(self, path, rel):
+        stat = path.stat()
+        cached = self.digests.get(rel)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        # У фото из хранилища имя и есть sha256 содержимого
+        stem = path.stem
+        if rel.startswith('blobs/') and len(stem) == 64:
+            digest = stem
+        else:
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        self.digests[rel] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def _thumb(self, rel):
+        # Возвращает (имя миниатюры или None, создана ли новая)
+        if not rel:
+            return None, 0
+        path = self.photos_dir / rel
+        try:
+            digest = self._digest(path, rel)
+        except OSError:
+            return None, 0
+        ext = 'jpg' if Image is not None else (path.suffix.lower().lstrip('.') or 'jpg')
+        name = f"{digest[:16]}-{self.thumb_size}.{ext}"
+        target = self.thumbs_dir / name
+        if target.exists():
+            return name, 0
+        tmp = target.with_name(f"{name}.{os.getpid()}.tmp")
+        try:
+            if Image is not None:
+                with Image.open(path) as image:
+                    image = image.convert('RGB')
+                    image.thumbnail((self.thumb_size, self.thumb_size))
+                    image.save(tmp, 'JPEG', quality=82, optimize=True, progressive=True)
+            else:
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, target)
+        except Exception as e:
+            tmp.unlink(missing_ok=True)
+            logger.error("Не удалось сделать миниатюру %s: %s", rel, e)
+            return None, 0
+        return name, 1
+
+    def _remove_unused(self):
+        used = set().union(*self.section_thumbs.values()) if self.section_thumbs else set()
+        removed = 0
+        for path in self.thumbs_dir.iterdir():
+            if path.name not in used:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    @staticmethod
+    def _write(path, data):
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+
+# ====================== РАЗДАЧА ======================
+
+def build_app(directory):
+    directory = Path(directory)
+
+    async def index(request):
+        path = directory / 'index.html'
+        if not path.exists():
+            return web.Response(status=503, text='каталог ещё собирается')
+        # Всегда проверять свежесть: FileResponse отвечает 304 по ETag
+        return web.FileResponse(path, headers={'Cache-Control': 'no-cache'})
+
+    async def thumb(request):
+        name = request.match_info['name']
+        path = directory / 'thumbs' / name
+        if not THUMB_NAME.fullmatch(name) or not path.exists():
+            raise web.HTTPNotFound()
+        return web.FileResponse(path, headers={'Cache-Control': IMMUTABLE})
+
+    app = web.Application()
+    app.router.add_get('/', index)
+    app.router.add_get('/thumbs/{name}', thumb)
+    return app
+
+
+async def start(app, host, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Каталог Web App: http://%s:%s/", host, port)
+    return runner
+
+
+def parse_batch(data, limit=50):
+    # web_app_data -> [(cat_id, item_id, количество)]; неразборчивое отбрасывается
+    try:
+        rows = json_codec.loads(data)
+    except ValueError:
+        return []
+    if not isinstance(rows, list):
+        return []
+    batch = []
+    for row in rows[:200]:
+        if (
+            isinstance(row, list) and len(row) == 3
+            and isinstance(row[0], str) and isinstance(row[1], str)
+            and isinstance(row[2], int) and not isinstance(row[2], bool) and row[2] > 0
+        ):
+            batch.append((row[0], row[1], min(row[2], limit)))
+    return batch
@@ -0,0 +1,196 @@
+import os
+import sys
+import zlib
+import time
+import signal
+import asyncio
+import argparse
+import subprocess
+from pathlib import Path
+from aiohttp import web, ClientSession, ClientTimeout, ClientError
+
+# Кластерный режим: фронт принимает вебхук Telegram и раскладывает апдейты по
+# N процессам-воркерам по from_user.id. Воркер владеет корзинами и FSM своих
+# пользователей, меню и заказы лежат в общем SQLite (STORE_BACKEND=sqlite).
+#
+#   python cluster.py run --workers 4 --port 8080 --webhook-url https://example.com/webhook
+
+BASE_DIR = Path(__file__).parent
+WORKER_BASE_PORT = int(os.getenv('WORKER_BASE_PORT', '18100'))
+
+# Ключи апдейта, в которых есть from
+USER_KEYS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'my_chat_member', 'chat_member', 'chat_join_request'
+)
+
+
+def extract_user_id(update):
+    for key in USER_KEYS:
+        event = update.get(key)
+        if event and 'from' in event:
+            return event['from']['id']
+    return 0
+
+
+def shard_for(user_id, workers):
+    return zlib.crc32(str(user_id).encode()) % workers
+
+
+# ====================== ВОРКЕР ======================
+
+def run_worker(port):
+    sys.path.insert(0, str(BASE_DIR))
+    import bot as bot_module
+    from aiogram.types import Update
+
+    async def handle_update(request):
+        update = Update.model_validate(await request.json(), context={'bot': bot_module.bot})
+        await bot_module.dp.feed_update(bot_module.bot, update)
+        return web.Response(text='ok')
+
+    async def on_startup(app):
+        await bot_module.dp.emit_startup(bot=bot_module.bot)
+
+    async def on_shutdown(app):
+        await bot_module.dp.emit_shutdown(bot=bot_module.bot)
+        await bot_module.bot.session.close()
+
+    app = web.Application()
+    app.router.add_post('/update', handle_update)
+    app.router.add_get('/health', lambda request: web.Response(text='ok'))
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    web.run_app(app, host='127.0.0.1', port=port, print=None)
+
+
+# ====================== ФРОНТ ======================
+
+def build_front(workers, webhook_path='/webhook', secret=None):
+    worker_urls = [f"http://127.0.0.1:{WORKER_BASE_PORT + i}/update" for i in range(workers)]
+    state = {}
+
+    async def handle_webhook(request):
+        if secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+            return web.Response(status=401)
+        update = await request.json()
+        url = worker_urls[shard_for(extract_user_id(update), workers)]
+        try:
+            async with state['session'].post(url, json=update) as resp:
+                return web.Response(status=resp.status)
+        except ClientError:
+            # Telegram повторит доставку, если ответить ошибкой
+            return web.Response(status=502)
+
+    async def on_startup(app):
+        state['session'] = ClientSession(timeout=ClientTimeout(total=60))
+
+    async def on_cleanup(app):
+        await state['session'].close()
+
+    app = web.Application()
+    app.router.add_post(webhook_path, handle_webhook)
+    app.router.add_get('/health', lambda request: web.Response(text='ok'))
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+async def wait_ready(url, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    async with ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status == 200:
+                        return
+            except ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} не поднялся за {timeout} с")
+
+
+def migrate_store():
+    # Перенос JSON в общий SQLite и старых фото в хранилище блобов делаем один раз
+    # до старта воркеров, а не в каждом из них
+    sys.path.insert(0, str(BASE_DIR))
+    from stores import SqliteStore
+    from photo_store import PhotoStore
+    data_dir = Path(os.getenv('DATA_DIR', BASE_DIR / 'data'))
+    store = SqliteStore(data_dir / 'shared.sqlite3', data_dir)
+    store.load()
+    menu, _ = store.load_menu()
+    if PhotoStore(data_dir / 'photos').migrate_legacy(menu):
+        store.save_menu(menu)
+
+
+def spawn_workers(workers, env=None):
+    processes = []
+    for i in range(workers):
+        worker_env = dict(env or os.environ)
+        worker_env.update({'WORKER_ID': str(i), 'STORE_BACKEND': 'sqlite'})
+        processes.append(subprocess.Popen(
+            [sys.executable, __file__, 'worker', '--port', str(WORKER_BASE_PORT + i)],
+            env=worker_env
+        ))
+    return processes
+
+
+def stop_workers(processes):
+    for process in processes:
+        process.send_signal(signal.SIGINT)
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def set_webhook(url, secret):
+    from aiogram import Bot
+    from dotenv import load_dotenv
+    load_dotenv()
+    bot = Bot(token=os.getenv('TELEGRAM_BOT_TOKEN'))
+    try:
+        await bot.set_webhook(url, secret_token=secret, drop_pending_updates=False)
+    finally:
+        await bot.session.close()
+
+
+def cmd_run(args):
+    migrate_store()
+    processes = spawn_workers(args.workers)
+    try:
+        for i in range(args.workers):
+            asyncio.run(wait_ready(f"http://127.0.0.1:{WORKER_BASE_PORT + i}/health"))
+        if args.webhook_url:
+            asyncio.run(set_webhook(args.webhook_url, args.secret))
+        app = build_front(args.workers, args.path, args.secret)
+        web.run_app(app, host=args.host, port=args.port, print=None)
+    finally:
+        stop_workers(processes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Кластерный режим бота кафе «Кацулька»")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help="фронт с вебхуком и N воркеров")
+    p.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    p.add_argument('--host', default='0.0.0.0')
+    p.add_argument('--port', type=int, default=8080)
+    p.add_argument('--path', default='/webhook')
+    p.add_argument('--webhook-url', default=os.getenv('WEBHOOK_URL'))
+    p.add_argument('--secret', default=os.getenv('WEBHOOK_SECRET'))
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser('worker')
+    p.add_argument('--port', type=int, required=True)
+    p.set_defaults(func=lambda args: run_worker(args.port))
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import hmac
+import logging
+from aiohttp import web
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+# Панель администратора в браузере: открытые заказы, собираемые корзины и
+# последние заявки специальных категорий.
+#
+#   GET /        — страница (без внешних скриптов и стилей)
+#   GET /state   — снимок в JSON, в нём номер последнего события seq
+#   GET /events  — поток server-sent events с событиями после seq
+#
+# Страница один раз читает снимок, дальше только применяет события из потока:
+# опроса нет. Доступ — по адресу (по умолчанию только 127.0.0.1) и, если задан,
+# по токену в параметре ?token=.
+
+KEEPALIVE = 15.0
+
+PAGE = """<!doctype html>
+<html lang="ru"><head><meta charset="utf-8"><title>Кацулька — заказы</title>
+<style>
+body{font:14px sans-serif;margin:16px;background:#fafafa}
+h2{margin:18px 0 6px}
+table{border-collapse:collapse;width:100%;background:#fff}
+td,th{border:1px solid #ddd;padding:4px 8px;text-align:left;vertical-align:top}
+.new{background:#fff7d6}.cooking{background:#e3f0ff}.ready{background:#e4f7e4}
+#status{color:#888}
+</style></head><body>
+<div id="status">подключение…</div>
+<h2>Открытые заказы <span id="orders-count"></span></h2>
+<table><thead><tr><th>№</th><th>Статус</th><th>Клиент</th><th>Создан</th><th>Позиции</th><th>Итого</th></tr></thead>
+<tbody id="orders"></tbody></table>
+<h2>Корзины <span id="carts-count"></span></h2>
+<table><thead><tr><th>Клиент</th><th>Позиции</th><th>Итого</th><th>Изменена</th></tr></thead>
+<tbody id="carts"></tbody></table>
+<h2>Заявки специальных категорий</h2>
+<table><thead><tr><th>Когда</th><th>Сценарий</th><th>Клиент</th><th>Текст</th></tr></thead>
+<tbody id="specials"></tbody></table>
+<script>
+const token = new URLSearchParams(location.search).get('token') || '';
+const q = token ? '&token=' + encodeURIComponent(token) : '';
+const open = new Set(OPEN_STATUSES);
+let orders = {}, carts = {}, specials = [], source = null;
+
+function esc(s) { return String(s ?? '').replace(/[&<>"]/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;'}[c])); }
+function lines(items) { return items.map(([name, count]) => esc(name) + ' ×' + count).join('<br>'); }
+function time(iso) { return iso ? iso.slice(5, 16).replace('T', ' ') : ''; }
+
+function render() {
+  const list = Object.values(orders).sort((a, b) => (a.created_at || '').localeCompare(b.created_at || ''));
+  document.getElementById('orders-count').textContent = '(' + list.length + ')';
+  document.getElementById('orders').innerHTML = list.map(o =>
+    `<tr class="${o.status}"><td>${esc(o.id)}</td><td>${esc(STATUS_LABELS[o.status] || o.status)}</td>` +
+    `<td>${esc(o.user_id)}</td><td>${time(o.created_at)}</td><td>${lines(o.items)}</td><td>${o.total}</td></tr>`).join('');
+  const cartList = Object.values(carts).sort((a, b) => (b.updated_at || '').localeCompare(a.updated_at || ''));
+  document.getElementById('carts-count').textContent = '(' + cartList.length + ')';
+  document.getElementById('carts').innerHTML = cartList.map(c =>
+    `<tr><td>${esc(c.user_id)}</td><td>${lines(c.items)}</td><td>${c.total}</td><td>${time(c.updated_at)}</td></tr>`).join('');
+  document.getElementById('specials').innerHTML = specials.map(s =>
+    `<tr><td>${time(s.at)}</td><td>${esc(s.scenario)}</td><td>${esc(s.user)}</td><td>${esc(s.text)}</td></tr>`).join('');
+}
+
+function order(o) { if (open.has(o.status)) orders[o.id] = o; else delete orders[o.id]; }
+function cart(c) { if (c.items.length) carts[c.user_id] = c; else delete carts[c.user_id]; }
+
+async function load() {
+  if (source) source.close();
+  const state = await (await fetch('state?' + q.slice(1))).json();
+  orders = {}; carts = {};
+  state.orders.forEach(order); state.carts.forEach(cart); specials = state.specials;
+  render();
+  source = new EventSource('events?since=' + encodeURIComponent(state.seq) + q);
+  source.onopen = () => document.getElementById('status').textContent = 'онлайн';
+  source.onerror = () => document.getElementById('status').textContent = 'переподключение…';
+  source.addEventListener('order', e => { order(JSON.parse(e.data)); render(); });
+  source.addEventListener('cart', e => { cart(JSON.parse(e.data)); render(); });
+  source.addEventListener('special_request', e => { specials.unshift(JSON.parse(e.data)); specials.length = Math.min(specials.length, 50); render(); });
+  source.addEventListener('reset', () => load());
+}
+load();
+</script></body></html>
+"""
+
+
+def build_app(bus, snapshot, token=None, open_statuses=(), status_labels=None):
+    page = (
+        PAGE
+        .replace('OPEN_STATUSES', json_codec.dumps(list(open_statuses)).decode())
+        .replace('STATUS_LABELS', json_codec.dumps(status_labels or {}).decode())
+    ).encode()
+
+    @web.middleware
+    async def check_token(request, handler):
+        if token and not hmac.compare_digest(request.query.get('token', ''), token):
+            return web.Response(status=403, text='forbidden')
+        return await handler(request)
+
+    async def index(request):
+        return web.Response(body=page, content_type='text/html', charset='utf-8')
+
+    async def state(request):
+        data = snapshot()
+        data['seq'] = bus.cursor
+        return web.Response(body=json_codec.dumps(data), content_type='application/json')
+
+    async def events(request):
+        since = request.headers.get('Last-Event-ID') or request.query.get('since')
+        subscriber, missed = bus.subscribe(since or None)
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+        try:
+            await response.prepare(request)
+            # Журнал не покрывает пропущенное: пусть страница перечитает снимок
+            await response.write(b''.join(missed) if missed is not None else b'event: reset\ndata: {}\n\n')
+            while True:
+                batch = await subscriber.next_batch(KEEPALIVE)
+                if batch is None:
+                    break
+                await response.write(b''.join(batch) if batch else b': keepalive\n\n')
+        except (ConnectionResetError, ConnectionError):
+            pass
+        finally:
+            bus.unsubscribe(subscriber)
+        return response
+
+    app = web.Application(middlewares=[check_token])
+    app.router.add_get('/', index)
+    app.router.add_get('/state', state)
+    app.router.add_get('/events', events)
+    return app
+
+
+async def start(app, host, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Панель администратора: http://%s:%s/", host, port)
+    return runner
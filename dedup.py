@@ -0,0 +1,113 @@
+import time
+import logging
+from collections import OrderedDict
+from aiogram import BaseMiddleware
+import json_codec
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Повторно доставленные и повторённые апдейты отсекаются до хендлеров.
+#
+# Ключи:
+#   ('update', update_id) — Telegram прислал тот же апдейт ещё раз (медленный
+#     ответ вебхука, перезапуск при поллинге);
+#   ('tap', user_id, message_id, edit_date, data) — та же кнопка на той же версии
+#     сообщения нажата снова. Только для кнопок, которые нельзя выполнять дважды
+#     (оформление заказа, смена статуса, подтверждения): «добавить» можно жать
+#     сколько угодно. edit_date меняется при каждой правке экрана, поэтому кнопка
+#     на обновлённом экране — уже новое нажатие.
+#
+# Ключи живут ttl секунд, всего не больше max_size. Если задан path, хвост
+# сохраняется в файл и читается при запуске: апдейты, которые Telegram пришлёт
+# заново после перезапуска, тоже отсекаются.
+
+
+class UpdateDeduplicator(BaseMiddleware):
+    def __init__(self, ttl=600.0, max_size=50000, once_callbacks=(), once_prefixes=(), path=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.once_callbacks = set(once_callbacks)
+        self.once_prefixes = tuple(once_prefixes)
+        self.path = path
+        # ключ -> момент истечения; ttl у всех одинаковый, поэтому порядок вставки
+        # совпадает с порядком истечения и старые ключи всегда в начале
+        self.seen = OrderedDict()
+        self.dirty = False
+
+    def _tap_key(self, update):
+        call = update.callback_query
+        if call is None or not call.data or call.message is None:
+            return None
+        if call.data not in self.once_callbacks and not call.data.startswith(self.once_prefixes):
+            return None
+        edit_date = getattr(call.message, 'edit_date', None)
+        return ('tap', call.from_user.id, call.message.message_id, edit_date, call.data)
+
+    def _expire(self, now):
+        while self.seen:
+            key, expires = next(iter(self.seen.items()))
+            if expires > now and len(self.seen) <= self.max_size:
+                break
+            self.seen.popitem(last=False)
+
+    def _remember(self, key, now):
+        self.seen[key] = now + self.ttl
+        self.dirty = True
+
+    async def __call__(self, handler, event, data):
+        now = time.time()
+        self._expire(now)
+
+        update_key = ('update', event.update_id)
+        tap_key = self._tap_key(event)
+        for kind, key in (('update', update_key), ('tap', tap_key)):
+            if key is not None and key in self.seen:
+                metrics.inc('dedup_hits_total', kind=kind)
+                logger.info("Повторный апдейт пропущен: %s", key)
+                if event.callback_query is not None:
+                    await self._answer(event.callback_query)
+                return None
+
+        self._remember(update_key, now)
+        if tap_key is not None:
+            self._remember(tap_key, now)
+        try:
+            return await handler(event, data)
+        except Exception:
+            # Упавшее нажатие можно повторить
+            if tap_key is not None:
+                self.seen.pop(tap_key, None)
+            raise
+
+    async def _answer(self, call):
+        try:
+            await call.answer()
+        except Exception as e:
+            logger.debug("Не удалось ответить на повторный callback: %s", e)
+
+    # ---------- хвост на диске ----------
+
+    def load(self):
+        if not self.path:
+            return 0
+        try:
+            entries = json_codec.read_file(self.path)
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            logger.error("Ошибка загрузки %s: %s", self.path, e)
+            return 0
+        now = time.time()
+        for key, expires in entries:
+            if expires > now:
+                self.seen[tuple(key)] = expires
+        self._expire(now)
+        return len(self.seen)
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        self._expire(time.time())
+        self.dirty = False
+        json_codec.write_file(self.path, [[list(key), expires] for key, expires in self.seen.items()])
@@ -0,0 +1,250 @@
+import os
+import json
+import asyncio
+import time
+import itertools
+from collections import Counter
+from aiohttp import web
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update, FSInputFile, BufferedInputFile
+
+# Заглушка Telegram Bot API для бенчмарков и нагрузочных прогонов:
+# запросы не уходят в сеть, а считаются и получают правдоподобный ответ.
+
+MESSAGE_METHODS = {
+    'sendMessage', 'sendPhoto', 'editMessageText', 'editMessageCaption',
+    'editMessageMedia', 'editMessageReplyMarkup', 'sendDocument'
+}
+
+_message_ids = itertools.count(1000)
+_file_ids = itertools.count(1)
+
+
+def _file_size(input_file):
+    if isinstance(input_file, FSInputFile):
+        try:
+            return os.path.getsize(input_file.path)
+        except OSError:
+            return 0
+    if isinstance(input_file, BufferedInputFile):
+        return len(input_file.data)
+    return 0
+
+
+def fake_result(api_method, params):
+    if api_method in MESSAGE_METHODS:
+        chat_id = params.get('chat_id') or 1
+        result = {
+            'message_id': int(params.get('message_id') or next(_message_ids)),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+        }
+        if api_method in ('sendPhoto', 'editMessageMedia'):
+            file_id = f"fake_photo_{next(_file_ids)}"
+            result['photo'] = [{
+                'file_id': file_id, 'file_unique_id': file_id, 'width': 800, 'height': 600
+            }]
+            result['caption'] = params.get('caption')
+        elif api_method == 'sendDocument':
+            file_id = f"fake_doc_{next(_file_ids)}"
+            result['document'] = {'file_id': file_id, 'file_unique_id': file_id}
+        else:
+            result['text'] = params.get('text') or params.get('caption') or ''
+        return result
+    if api_method == 'getMe':
+        return {'id': 1, 'is_bot': True, 'first_name': 'Кацулька', 'username': 'katsulka_bot'}
+    if api_method == 'getFile':
+        return {'file_id': params['file_id'], 'file_unique_id': params['file_id'], 'file_path': 'photos/file.jpg'}
+    return True
+
+
+class FakeSession(BaseSession):
+    def __init__(self, latency=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.calls = Counter()
+        self.bytes_sent = Counter()
+        self.log = []
+        # (chat_id, message_id) -> фото сообщения или None для текста: правки проверяются как в Telegram
+        self.messages = {}
+        self.last_message = {}
+
+    def reset(self):
+        self.calls.clear()
+        self.bytes_sent.clear()
+        self.log.clear()
+
+    def _check_edit(self, api_method, params):
+        key = (params.get('chat_id'), params.get('message_id'))
+        if key not in self.messages:
+            return None
+        if api_method == 'editMessageText' and self.messages[key]:
+            return "Bad Request: there is no text in the message to edit"
+        if api_method in ('editMessageCaption', 'editMessageMedia') and not self.messages[key]:
+            return "Bad Request: there is no media in the message to edit"
+        return None
+
+    def _remember(self, api_method, params, result):
+        if api_method == 'deleteMessage':
+            self.messages.pop((params.get('chat_id'), params.get('message_id')), None)
+        elif isinstance(result, dict) and 'message_id' in result:
+            chat_id = result['chat']['id']
+            self.messages[(chat_id, result['message_id'])] = result.get('photo')
+            self.last_message[chat_id] = result['message_id']
+
+    def payload_size(self, bot, method):
+        files = {}
+        size = 0
+        for key, value in method.model_dump(warnings=False).items():
+            prepared = self.prepare_value(value, bot=bot, files=files)
+            if prepared:
+                size += len(key) + len(str(prepared).encode('utf-8'))
+        return size + sum(_file_size(f) for f in files.values())
+
+    async def make_request(self, bot, method, timeout=None):
+        api_method = method.__api_method__
+        self.calls[api_method] += 1
+        self.bytes_sent[api_method] += self.payload_size(bot, method)
+        self.log.append(api_method)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = {key: getattr(method, key, None) for key in ('chat_id', 'message_id', 'text', 'caption', 'file_id')}
+        error = self._check_edit(api_method, params)
+        if error:
+            content = json.dumps({'ok': False, 'error_code': 400, 'description': error})
+            self.check_response(bot=bot, method=method, status_code=400, content=content)
+        result = fake_result(api_method, params)
+        photo = self.messages.get((params['chat_id'], params['message_id']))
+        if api_method in ('editMessageCaption', 'editMessageReplyMarkup') and photo:
+            # Подпись и кнопки правятся у того же фото
+            result.pop('text', None)
+            result.update(caption=params['caption'] or '', photo=photo)
+        self._remember(api_method, params, result)
+        content = json.dumps({'ok': True, 'result': result})
+        response = self.check_response(bot=bot, method=method, status_code=200, content=content)
+        return response.result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+class FakeTelegramServer:
+    # Локальный HTTP-сервер с API как у Telegram: для проверок нескольких процессов,
+    # которые ходят в «Telegram» через TELEGRAM_API_URL
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.requests = []
+        self.url = None
+        self._runner = None
+        # api_method -> [(вид сбоя, параметры)] — сбои для следующих запросов
+        self.faults = {}
+
+    def inject(self, api_method, kind, times=1, **options):
+        # kind: 'retry_after' (429), 'timeout' (ответ через delay секунд), 'server_error' (500)
+        self.faults.setdefault(api_method, []).extend([(kind, options)] * times)
+
+    async def handle(self, request):
+        api_method = request.match_info['method']
+        params = {}
+        if request.can_read_body:
+            for key, value in (await request.post()).items():
+                params[key] = value if isinstance(value, str) else f"<file {value.filename}>"
+        # ID бота из токена: несколько ботов в одном процессе ходят в одну заглушку
+        params['_bot'] = request.match_info['token'].split(':')[0]
+        self.requests.append((api_method, params))
+
+        faults = self.faults.get(api_method)
+        if faults:
+            kind, options = faults.pop(0)
+            if kind == 'retry_after':
+                retry_after = options.get('retry_after', 1)
+                return web.json_response({
+                    'ok': False, 'error_code': 429,
+                    'description': f"Too Many Requests: retry after {retry_after}",
+                    'parameters': {'retry_after': retry_after}
+                }, status=429)
+            if kind == 'server_error':
+                return web.json_response(
+                    {'ok': False, 'error_code': 500, 'description': "Internal Server Error"}, status=500
+                )
+            if kind == 'timeout':
+                await asyncio.sleep(options.get('delay', 5))
+        return web.json_response({'ok': True, 'result': fake_result(api_method, params)})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        self.url = f"http://{self.host}:{self.port}"
+        return self
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def calls(self, api_method, **match):
+        return [
+            params for name, params in self.requests
+            if name == api_method and all(str(params.get(k)) == str(v) for k, v in match.items())
+        ]
+
+
+# ====================== КОНСТРУКТОРЫ АПДЕЙТОВ ======================
+
+_update_ids = itertools.count(1)
+
+
+def _user(user_id):
+    return {'id': int(user_id), 'is_bot': False, 'first_name': f"user{user_id}", 'username': f"user{user_id}"}
+
+
+def message_update(user_id, text, bot=None, update_id=None, raw=False):
+    data = {
+        'update_id': update_id or next(_update_ids),
+        'message': {
+            'message_id': next(_message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(user_id), 'type': 'private'},
+            'from': _user(user_id),
+            'text': text,
+        }
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        data['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    if raw:
+        return data
+    return Update.model_validate(data, context={'bot': bot})
+
+
+def callback_update(user_id, callback_data, bot=None, message_id=None, update_id=None, raw=False, photo=False):
+    data = {
+        'update_id': update_id or next(_update_ids),
+        'callback_query': {
+            'id': str(next(_update_ids)),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': callback_data,
+            'message': {
+                'message_id': message_id or next(_message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(user_id), 'type': 'private'},
+                'text': '…',
+            },
+        }
+    }
+    if photo:
+        message = data['callback_query']['message']
+        del message['text']
+        message['photo'] = [{'file_id': 'fake_photo', 'file_unique_id': 'fake_photo', 'width': 800, 'height': 600}]
+    if raw:
+        return data
+    return Update.model_validate(data, context={'bot': bot})
@@ -0,0 +1,143 @@
+from collections import Counter
+
+# Остатки позиций: сколько порций есть на кухне. Позиция без остатка не
+# ограничена; остатки задаёт админ командой /stock.
+#
+#   stock    — item_id -> порций на кухне (уменьшается при оформлении заказа)
+#   reserved — item_id -> порций, лежащих в корзинах этого процесса
+#   доступно — stock - reserved
+#
+# Все операции синхронные и без await: в цикле событий проверка и изменение
+# счётчика идут подряд, и две корзины не заберут одну последнюю порцию.
+# Резервы не сохраняются — они пересчитываются из корзин при запуске.
+#
+# На диск остатки пишутся пачкой (take() + apply()), а не на каждое нажатие:
+# между записями копятся заданные админом уровни и проданные порции. В кластере
+# хранилище применяет продажи всех воркеров к общему остатку, и после записи
+# воркер получает свежие уровни; в промежутке между записями воркеры видят
+# только свои продажи.
+
+
+class Inventory:
+    def __init__(self, on_change=None):
+        self.stock = {}
+        self.reserved = Counter()
+        # Изменения с последней записи: заданные уровни (None — без учёта) и продажи
+        self.levels = {}
+        self.sold = Counter()
+        # Вызывается с item_id, когда позиция закончилась или снова появилась
+        self.on_change = on_change
+
+    def load(self, stock, carts):
+        self.stock = dict(stock)
+        self.reserved = Counter()
+        for cart in carts.values():
+            for item_id, line in cart.items.items():
+                self.reserved[item_id] += line.count
+
+    # ---------- чтение ----------
+
+    def tracked(self, item_id):
+        return item_id in self.stock
+
+    def available(self, item_id):
+        # None — позиция не ограничена
+        if item_id not in self.stock:
+            return None
+        return max(0, self.stock[item_id] - self.reserved[item_id])
+
+    def sold_out(self, item_id):
+        return self.available(item_id) == 0
+
+    # ---------- корзины ----------
+
+    def reserve(self, item_id, count=1):
+        # Резервирует до count порций, возвращает сколько получилось
+        available = self.available(item_id)
+        if available is not None:
+            count = min(count, available)
+        if count <= 0:
+            return 0
+        self._change(item_id, lambda: self.reserved.update({item_id: count}))
+        return count
+
+    def release(self, item_id, count):
+        self._change(item_id, lambda: self._unreserve(item_id, count))
+
+    def release_cart(self, cart):
+        if cart is not None:
+            for item_id, line in cart.items.items():
+                self.release(item_id, line.count)
+
+    def commit_cart(self, cart):
+        # Заказ оформлен: резерв становится продажей. Резерв и остаток меняются
+        # за один шаг — позиция не мелькает доступной между ними
+        for item_id, line in cart.items.items():
+            self._change(item_id, lambda: self._sell(item_id, line.count))
+
+    def _unreserve(self, item_id, count):
+        left = self.reserved[item_id] - count
+        if left > 0:
+            self.reserved[item_id] = left
+        else:
+            self.reserved.pop(item_id, None)
+
+    def _sell(self, item_id, count):
+        self._unreserve(item_id, count)
+        if item_id in self.stock:
+            self.stock[item_id] = max(0, self.stock[item_id] - count)
+            self.sold[item_id] += count
+
+    # ---------- админ ----------
+
+    def set_level(self, item_id, level):
+        def apply():
+            if level is None:
+                self.stock.pop(item_id, None)
+            else:
+                self.stock[item_id] = level
+        self._change(item_id, apply)
+        self.levels[item_id] = level
+        # Новый уровень уже учитывает всё проданное до него
+        self.sold.pop(item_id, None)
+
+    def _change(self, item_id, apply):
+        was = self.sold_out(item_id)
+        apply()
+        if self.on_change is not None and self.sold_out(item_id) != was:
+            self.on_change(item_id)
+
+    # ---------- запись ----------
+
+    @property
+    def dirty(self):
+        return bool(self.levels or self.sold)
+
+    def take(self):
+        # Снимок для записи в потоке: (все остатки, заданные уровни, продажи)
+        levels, sold = self.levels, self.sold
+        self.levels, self.sold = {}, Counter()
+        return dict(self.stock), levels, sold
+
+    def apply(self, saved):
+        # saved — остатки из хранилища после записи. Что изменилось, пока шла
+        # запись, поверх них накладывается заново
+        for item_id in set(self.stock) | set(saved):
+            if item_id in self.levels:
+                continue
+            level = saved.get(item_id)
+            self._change(item_id, lambda: self._set_saved(item_id, level))
+
+    def _set_saved(self, item_id, level):
+        if level is None:
+            self.stock.pop(item_id, None)
+        else:
+            self.stock[item_id] = max(0, level - self.sold[item_id])
+
+    def restore(self, levels, sold):
+        # Запись не удалась: изменения вернутся в следующую пачку
+        for item_id, level in levels.items():
+            self.levels.setdefault(item_id, level)
+        for item_id, count in sold.items():
+            if item_id not in self.levels or item_id in levels:
+                self.sold[item_id] += count
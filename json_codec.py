@@ -0,0 +1,49 @@
+import os
+import json
+
+# Кодек JSON для файлов данных: orjson, если установлен, иначе стандартный json.
+# JSON_CODEC=stdlib принудительно включает стандартный модуль.
+try:
+    if os.getenv('JSON_CODEC', 'auto') == 'stdlib':
+        raise ImportError
+    import orjson
+except ImportError:
+    orjson = None
+
+CODEC_NAME = 'orjson' if orjson else 'stdlib'
+
+
+def _default(obj):
+    # Модели из models.py пишутся в своём JSON-виде
+    to_dict = getattr(obj, 'to_dict', None)
+    if to_dict is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return to_dict()
+
+
+def dumps(obj, compact=True):
+    if orjson:
+        option = orjson.OPT_PASSTHROUGH_DATACLASS | (0 if compact else orjson.OPT_INDENT_2)
+        return orjson.dumps(obj, default=_default, option=option)
+    if compact:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, indent=2, default=_default).encode('utf-8')
+
+
+def loads(data):
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def write_file(path, obj, compact=True):
+    # Пишем во временный файл и подменяем, чтобы не оставить обрезанный JSON при падении
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(dumps(obj, compact))
+    os.replace(tmp_path, path)
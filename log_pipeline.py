@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+# Контекст текущего апдейта: проставляется мидлварью бота и попадает в каждую запись
+log_user_id = contextvars.ContextVar('log_user_id', default=None)
+log_route = contextvars.ContextVar('log_route', default=None)
+
+# Поля, которые переносим из record в JSON, если они заданы через extra=...
+EXTRA_FIELDS = ('user_id', 'route', 'latency_ms', 'suppressed')
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class ContextQueueHandler(QueueHandler):
+    # Стандартный QueueHandler форматирует сообщение прямо в потоке цикла событий.
+    # Нам нужно только снять контекст, а форматирование делает поток-слушатель.
+    def prepare(self, record):
+        if getattr(record, 'user_id', None) is None:
+            record.user_id = log_user_id.get()
+        if getattr(record, 'route', None) is None:
+            record.route = log_route.get()
+        return record
+
+
+class RepeatSampler(logging.Filter):
+    # Ограничение одинаковых ошибок: не больше `burst` записей с одним ключом за `window` секунд.
+    # Количество отброшенных записей прикладывается к следующей пропущенной.
+    def __init__(self, burst=5, window=60.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+
+        exc_type = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else None
+        key = (record.name, record.msg, exc_type)
+        now = time.monotonic()
+
+        with self._lock:
+            started, passed, dropped = self._buckets.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                started, passed = now, 0
+            if passed >= self.burst:
+                self._buckets[key] = (started, passed, dropped + 1)
+                return False
+            self._buckets[key] = (started, passed + 1, 0)
+
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+
+_listener = None
+
+
+def setup_logging(level=None, fmt=None, log_file=None):
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    level = level or os.getenv('LOG_LEVEL', 'INFO')
+    fmt = fmt or os.getenv('LOG_FORMAT', 'json')
+    log_file = log_file or os.getenv('LOG_FILE')
+
+    if fmt == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = ContextQueueHandler(log_queue)
+    queue_handler.addFilter(RepeatSampler(
+        burst=int(os.getenv('LOG_SAMPLE_BURST', '5')),
+        window=float(os.getenv('LOG_SAMPLE_WINDOW', '60'))
+    ))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
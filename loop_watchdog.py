@@ -0,0 +1,153 @@
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from pathlib import Path
+from datetime import datetime
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сторож цикла событий: замечает, когда синхронный код надолго занимает цикл.
+#
+# Задача в цикле каждые interval секунд просыпается и записывает, насколько
+# проснулась позже, чем просила (лаг) — это метрика event_loop_lag_seconds.
+# Отдельный поток следит за её пульсом: если цикл молчит дольше threshold, поток
+# снимает стек потока цикла (sys._current_frames) и пишет в лог, какой хендлер и
+# какая строка держат цикл. Хендлер и пользователь задачи сообщает мидлварь
+# логов через enter()/leave(): сторож видит, какая задача сейчас в цикле.
+
+BASE_DIR = Path(__file__).parent
+
+
+class LoopWatchdog:
+    def __init__(self, interval=0.1, threshold=0.25):
+        self.interval = interval
+        self.threshold = threshold
+        # задача -> что о ней показать (хендлер, пользователь)
+        self.running = {}
+        self.loop = None
+        self.loop_thread = None
+        self.last_beat = None
+        self.beats = 0
+        self.captured_beat = None
+        self.stalls = 0
+        self.last_stall = None
+        self.max_lag = 0.0
+        self.started_at = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.started_at = datetime.now()
+        self._stop.clear()
+        self._task = self.loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    # ---------- в цикле ----------
+
+    def enter(self, **info):
+        self.running[asyncio.current_task()] = info
+
+    def leave(self):
+        self.running.pop(asyncio.current_task(), None)
+
+    async def _heartbeat(self):
+        while True:
+            asked = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - asked - self.interval)
+            self.last_beat = now
+            self.beats += 1
+            self.max_lag = max(self.max_lag, lag)
+            metrics.observe('event_loop_lag_seconds', lag)
+            if self.last_stall is not None and self.last_stall['beat'] == self.beats - 1:
+                # Цикл освободился: теперь известно, сколько длилась остановка
+                self.last_stall['lag_ms'] = round(lag * 1000, 1)
+                logger.warning(
+                    "Цикл событий был заблокирован %.0f мс (%s)",
+                    lag * 1000, self.last_stall['where']
+                )
+
+    # ---------- в потоке сторожа ----------
+
+    def _watch(self):
+        while not self._stop.wait(self.interval / 2):
+            silent = time.monotonic() - self.last_beat
+            if silent < self.interval + self.threshold or self.captured_beat == self.beats:
+                continue
+            # Одна запись на остановку: следующая — только после нового пульса
+            self.captured_beat = self.beats
+            try:
+                self._capture(silent)
+            except Exception as e:
+                logger.error("Сторож цикла не смог снять стек: %s", e)
+
+    def _task_context(self):
+        # Задача, которая сейчас выполняется в цикле. Только чтение: поток цикла
+        # стоит, пока мы смотрим
+        task = asyncio.current_task(self.loop)
+        if task is None:
+            return None, {}
+        return task.get_name(), self.running.get(task, {})
+
+    def _capture(self, silent):
+        frame = sys._current_frames().get(self.loop_thread)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        # Самая глубокая строка нашего кода и самая глубокая строка вообще
+        own = next(
+            (f for f in reversed(stack) if Path(f.filename).resolve().parent == BASE_DIR.resolve()),
+            None
+        )
+        innermost = stack[-1]
+        task_name, values = self._task_context()
+        where = ', '.join(f"{name}={value}" for name, value in values.items() if value is not None)
+        where = where or task_name or 'вне задачи'
+        call = f"{Path(own.filename).name}:{own.lineno} {own.line}" if own else None
+        self.stalls += 1
+        self.last_stall = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'beat': self.beats,
+            'where': where,
+            'call': call,
+            'innermost': f"{Path(innermost.filename).name}:{innermost.lineno} {innermost.name}",
+            'lag_ms': round(silent * 1000, 1),
+        }
+        metrics.inc('event_loop_stalls_total', route=values.get('route') or 'unknown')
+        logger.warning(
+            "Цикл событий заблокирован уже %.0f мс: %s, вызов %s, внутри %s\n%s",
+            silent * 1000, where, call, self.last_stall['innermost'],
+            ''.join(traceback.format_list(stack[-12:]))
+        )
+
+    # ---------- сводка ----------
+
+    def report(self):
+        lag = metrics.percentiles('event_loop_lag_seconds', qs=(0.5, 0.9, 0.99))
+        return {
+            'lag_ms': {q: round(value * 1000, 1) for q, value in lag.items()},
+            'max_lag_ms': round(self.max_lag * 1000, 1),
+            'stalls': self.stalls,
+            'last_stall': self.last_stall,
+            'since': self.started_at.isoformat(timespec='seconds') if self.started_at else None,
+        }
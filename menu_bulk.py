@@ -0,0 +1,228 @@
+import io
+import re
+import csv
+import time
+import asyncio
+import zipfile
+from pathlib import PurePosixPath
+from concurrent.futures import ThreadPoolExecutor
+import json_codec
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Пакетный импорт и экспорт меню: ZIP-архив с манифестом и фотографиями.
+#
+# manifest.json: {"mode": "merge" | "replace", "items": [
+#     {"category": "drinks", "name": "Чай", "desc": "...", "price": 5, "photo": "tea.jpg", "id": "item_..."}
+# ]}
+# manifest.csv: столбцы category,name,desc,price,photo,id (режим всегда merge)
+#
+# id необязателен: с ним позиция обновляется, без него добавляется новая.
+# id вида item_<цифры>, как у созданных ботом позиций: он входит в callback_data.
+# В режиме replace перечисленные в манифесте категории заменяются целиком.
+
+MAX_NAME = 100
+MAX_DESC = 500
+MAX_PHOTO_SIDE = 1280
+# Архив распаковывается в память бота: ограничиваем число файлов и их размер без сжатия
+MAX_ENTRIES = 1000
+MAX_ENTRY_BYTES = 20 * 1024 * 1024
+MAX_TOTAL_BYTES = 200 * 1024 * 1024
+PHOTO_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'RIFF')
+ITEM_ID = re.compile(r'item_\d+')
+
+
+class BundleError(Exception):
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def read_manifest(zf):
+    names = set(zf.namelist())
+    if 'manifest.json' in names:
+        data = json_codec.loads(zf.read('manifest.json'))
+        if isinstance(data, list):
+            return 'merge', data
+        return data.get('mode', 'merge'), data.get('items', [])
+    if 'manifest.csv' in names:
+        text = zf.read('manifest.csv').decode('utf-8-sig')
+        return 'merge', list(csv.DictReader(io.StringIO(text)))
+    raise BundleError(["В архиве нет manifest.json или manifest.csv"])
+
+
+def open_bundle(zip_bytes):
+    # Разбор архива и манифеста — в потоке, распаковка не держит цикл событий
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(zip_bytes))
+    except zipfile.BadZipFile:
+        raise BundleError(["Файл не является ZIP-архивом"])
+    with zf:
+        check_sizes(zf.infolist())
+        mode, rows = read_manifest(zf)
+        return mode, rows, set(zf.namelist())
+
+
+def check_sizes(entries):
+    # Размеры из заголовков архива: zipfile не распакует запись больше заявленного
+    if len(entries) > MAX_ENTRIES:
+        raise BundleError([f"В архиве больше {MAX_ENTRIES} файлов"])
+    errors = [
+        f"{entry.filename}: больше {MAX_ENTRY_BYTES // 2 ** 20} МБ без сжатия"
+        for entry in entries if entry.file_size > MAX_ENTRY_BYTES
+    ]
+    if sum(entry.file_size for entry in entries) > MAX_TOTAL_BYTES:
+        errors.append(f"Архив больше {MAX_TOTAL_BYTES // 2 ** 20} МБ без сжатия")
+    if errors:
+        raise BundleError(errors)
+
+
+def validate_rows(rows, mode, zip_names, categories, menu):
+    errors = []
+    items = []
+    seen = {}
+    # item_id -> категория: id уникален во всём меню, на нём держатся кнопки и остатки
+    owners = {item_id: cat_id for cat_id, cat_items in menu.items() for item_id in cat_items}
+    for n, row in enumerate(rows, start=1):
+        where = f"строка {n}"
+        cat_id = (row.get('category') or '').strip()
+        name = (row.get('name') or '').strip()
+        desc = (row.get('desc') or '').strip()
+        photo = (row.get('photo') or '').strip() or None
+        item_id = (row.get('id') or '').strip() or None
+
+        if cat_id not in categories:
+            errors.append(f"{where}: неизвестная категория '{cat_id}'")
+        if not name or len(name) > MAX_NAME:
+            errors.append(f"{where}: название пустое или длиннее {MAX_NAME} символов")
+        if len(desc) > MAX_DESC:
+            errors.append(f"{where}: описание длиннее {MAX_DESC} символов")
+        try:
+            price = int(row.get('price'))
+            if price <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            errors.append(f"{where}: цена должна быть целым положительным числом")
+            price = None
+        if photo and photo not in zip_names:
+            errors.append(f"{where}: фото '{photo}' не найдено в архиве")
+        elif photo and PurePosixPath(photo).suffix.lower() not in PHOTO_EXTENSIONS:
+            errors.append(f"{where}: фото '{photo}' — неподдерживаемый формат")
+        if item_id and not ITEM_ID.fullmatch(item_id):
+            errors.append(f"{where}: id '{item_id}' должен быть вида item_<цифры>")
+        elif item_id in seen:
+            errors.append(f"{where}: id {item_id} уже был в строке {seen[item_id]}")
+        elif item_id:
+            seen[item_id] = n
+        if item_id and owners.get(item_id, cat_id) != cat_id:
+            errors.append(f"{where}: позиция {item_id} уже есть в категории '{owners[item_id]}'")
+        elif item_id and mode == 'merge' and cat_id in menu and item_id not in menu[cat_id]:
+            errors.append(f"{where}: позиции {item_id} нет в категории '{cat_id}'")
+
+        items.append({
+            'category': cat_id, 'id': item_id, 'name': name,
+            'desc': desc, 'price': price, 'photo': photo
+        })
+    if not rows:
+        errors.append("Манифест пуст")
+    return items, errors
+
+
+def process_photo(data, ext, photo_store):
+    # Приводим фото к JPEG разумного размера и кладём в хранилище блобов;
+    # без Pillow проверяем только сигнатуру и сохраняем как есть
+    if Image is None:
+        if not data.startswith(IMAGE_SIGNATURES):
+            raise ValueError("файл не похож на изображение")
+        return photo_store.put_bytes(data, ext)
+    buffer = io.BytesIO()
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGB')
+        image.thumbnail((MAX_PHOTO_SIDE, MAX_PHOTO_SIDE))
+        image.save(buffer, 'JPEG', quality=85, optimize=True)
+    return photo_store.put_bytes(buffer.getvalue(), 'jpg')
+
+
+def extract_photo(zip_bytes, name, ext, photo_store):
+    # Свой ZipFile на задачу: распаковка идёт параллельно в потоках пула
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+        data = zf.read(name)
+    return process_photo(data, ext, photo_store)
+
+
+async def import_bundle(zip_bytes, menu, categories, photo_store, workers=4):
+    # Возвращает (mode, {cat_id: {item_id: item}}) — меню бот применяет сам одним коммитом.
+    # Фото пишутся заранее; при любой ошибке новые блобы удаляются.
+    loop = asyncio.get_running_loop()
+    created = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        mode, rows, names = await loop.run_in_executor(pool, open_bundle, zip_bytes)
+        items, errors = validate_rows(rows, mode, names, categories, menu)
+        if errors:
+            raise BundleError(errors)
+
+        base = int(time.time())
+        staged = {}
+        jobs = []
+        for n, item in enumerate(items):
+            cat_id = item['category']
+            item_id = item['id'] or f"item_{base}{n:03d}"
+            previous = menu.get(cat_id, {}).get(item_id, {})
+            staged.setdefault(cat_id, {})[item_id] = {
+                'name': item['name'],
+                'desc': item['desc'],
+                'price': item['price'],
+                'photo': previous.get('photo')
+            }
+            if item['photo']:
+                ext = PurePosixPath(item['photo']).suffix.lstrip('.')
+                jobs.append((cat_id, item_id, item['photo'], ext))
+
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(pool, extract_photo, zip_bytes, name, ext, photo_store)
+                for _, _, name, ext in jobs
+            ),
+            return_exceptions=True
+        )
+    for (cat_id, item_id, _, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            errors.append(f"{cat_id}/{staged[cat_id][item_id]['name']}: {result}")
+        else:
+            rel, is_new = result
+            if is_new:
+                created.append(rel)
+            staged[cat_id][item_id]['photo'] = rel
+
+    if errors:
+        for rel in created:
+            (photo_store.root / rel).unlink(missing_ok=True)
+        raise BundleError(errors)
+    return mode, staged
+
+
+def build_export(menu, categories, photos_dir):
+    buffer = io.BytesIO()
+    items = []
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for cat_id, cat_items in menu.items():
+            if cat_id not in categories:
+                continue
+            for item_id, item in cat_items.items():
+                photo = item.get('photo')
+                if photo and (photos_dir / photo).exists():
+                    # JPEG уже сжат, повторно не жмём
+                    zf.write(photos_dir / photo, f"photos/{photo}", compress_type=zipfile.ZIP_STORED)
+                    photo = f"photos/{photo}"
+                else:
+                    photo = None
+                items.append({
+                    'category': cat_id, 'id': item_id, 'name': item['name'],
+                    'desc': item.get('desc', ''), 'price': item['price'], 'photo': photo
+                })
+        zf.writestr('manifest.json', json_codec.dumps({'mode': 'merge', 'items': items}, compact=False))
+    return buffer.getvalue(), len(items)
@@ -0,0 +1,100 @@
+import threading
+import contextvars
+from collections import deque
+
+# Простейший реестр метрик в памяти процесса: счётчики, текущие значения и
+# распределения по последним замерам. render() отдаёт текст в формате Prometheus.
+#
+# Несколько кафе в одном процессе (tenants.py) делят реестр: tenants.py задаёт
+# tenant для задач каждого кафе, и всё записанное в них получает метку tenant.
+# Чтение, series() и render() в таком контексте видят только метрики своего кафе.
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+tenant = contextvars.ContextVar('metrics_tenant', default=None)
+
+
+def _key(name, labels):
+    current = tenant.get()
+    if current is not None:
+        labels = {**labels, 'tenant': current}
+    return (name, tuple(sorted(labels.items())))
+
+
+def _visible(labels):
+    current = tenant.get()
+    return current is None or ('tenant', current) in labels
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, window=2048, **labels):
+    key = _key(name, labels)
+    samples = _histograms.get(key)
+    if samples is None:
+        samples = _histograms.setdefault(key, deque(maxlen=window))
+    samples.append(value)
+
+
+def counter(name, **labels):
+    return _counters.get(_key(name, labels), 0)
+
+
+def gauge(name, **labels):
+    return _gauges.get(_key(name, labels))
+
+
+def percentiles(name, qs=(0.5, 0.9, 0.99), **labels):
+    samples = sorted(_histograms.get(_key(name, labels), ()))
+    if not samples:
+        return {}
+    return {q: samples[min(len(samples) - 1, int(q * len(samples)))] for q in qs}
+
+
+def series(name):
+    # Все наборы меток для метрики: [(labels, значение или список замеров)]
+    result = []
+    for store in (_counters, _gauges, _histograms):
+        for (metric, labels), value in list(store.items()):
+            if metric == name and _visible(labels):
+                result.append((dict(labels), value))
+    return result
+
+
+def _labels_text(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+def render():
+    lines = []
+    for (name, labels), value in sorted(_counters.items()):
+        if _visible(labels):
+            lines.append(f"{name}{_labels_text(labels)} {value}")
+    for (name, labels), value in sorted(_gauges.items()):
+        if _visible(labels):
+            lines.append(f"{name}{_labels_text(labels)} {value}")
+    for (name, labels), samples in sorted(_histograms.items()):
+        if not _visible(labels):
+            continue
+        ordered = sorted(samples)
+        if not ordered:
+            continue
+        for q in (0.5, 0.9, 0.99):
+            value = ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+            lines.append(f"{name}{_labels_text(labels, {'quantile': q})} {round(value, 3)}")
+        lines.append(f"{name}_count{_labels_text(labels)} {len(ordered)}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,166 @@
+import gc
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+# Заказы и корзины в памяти: dataclass со __slots__ вместо словарей.
+#
+# Позиция корзины ссылается на меню по item_id (ключ в items) и категории и хранит
+# снимок цены на момент добавления. Названия, категории и user_id интернируются:
+# в 100 тысячах заказов «Окрошка» — одна строка, а не сто тысяч копий.
+#
+# to_dict()/from_dict() дают ровно прежний JSON: отсутствующие поля не пишутся,
+# незнакомые ключи сохраняются в extra. json_codec сериализует объекты через
+# to_dict(), поэтому хранилища пишут orders и active_orders как раньше.
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _extra(data, fields, known):
+    # Незнакомые ключи (extra), чтобы не потерять их при записи. Обычно их нет,
+    # и хватает сравнения длины
+    if len(data) == known:
+        return None
+    return {key: value for key, value in data.items() if key not in fields} or None
+
+
+def _dump(obj, fields):
+    data = {}
+    for key in fields:
+        value = getattr(obj, key)
+        if value is not None:
+            data[key] = value
+    if obj.extra:
+        data.update(obj.extra)
+    return data
+
+
+@dataclass(slots=True)
+class CartLine:
+    name: str
+    price: int
+    count: int = 1
+    category: str = None
+    extra: dict = None
+
+    FIELDS = ('name', 'price', 'count', 'category')
+
+    @classmethod
+    def from_dict(cls, data):
+        category = data.get('category')
+        return cls(
+            _intern(data['name']),
+            data['price'],
+            data['count'],
+            _intern(category),
+            _extra(data, cls.FIELDS, 3 if category is None else 4)
+        )
+
+    @classmethod
+    def from_menu(cls, cat_id, item, count=1):
+        return cls(name=_intern(item['name']), price=item['price'], count=count, category=_intern(cat_id))
+
+    def to_dict(self):
+        return _dump(self, self.FIELDS)
+
+    @property
+    def total(self):
+        return self.count * self.price
+
+
+def _lines_from_dict(items):
+    return {_intern(item_id): CartLine.from_dict(line) for item_id, line in items.items()}
+
+
+def _lines_to_dict(items):
+    return {item_id: line.to_dict() for item_id, line in items.items()}
+
+
+@dataclass(slots=True)
+class Cart:
+    items: dict
+    created_at: str = None
+    updated_at: str = None
+    extra: dict = None
+
+    FIELDS = ('created_at', 'updated_at')
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            _lines_from_dict(data.get('items', {})),
+            data.get('created_at'),
+            data.get('updated_at'),
+            _extra(data, ('items',) + cls.FIELDS, sum(key in data for key in ('items',) + cls.FIELDS))
+        )
+
+    def to_dict(self):
+        return dict({'items': _lines_to_dict(self.items)}, **_dump(self, self.FIELDS))
+
+    @property
+    def total(self):
+        return sum(line.total for line in self.items.values())
+
+
+@dataclass(slots=True)
+class Order:
+    items: dict
+    created_at: str = None
+    user_id: str = None
+    status: str = None
+    cooking_at: str = None
+    ready_at: str = None
+    completed_at: str = None
+    cancelled_at: str = None
+    extra: dict = None
+
+    FIELDS = ('user_id', 'created_at', 'status', 'cooking_at', 'ready_at', 'completed_at', 'cancelled_at')
+
+    KEYS = ('items',) + FIELDS
+
+    @classmethod
+    def from_dict(cls, data):
+        get = data.get
+        return cls(
+            _lines_from_dict(get('items', {})),
+            get('created_at'),
+            _intern(get('user_id')),
+            _intern(get('status')),
+            get('cooking_at'),
+            get('ready_at'),
+            get('completed_at'),
+            get('cancelled_at'),
+            _extra(data, cls.KEYS, sum(key in data for key in cls.KEYS))
+        )
+
+    def to_dict(self):
+        return dict({'items': _lines_to_dict(self.items)}, **_dump(self, self.FIELDS))
+
+    @property
+    def total(self):
+        return sum(line.total for line in self.items.values())
+
+
+@contextmanager
+def _bulk_allocation():
+    # Сотни тысяч новых объектов подряд запускают сборщик мусора раз за разом,
+    # а мусора среди них нет: на время загрузки сборщик выключаем
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def load_orders(data):
+    with _bulk_allocation():
+        return {order_id: Order.from_dict(order) for order_id, order in data.items()}
+
+
+def load_carts(data):
+    with _bulk_allocation():
+        return {user_id: Cart.from_dict(cart) for user_id, cart in data.items()}
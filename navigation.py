@@ -0,0 +1,134 @@
+import logging
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+logger = logging.getLogger(__name__)
+
+# Навигация «одним экраном»: у каждого пользователя есть текущее сообщение-экран,
+# и переходы по меню редактируют его, а не шлют новое.
+#
+#   текст -> текст   edit_message_text
+#   фото  -> фото    edit_message_caption (то же фото) или edit_message_media
+#   фото  -> текст   экран остаётся фото: текст становится подписью к обложке
+#   текст -> фото    новое сообщение, старое удаляется
+#
+# Фото отдаются через PhotoStore, поэтому после первой отправки идут по file_id.
+
+CAPTION_LIMIT = 1024
+
+
+class Navigator:
+    def __init__(self, bot, photo_store, cover=None):
+        self.bot = bot
+        self.photo_store = photo_store
+        self.cover = cover
+        # chat_id -> (message_id, фото на экране или None для текста, подпись экрана
+        # для пропуска одинаковых правок)
+        self.screens = {}
+
+    def forget(self, chat_id):
+        self.screens.pop(chat_id, None)
+
+    def _signature(self, text, photo, reply_markup):
+        markup = reply_markup.model_dump_json() if reply_markup else None
+        return hash((text, photo, markup))
+
+    def _track(self, chat_id, message, photo, signature):
+        if isinstance(message, types.Message):
+            if photo:
+                self.photo_store.remember(photo, message)
+            self.screens[chat_id] = (message.message_id, photo, signature)
+        return message
+
+    def _target(self, event):
+        # event — CallbackQuery (правим текущий экран) или Message (новый экран)
+        if not isinstance(event, types.CallbackQuery):
+            return event.chat.id, None
+        message = event.message if isinstance(event.message, types.Message) else None
+        chat_id = message.chat.id if message else event.from_user.id
+        screen = self.screens.get(chat_id)
+        # Правим самое новое из двух: сообщение с кнопкой или запомненный экран.
+        # Так хендлер может показать несколько кадров подряд, а старые кнопки
+        # не оживляют давно ушедшие вверх сообщения
+        if screen and (message is None or screen[0] >= message.message_id):
+            return chat_id, screen
+        if message:
+            # Какое фото на незнакомом экране, неизвестно: '' не совпадёт ни с одним
+            return chat_id, (message.message_id, '' if message.photo else None, None)
+        return chat_id, None
+
+    async def clear_buttons(self, event):
+        chat_id, target = self._target(event)
+        if target is None:
+            return
+        try:
+            await self.bot.edit_message_reply_markup(chat_id=chat_id, message_id=target[0], reply_markup=None)
+        except TelegramBadRequest:
+            return
+        self.screens[chat_id] = (target[0], target[1], None)
+
+    async def show(self, event, text, reply_markup=None, photo=None, parse_mode=None):
+        chat_id, target = self._target(event)
+
+        if photo and not self.photo_store.available(photo):
+            photo = None
+        on_photo = target is not None and target[1] is not None
+        if on_photo and not photo and self.cover and self.photo_store.available(self.cover):
+            photo = self.cover
+        if photo and len(text) > CAPTION_LIMIT:
+            photo = None
+
+        signature = self._signature(text, photo, reply_markup)
+        if target is not None:
+            message_id, current_photo, current_signature = target
+            if current_signature == signature:
+                return None
+            try:
+                if photo and on_photo:
+                    if current_photo == photo:
+                        edited = await self.bot.edit_message_caption(
+                            chat_id=chat_id, message_id=message_id,
+                            caption=text, reply_markup=reply_markup, parse_mode=parse_mode
+                        )
+                    else:
+                        edited = await self.bot.edit_message_media(
+                            chat_id=chat_id, message_id=message_id,
+                            media=types.InputMediaPhoto(
+                                media=self.photo_store.input_file(photo),
+                                caption=text, parse_mode=parse_mode
+                            ),
+                            reply_markup=reply_markup
+                        )
+                    return self._track(chat_id, edited, photo, signature)
+                if not photo and not on_photo:
+                    edited = await self.bot.edit_message_text(
+                        text, chat_id=chat_id, message_id=message_id,
+                        reply_markup=reply_markup, parse_mode=parse_mode
+                    )
+                    return self._track(chat_id, edited, None, signature)
+            except TelegramBadRequest as e:
+                if 'not modified' in str(e):
+                    self.screens[chat_id] = (message_id, photo, signature)
+                    return None
+                # Старое или удалённое сообщение править нельзя — показываем экран заново
+                logger.debug("Экран %s не отредактирован: %s", message_id, e)
+                target = None
+
+        sent = await self._send(chat_id, text, reply_markup, photo, parse_mode)
+        if target is not None:
+            # Тип экрана сменился (текст <-> фото): старое сообщение убираем
+            try:
+                await self.bot.delete_message(chat_id, target[0])
+            except TelegramBadRequest:
+                pass
+        return self._track(chat_id, sent, photo, signature)
+
+    async def _send(self, chat_id, text, reply_markup, photo, parse_mode):
+        if photo:
+            return await self.bot.send_photo(
+                chat_id, self.photo_store.input_file(photo),
+                caption=text, reply_markup=reply_markup, parse_mode=parse_mode
+            )
+        return await self.bot.send_message(
+            chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode
+        )
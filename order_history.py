@@ -0,0 +1,50 @@
+from bisect import insort
+from models import CartLine
+
+# История заказов по пользователям.
+#
+# Индекс user_id -> отсортированный по created_at список (created_at, order_id):
+# страница истории — срез с конца списка, без обхода всех заказов.
+# Строится при запуске и пополняется в final_confirmation.
+
+
+class HistoryIndex:
+    def __init__(self):
+        self.by_user = {}
+
+    def rebuild(self, orders):
+        self.by_user = {}
+        for order_id, order in orders.items():
+            if order.user_id:
+                self.by_user.setdefault(str(order.user_id), []).append((order.created_at or '', order_id))
+        for keys in self.by_user.values():
+            keys.sort()
+
+    def add(self, order_id, order):
+        keys = self.by_user.setdefault(str(order.user_id), [])
+        key = (order.created_at or '', order_id)
+        if key not in keys[-1:]:
+            insort(keys, key)
+
+    def count(self, user_id):
+        return len(self.by_user.get(user_id, ()))
+
+    def page(self, user_id, page, size):
+        # Новые заказы первыми
+        keys = self.by_user.get(user_id, [])
+        end = len(keys) - page * size
+        return [order_id for _, order_id in reversed(keys[max(0, end - size):max(0, end)])]
+
+
+def reorder_items(order, menu, item_categories):
+    # Корзина из прошлого заказа по текущему меню: цены и названия берутся
+    # из меню, исчезнувшие позиции пропускаются
+    items, missing = {}, []
+    for item_id, line in order.items.items():
+        cat_id = line.category or item_categories.get(item_id)
+        current = menu.get(cat_id, {}).get(item_id)
+        if current is None:
+            missing.append(line.name)
+            continue
+        items[item_id] = CartLine.from_menu(cat_id, current, count=line.count)
+    return items, missing
@@ -0,0 +1,108 @@
+from bisect import bisect_left, insort
+
+# Жизненный цикл заказа и индекс заказов по статусам.
+#
+#   new -> cooking -> ready -> done
+#     \________\________\---> cancelled
+#
+# Для каждого статуса индекс держит отсортированный по created_at список
+# (created_at, order_id): самые старые заказы берутся срезом, без обхода всех
+# заказов, а смена статуса стоит два бинарных поиска.
+
+NEW, COOKING, READY, DONE, CANCELLED = 'new', 'cooking', 'ready', 'done', 'cancelled'
+STATUSES = (NEW, COOKING, READY, DONE, CANCELLED)
+OPEN_STATUSES = (NEW, COOKING, READY)
+
+TRANSITIONS = {
+    NEW: (COOKING, DONE, CANCELLED),
+    COOKING: (READY, DONE, CANCELLED),
+    READY: (DONE, CANCELLED),
+    DONE: (),
+    CANCELLED: (),
+}
+
+# Следующий шаг для кнопки «дальше» в очереди
+NEXT_STATUS = {NEW: COOKING, COOKING: READY, READY: DONE}
+
+STATUS_TITLES = {
+    NEW: "🆕 Новые",
+    COOKING: "👩‍🍳 Готовятся",
+    READY: "🛎 Готовы",
+    DONE: "✅ Выданы",
+    CANCELLED: "⛔ Отменены",
+}
+
+# Статус одного заказа (в сообщении админу) и кнопка перехода в статус
+STATUS_LABELS = {
+    NEW: "🆕 Новый",
+    COOKING: "👩‍🍳 Готовится",
+    READY: "🛎 Готов",
+    DONE: "✅ Выдан",
+    CANCELLED: "⛔ Отменён",
+}
+
+ACTION_TITLES = {
+    COOKING: "👩‍🍳 Готовим",
+    READY: "🛎 Готово",
+    DONE: "✅ Выдан",
+    CANCELLED: "⛔ Отменить",
+}
+
+
+class OrderIndex:
+    def __init__(self):
+        self.by_status = {status: [] for status in STATUSES}
+        # order_id -> (status, created_at)
+        self.entries = {}
+
+    def rebuild(self, orders):
+        self.by_status = {status: [] for status in STATUSES}
+        self.entries = {}
+        for order_id, order in orders.items():
+            status = order.status or NEW
+            if status not in self.by_status:
+                status = NEW
+            created_at = order.created_at or ''
+            self.entries[order_id] = (status, created_at)
+            self.by_status[status].append((created_at, order_id))
+        for keys in self.by_status.values():
+            keys.sort()
+
+    def add(self, order_id, order):
+        status = order.status or NEW
+        if status not in self.by_status:
+            status = NEW
+        if order_id in self.entries:
+            self.move(order_id, status)
+            return
+        created_at = order.created_at or ''
+        self.entries[order_id] = (status, created_at)
+        insort(self.by_status[status], (created_at, order_id))
+
+    def move(self, order_id, status):
+        old_status, created_at = self.entries[order_id]
+        if old_status == status:
+            return
+        keys = self.by_status[old_status]
+        position = bisect_left(keys, (created_at, order_id))
+        if position < len(keys) and keys[position] == (created_at, order_id):
+            del keys[position]
+        self.entries[order_id] = (status, created_at)
+        insort(self.by_status[status], (created_at, order_id))
+
+    def status_of(self, order_id):
+        entry = self.entries.get(order_id)
+        return entry[0] if entry else None
+
+    def oldest(self, status, limit=10):
+        return [order_id for _, order_id in self.by_status[status][:limit]]
+
+    def count(self, status):
+        return len(self.by_status[status])
+
+    def counts(self):
+        return {status: len(keys) for status, keys in self.by_status.items()}
+
+
+def can_move(status, new_status):
+    return new_status in TRANSITIONS.get(status, ())
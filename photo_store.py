@@ -0,0 +1,183 @@
+import os
+import time
+import hashlib
+import logging
+from collections import Counter
+from pathlib import Path
+from aiogram.types import FSInputFile
+import json_codec
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Хранилище фото по содержимому: файл называется sha256 от байтов и лежит в
+# photos/blobs/ab/cd/<hash>.<ext>. Одинаковые картинки хранятся один раз.
+# В меню в поле 'photo' пишется путь относительно photos/, поэтому остальной код
+# по-прежнему открывает PHOTOS_DIR / item['photo'].
+#
+# Счётчик ссылок строится из меню (rebuild_refs), файл удаляется только когда
+# на него больше никто не ссылается. Рядом лежит index.json:
+#   unique   — file_unique_id из Telegram -> путь (повторную загрузку можно не скачивать)
+#   file_ids — ключ фото -> file_id в Telegram (повторная отправка без загрузки файла)
+
+
+class PhotoStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.blobs_dir = self.root / 'blobs'
+        self.index_path = self.blobs_dir / 'index.json'
+        self.refs = Counter()
+        self.unique = {}
+        self.file_ids = {}
+        self._index_dirty = False
+
+    # ---------- индекс ----------
+
+    def load_index(self):
+        try:
+            index = json_codec.read_file(self.index_path)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error("Ошибка чтения индекса фото: %s", e)
+            return
+        self.unique = index.get('unique', {})
+        self.file_ids = index.get('file_ids', {})
+
+    def save_index(self):
+        if not self._index_dirty:
+            return
+        self._index_dirty = False
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        json_codec.write_file(self.index_path, {'unique': self.unique, 'file_ids': self.file_ids})
+
+    # ---------- блобы ----------
+
+    @staticmethod
+    def is_blob(rel):
+        return rel.startswith('blobs/')
+
+    @staticmethod
+    def blob_rel(digest, ext):
+        return f"blobs/{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+    def put_bytes(self, data, ext='jpg', unique_id=None):
+        # Возвращает (путь, создан_ли_новый_файл)
+        digest = hashlib.sha256(data).hexdigest()
+        rel = self.blob_rel(digest, ext.lower().lstrip('.') or 'jpg')
+        path = self.root / rel
+        created = not path.exists()
+        if created:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            metrics.inc('photo_blobs_written_total')
+        else:
+            metrics.inc('photo_dedup_hits_total')
+        if unique_id and self.unique.get(unique_id) != rel:
+            self.unique[unique_id] = rel
+            self._index_dirty = True
+        return rel, created
+
+    def lookup_unique(self, unique_id):
+        rel = self.unique.get(unique_id)
+        if rel and (self.root / rel).exists():
+            metrics.inc('photo_dedup_hits_total')
+            return rel
+        return None
+
+    # ---------- ссылки ----------
+
+    def rebuild_refs(self, menu):
+        self.refs = Counter(
+            item['photo']
+            for items in menu.values()
+            for item in items.values()
+            if item.get('photo')
+        )
+
+    def release(self, rel):
+        # Вызывается после удаления ссылки из меню и пересчёта refs
+        if not rel or self.refs[rel] > 0:
+            return False
+        path = self.root / rel
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            return False
+        self._forget(rel)
+        return True
+
+    def gc(self, grace=3600.0):
+        # Удаляет блобы без ссылок. Свежие не трогаем: их могли только что
+        # загрузить, а в меню позиция появится чуть позже
+        if not self.blobs_dir.exists():
+            return 0
+        removed = 0
+        deadline = time.time() - grace
+        for path in self.blobs_dir.glob('*/*/*'):
+            if path.suffix == '.tmp':
+                continue
+            rel = path.relative_to(self.root).as_posix()
+            if self.refs[rel] == 0 and path.stat().st_mtime < deadline:
+                path.unlink(missing_ok=True)
+                self._forget(rel)
+                removed += 1
+        metrics.inc('photo_gc_removed_total', removed)
+        return removed
+
+    def _forget(self, rel):
+        self.file_ids.pop(self._key(rel), None)
+        for unique_id in [u for u, r in self.unique.items() if r == rel]:
+            del self.unique[unique_id]
+        self._index_dirty = True
+
+    def migrate_legacy(self, menu):
+        # Старые фото вида {cat}_{item}.jpg переносим в блобы; возвращает изменённые категории
+        changed = set()
+        legacy = set()
+        for cat_id, items in menu.items():
+            for item in items.values():
+                rel = item.get('photo')
+                if not rel or self.is_blob(rel):
+                    continue
+                path = self.root / rel
+                try:
+                    data = path.read_bytes()
+                except FileNotFoundError:
+                    continue
+                item['photo'], _ = self.put_bytes(data, path.suffix or 'jpg')
+                legacy.add(rel)
+                changed.add(cat_id)
+        for rel in legacy:
+            (self.root / rel).unlink(missing_ok=True)
+        return changed
+
+    # ---------- отправка ----------
+
+    def _key(self, rel):
+        if self.is_blob(rel):
+            # Имя блоба и есть хэш содержимого, поэтому file_id для него не устаревает
+            return Path(rel).stem
+        try:
+            stat = (self.root / rel).stat()
+        except FileNotFoundError:
+            return rel
+        return f"{rel}:{stat.st_mtime_ns}:{stat.st_size}"
+
+    def available(self, rel):
+        return self._key(rel) in self.file_ids or (self.root / rel).exists()
+
+    def input_file(self, rel):
+        return self.file_ids.get(self._key(rel)) or FSInputFile(self.root / rel)
+
+    def remember(self, rel, message):
+        # Запоминаем file_id после первой отправки фото
+        if not message or not message.photo:
+            return
+        key = self._key(rel)
+        file_id = message.photo[-1].file_id
+        if self.file_ids.get(key) != file_id:
+            self.file_ids[key] = file_id
+            self._index_dirty = True
@@ -0,0 +1,191 @@
+import os
+import heapq
+
+# «Часто берут вместе»: матрица совместной встречаемости позиций в заказах.
+#
+# counts[a][b] — в скольких заказах были и a, и b (количество порций не важно).
+# Для каждой позиции заранее считаются top_k соседей среди позиций текущего
+# меню, так что на экране блюда рекомендации — один поиск по словарю.
+# Новый заказ увеличивает счётчики своих пар и пересчитывает соседей только
+# у своих позиций.
+#
+# С NumPy матрица плотная (позиций в меню десятки) и строится блоками через
+# B.T @ B по матрице «заказ × позиция». Без NumPy — словари счётчиков;
+# RECOMMENDER_NUMPY=0 включает их принудительно. Результат одинаковый:
+# при равных счётчиках выше позиция, раньше встретившаяся в заказах.
+try:
+    if os.getenv('RECOMMENDER_NUMPY', 'auto') == '0':
+        raise ImportError
+    import numpy as np
+except ImportError:
+    np = None
+
+BACKEND_NAME = 'numpy' if np is not None else 'python'
+
+# Заказов в одном блоке B при построении матрицы: B занимает block × позиций × 4 байта
+BLOCK = 8192
+
+
+class Recommender:
+    def __init__(self, top_k=3, use_numpy=None):
+        self.top_k = top_k
+        self.use_numpy = (np is not None) if use_numpy is None else use_numpy
+        # item_id -> номер строки матрицы, в порядке первого появления в заказах
+        self.index = {}
+        self.item_ids = []
+        self.matrix = None
+        self.pairs = {}
+        # Позиции, которые можно советовать (есть в меню); None — любые
+        self.allowed = None
+        self.suggestions = {}
+
+    def _baskets(self, orders):
+        for order in orders.values():
+            if len(order.items) > 1:
+                yield list(order.items)
+
+    def _register(self, basket):
+        rows = []
+        for item_id in basket:
+            row = self.index.get(item_id)
+            if row is None:
+                row = self.index[item_id] = len(self.item_ids)
+                self.item_ids.append(item_id)
+            rows.append(row)
+        return rows
+
+    # ---------- построение ----------
+
+    def rebuild(self, orders, allowed=None):
+        self.index, self.item_ids = {}, []
+        self.allowed = set(allowed) if allowed is not None else None
+        baskets = [self._register(basket) for basket in self._baskets(orders)]
+        if self.use_numpy:
+            self._rebuild_matrix(baskets)
+        else:
+            self._rebuild_pairs(baskets)
+        self.refresh()
+
+    def _rebuild_matrix(self, baskets):
+        n = len(self.item_ids)
+        counts = np.zeros((n, n), dtype=np.float32)
+        for start in range(0, len(baskets), BLOCK):
+            block = baskets[start:start + BLOCK]
+            rows = np.repeat(np.arange(len(block)), [len(basket) for basket in block])
+            cols = np.fromiter((row for basket in block for row in basket), dtype=np.intp, count=len(rows))
+            b = np.zeros((len(block), n), dtype=np.float32)
+            b[rows, cols] = 1
+            # В float32 счёт точен до 2**24 заказов, а умножение идёт через BLAS
+            counts += b.T @ b
+        np.fill_diagonal(counts, 0)
+        self.matrix = counts.astype(np.int64)
+
+    def _rebuild_pairs(self, baskets):
+        pairs = {}
+        for basket in baskets:
+            for a in basket:
+                row = pairs.setdefault(a, {})
+                for b in basket:
+                    if a != b:
+                        row[b] = row.get(b, 0) + 1
+        self.pairs = pairs
+
+    # ---------- пополнение ----------
+
+    def add(self, order):
+        basket = list(order.items)
+        if len(basket) < 2:
+            return
+        rows = self._register(basket)
+        if self.use_numpy:
+            n = len(self.item_ids)
+            if self.matrix is None or self.matrix.shape[0] < n:
+                grown = np.zeros((n, n), dtype=np.int64)
+                if self.matrix is not None:
+                    old = self.matrix.shape[0]
+                    grown[:old, :old] = self.matrix
+                self.matrix = grown
+            index = np.array(rows)
+            self.matrix[np.ix_(index, index)] += 1
+            self.matrix[index, index] -= 1
+        else:
+            self._add_pairs(rows)
+        self._refresh_rows(rows)
+
+    def _add_pairs(self, rows):
+        for a in rows:
+            row = self.pairs.setdefault(a, {})
+            for b in rows:
+                if a != b:
+                    row[b] = row.get(b, 0) + 1
+
+    # ---------- соседи ----------
+
+    def set_allowed(self, allowed):
+        # Меню изменилось: исчезнувшие позиции больше не советуем
+        self.allowed = set(allowed) if allowed is not None else None
+        self.refresh()
+
+    def refresh(self):
+        self.suggestions = {}
+        self._refresh_rows(range(len(self.item_ids)))
+
+    def _refresh_rows(self, rows):
+        # Позиции, которых нет в меню, никто не откроет: соседей им не считаем
+        if self.allowed is not None:
+            for row in rows:
+                if self.item_ids[row] not in self.allowed:
+                    self.suggestions.pop(self.item_ids[row], None)
+            rows = [row for row in rows if self.item_ids[row] in self.allowed]
+        else:
+            rows = list(rows)
+        if not rows:
+            return
+        if self.use_numpy:
+            tops = self._top_matrix(rows)
+        else:
+            tops = [self._top_pairs(row) for row in rows]
+        for row, top in zip(rows, tops):
+            item_id = self.item_ids[row]
+            if top:
+                self.suggestions[item_id] = tuple(self.item_ids[col] for col in top)
+            else:
+                self.suggestions.pop(item_id, None)
+
+    def _allowed_mask(self):
+        if self.allowed is None:
+            return None
+        return np.fromiter((item_id in self.allowed for item_id in self.item_ids), dtype=bool, count=len(self.item_ids))
+
+    def _top_matrix(self, rows):
+        scores = self.matrix[rows]
+        mask = self._allowed_mask()
+        if mask is not None:
+            scores = np.where(mask, scores, 0)
+        k = min(self.top_k, scores.shape[1])
+        # stable: при равенстве выше меньший номер строки, как в _top_pairs
+        top = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        picked = np.take_along_axis(scores, top, axis=1)
+        return [
+            [int(col) for col, score in zip(cols, values) if score > 0]
+            for cols, values in zip(top, picked)
+        ]
+
+    def _top_pairs(self, row):
+        allowed = self.allowed
+        candidates = (
+            (count, col) for col, count in self.pairs.get(row, {}).items()
+            if allowed is None or self.item_ids[col] in allowed
+        )
+        return [col for count, col in heapq.nsmallest(self.top_k, candidates, key=lambda c: (-c[0], c[1]))]
+
+    def suggest(self, item_id):
+        return self.suggestions.get(item_id, ())
+
+    def pair_count(self, a, b):
+        row, col = self.index.get(a), self.index.get(b)
+        if row is None or col is None:
+            return 0
+        if self.use_numpy:
+            return int(self.matrix[row, col])
+        return self.pairs.get(row, {}).get(col, 0)
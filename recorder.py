@@ -0,0 +1,206 @@
+import re
+import gzip
+import hmac
+import time
+import queue
+import hashlib
+import logging
+import secrets
+import threading
+from datetime import datetime
+from pathlib import Path
+from aiogram import BaseMiddleware
+import json_codec
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Запись входящих апдейтов для воспроизведения (replay.py).
+#
+# Каждая строка файла — один апдейт: {"at": секунды от начала записи,
+# "ms": время обработки, "update": апдейт как его прислал Telegram}. Файлы —
+# JSONL в gzip, новый файл начинается после max_bytes несжатых данных, хранятся
+# последние keep файлов.
+#
+# id пользователей и чатов заменяются стабильным псевдонимом (HMAC от id с солью),
+# в том числе внутри callback_data (ok_<ключ>_<user_id>); имена и юзернеймы
+# стираются, текст сообщений бота под кнопками не пишется. Один и тот же клиент
+# в записи — всегда один и тот же псевдоним, поэтому сохраняется то, ради чего
+# пишем: кто, когда и что нажимал.
+# id админа заменяется на ADMIN_ALIAS: replay.py запускает бота с этим ADMIN_ID,
+# и админские кнопки при воспроизведении работают.
+#
+# Сжатие и запись идут в отдельном потоке, в цикле событий — только
+# сериализация апдейта и постановка в очередь.
+
+FILE_PATTERN = 'updates-*.jsonl.gz'
+ADMIN_ALIAS = 1
+PERSON_FIELDS = ('first_name', 'last_name', 'username', 'phone_number', 'title', 'bio')
+BOT_MESSAGE_FIELDS = ('text', 'caption', 'entities', 'caption_entities')
+ID_IN_DATA = re.compile(r'\d{5,}')
+
+
+class Anonymizer:
+    def __init__(self, salt=None, keep_ids=None):
+        self.salt = (salt or secrets.token_hex(16)).encode()
+        self.keep_ids = dict(keep_ids or {})
+        self.cache = {}
+
+    def alias(self, value):
+        if value in self.keep_ids:
+            return self.keep_ids[value]
+        alias = self.cache.get(value)
+        if alias is None:
+            digest = hmac.new(self.salt, str(value).encode(), hashlib.sha256).digest()
+            # Положительный id вне диапазона реальных пользователей не нужен:
+            # достаточно, чтобы псевдонимы не пересекались с keep_ids
+            alias = self.cache[value] = 10 ** 9 + int.from_bytes(digest[:6], 'big') % (9 * 10 ** 9)
+        return alias
+
+    def update(self, raw):
+        call = raw.get('callback_query')
+        if call:
+            # Сообщение под кнопкой написал бот: в нём имена клиентов и составы заказов
+            message = call.get('message') or {}
+            for key in BOT_MESSAGE_FIELDS:
+                message.pop(key, None)
+            if 'data' in call:
+                call['data'] = self._scrub_data(call['data'])
+            if 'chat_instance' in call:
+                call['chat_instance'] = str(self.alias(call['chat_instance']))
+        return self.scrub(raw)
+
+    def _scrub_data(self, data):
+        # В callback_data встречаются id клиентов, которые уже попадались в записи
+        def replace(match):
+            value = int(match.group())
+            return str(self.alias(value)) if value in self.cache or value in self.keep_ids else match.group()
+        return ID_IN_DATA.sub(replace, data)
+
+    def scrub(self, data):
+        # Пользователь или чат: у обоих есть id, а у пользователя ещё и is_bot
+        if isinstance(data, dict):
+            person = 'id' in data and ('is_bot' in data or 'type' in data)
+            result = {}
+            for key, value in data.items():
+                if person and key == 'id' and not data.get('is_bot'):
+                    result[key] = self.alias(value)
+                elif person and key in PERSON_FIELDS and not data.get('is_bot'):
+                    if key == 'first_name':
+                        result[key] = 'user'
+                elif key in ('user_id', 'chat_id') and isinstance(value, int):
+                    result[key] = self.alias(value)
+                else:
+                    result[key] = self.scrub(value)
+            return result
+        if isinstance(data, list):
+            return [self.scrub(value) for value in data]
+        return data
+
+
+class RotatingWriter:
+    def __init__(self, directory, max_bytes=16 * 2 ** 20, keep=20):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.file = None
+        self.written = 0
+        self.lines = queue.SimpleQueue()
+        self.thread = None
+
+    def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name='update-recorder', daemon=True)
+        self.thread.start()
+
+    def put(self, line):
+        self.lines.put(line)
+
+    def close(self):
+        if self.thread is not None:
+            self.lines.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while True:
+            line = self.lines.get()
+            if line is None:
+                break
+            try:
+                self._write(line)
+            except Exception as e:
+                logger.error("Ошибка записи апдейта: %s", e)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _write(self, line):
+        if self.file is None or self.written >= self.max_bytes:
+            self._rotate()
+        self.file.write(line)
+        self.written += len(line)
+        # Сбрасываем в ОС раз в строку: при падении теряется только хвост gzip,
+        # а прочитанные до него апдейты остаются
+        self.file.flush()
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+        name = f"updates-{datetime.now():%Y%m%d-%H%M%S-%f}.jsonl.gz"
+        self.file = gzip.open(self.directory / name, 'wb')
+        self.written = 0
+        for old in sorted(self.directory.glob(FILE_PATTERN))[:-self.keep]:
+            old.unlink(missing_ok=True)
+
+
+class UpdateRecorder(BaseMiddleware):
+    def __init__(self, directory, max_bytes=16 * 2 ** 20, keep=20, salt=None, admin_ids=()):
+        self.anonymizer = Anonymizer(salt, {admin_id: ADMIN_ALIAS for admin_id in admin_ids})
+        self.writer = RotatingWriter(directory, max_bytes, keep)
+        self.started = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self.writer.start()
+
+    def close(self):
+        self.writer.close()
+
+    async def __call__(self, handler, event, data):
+        if self.started is None:
+            return await handler(event, data)
+        arrived = time.monotonic()
+        try:
+            return await handler(event, data)
+        finally:
+            try:
+                raw = event.model_dump(mode='json', by_alias=True, exclude_none=True)
+                self.writer.put(json_codec.dumps({
+                    'at': round(arrived - self.started, 4),
+                    'ms': round((time.monotonic() - arrived) * 1000, 2),
+                    'update': self.anonymizer.update(raw),
+                }) + b'\n')
+                metrics.inc('updates_recorded_total')
+            except Exception as e:
+                logger.error("Не удалось записать апдейт: %s", e)
+
+
+def read_recording(path):
+    # Все апдейты записи по порядку прихода: path — файл или папка с файлами.
+    # Обрезанный хвост gzip (процесс упал посреди записи) пропускается
+    path = Path(path)
+    files = sorted(path.glob(FILE_PATTERN)) if path.is_dir() else [path]
+    entries = []
+    for n, file in enumerate(files):
+        try:
+            with gzip.open(file, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        entries.append((n, json_codec.loads(line)))
+        except (EOFError, gzip.BadGzipFile, ValueError) as e:
+            logger.warning("Запись %s обрезана: %s", file, e)
+    # Время «at» отсчитывается от запуска записи и внутри файла может идти не по
+    # порядку: строка пишется по окончании обработки
+    entries.sort(key=lambda entry: (entry[0], entry[1]['at']))
+    return [entry for _, entry in entries]
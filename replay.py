@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import contextvars
+from collections import Counter
+from pathlib import Path
+
+# Воспроизведение записанных апдейтов (recorder.py) через dp.feed_update против
+# заглушки Telegram и копии папки данных: рабочие данные не меняются, в Telegram
+# ничего не уходит.
+#
+#   python replay.py run recordings/ --out a.json              # как можно быстрее
+#   python replay.py run recordings/ --speed 1 --out a.json    # в исходном темпе
+#   python replay.py compare a.json b.json
+#
+# A/B двух сборок: один и тот же run из двух рабочих копий (каждая воспроизводит
+# своим bot.py), затем compare. Сравниваются задержки и вызовы API — всего и по
+# каждому апдейту.
+#
+# В быстром режиме апдейты одного пользователя идут строго по очереди, разные
+# пользователи — параллельно. В исходном темпе каждый апдейт подаётся в момент,
+# когда пришёл при записи (с учётом --speed).
+
+BASE_DIR = Path(__file__).parent
+FAKE_ENV = {
+    'TELEGRAM_BOT_TOKEN': '123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA',
+    'LOG_LEVEL': 'WARNING',
+}
+
+# Номер воспроизводимого апдейта: по нему вызовы API относятся к апдейту,
+# включая фоновые задачи, запущенные его хендлером
+current_update = contextvars.ContextVar('current_update', default=None)
+
+
+def timeline(entries):
+    # «at» отсчитывается от запуска записи; после перезапуска бота счёт начинается
+    # заново — такие куски ставим друг за другом
+    base, last, result = 0.0, 0.0, []
+    for entry in entries:
+        if entry['at'] < last:
+            base += last
+        last = entry['at']
+        result.append(base + entry['at'])
+    return result
+
+
+def describe(update):
+    if 'callback_query' in update:
+        return update['callback_query']['from']['id'], f"callback {update['callback_query'].get('data')}"
+    for key, value in update.items():
+        if isinstance(value, dict) and 'from' in value:
+            return value['from']['id'], f"{key} {value.get('text') or ''}".strip()
+    return None, next((key for key in update if key != 'update_id'), 'update')
+
+
+def build_name():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return str(BASE_DIR)
+
+
+# ====================== RUN ======================
+
+async def _replay(entries, speed, latency):
+    from recorder import ADMIN_ALIAS
+    for key, value in FAKE_ENV.items():
+        os.environ.setdefault(key, value)
+    # В записи админ — ADMIN_ALIAS; воспроизведение не должно само себя записывать
+    os.environ['ADMIN_ID'] = str(ADMIN_ALIAS)
+    os.environ.pop('RECORD_DIR', None)
+    sys.path.insert(0, str(BASE_DIR))
+    # ID заказов и прочая случайность — одинаковые от прогона к прогону
+    random.seed(0)
+    import bot as bot_module
+    from aiogram.types import Update
+    from fake_telegram import FakeSession
+
+    session = FakeSession(latency=latency)
+    bot_module.bot.session = session
+    calls = {}
+    make_request = session.make_request
+
+    async def recording(bot, method, timeout=None):
+        index = current_update.get()
+        if index is not None:
+            calls.setdefault(index, []).append(method.__api_method__)
+        return await make_request(bot, method, timeout)
+
+    session.make_request = recording
+    await bot_module.dp.emit_startup(bot=bot_module.bot)
+    session.reset()
+
+    results = [None] * len(entries)
+
+    async def feed(index, entry):
+        update = Update.model_validate(entry['update'], context={'bot': bot_module.bot})
+        token = current_update.set(index)
+        started = time.perf_counter()
+        error = None
+        try:
+            await bot_module.dp.feed_update(bot_module.bot, update)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            current_update.reset(token)
+        user_id, what = describe(entry['update'])
+        results[index] = {
+            'user': user_id,
+            'what': what,
+            'recorded_ms': entry.get('ms'),
+            'ms': round((time.perf_counter() - started) * 1000, 3),
+            'error': error,
+        }
+
+    started = time.perf_counter()
+    if speed:
+        moments = timeline(entries)
+
+        async def scheduled(index, entry):
+            delay = moments[index] / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await feed(index, entry)
+
+        await asyncio.gather(*(scheduled(index, entry) for index, entry in enumerate(entries)))
+    else:
+        chains = {}
+        for index, entry in enumerate(entries):
+            chains.setdefault(describe(entry['update'])[0], []).append(index)
+
+        async def chain(indexes):
+            for index in indexes:
+                await feed(index, entries[index])
+
+        await asyncio.gather(*(chain(indexes) for indexes in chains.values()))
+    elapsed = time.perf_counter() - started
+    # Фоновые задачи хендлеров (уведомления, рассылки) успевают отработать
+    await asyncio.sleep(0.1)
+    await bot_module.dp.emit_shutdown(bot=bot_module.bot)
+
+    for index, result in enumerate(results):
+        result['calls'] = calls.get(index, [])
+    return {
+        'build': build_name(),
+        'speed': speed,
+        'latency': latency,
+        'elapsed': round(elapsed, 3),
+        'calls': dict(Counter(method for methods in calls.values() for method in methods)),
+        'updates': results,
+    }
+
+
+def cmd_run(args):
+    from recorder import read_recording
+    entries = read_recording(args.recording)
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        print("В записи нет апдейтов")
+        sys.exit(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp) / 'data'
+        shutil.copytree(
+            args.data, data_dir,
+            ignore=shutil.ignore_patterns('shared.sqlite3*', 'seen_updates*', '*.tmp')
+        )
+        os.environ['DATA_DIR'] = str(data_dir)
+        result = asyncio.run(_replay(entries, args.speed, args.latency))
+    Path(args.out).write_text(json.dumps(result, ensure_ascii=False), encoding='utf-8')
+
+    latencies = sorted(update['ms'] for update in result['updates'])
+    errors = sum(1 for update in result['updates'] if update['error'])
+    print(
+        f"{result['build']}: апдейтов {len(latencies)} за {result['elapsed']:.2f} с, "
+        f"p50 {pct(latencies, 0.5):.1f}мс, p99 {pct(latencies, 0.99):.1f}мс, "
+        f"вызовов API {sum(result['calls'].values())}, ошибок {errors} -> {args.out}"
+    )
+
+
+# ====================== COMPARE ======================
+
+def pct(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def delta(a, b):
+    return f"{(b - a) / a * 100:+.1f}%" if a else ('=' if a == b else 'new')
+
+
+def cmd_compare(args):
+    a = json.loads(Path(args.a).read_text(encoding='utf-8'))
+    b = json.loads(Path(args.b).read_text(encoding='utf-8'))
+    if len(a['updates']) != len(b['updates']):
+        print(f"Прогоны разной длины: {len(a['updates'])} и {len(b['updates'])} апдейтов")
+        sys.exit(1)
+
+    print(f"A: {a['build']}\nB: {b['build']}\nАпдейтов: {len(a['updates'])}\n")
+    la = sorted(update['ms'] for update in a['updates'])
+    lb = sorted(update['ms'] for update in b['updates'])
+    print(f"{'задержка':<10} {'A':>10} {'B':>10} {'разница':>9}")
+    for title, q in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1)):
+        print(f"{title:<10} {pct(la, q):>8.1f}мс {pct(lb, q):>8.1f}мс {delta(pct(la, q), pct(lb, q)):>9}")
+    print(f"{'время':<10} {a['elapsed']:>9.2f}с {b['elapsed']:>9.2f}с {delta(a['elapsed'], b['elapsed']):>9}\n")
+
+    print(f"{'метод API':<24} {'A':>8} {'B':>8} {'разница':>9}")
+    for method in sorted(set(a['calls']) | set(b['calls'])):
+        ca, cb = a['calls'].get(method, 0), b['calls'].get(method, 0)
+        print(f"{method:<24} {ca:>8} {cb:>8} {delta(ca, cb):>9}")
+    ta, tb = sum(a['calls'].values()), sum(b['calls'].values())
+    print(f"{'итого':<24} {ta:>8} {tb:>8} {delta(ta, tb):>9}\n")
+
+    changed = [
+        (index, ua, ub) for index, (ua, ub) in enumerate(zip(a['updates'], b['updates']))
+        if ua['calls'] != ub['calls'] or bool(ua['error']) != bool(ub['error'])
+    ]
+    print(f"Апдейтов с другими вызовами API или ошибками: {len(changed)}")
+    for index, ua, ub in changed[:args.show]:
+        print(f"  #{index} {ua['what']}")
+        print(f"    A: {' '.join(ua['calls']) or '—'}{'  ' + ua['error'] if ua['error'] else ''}")
+        print(f"    B: {' '.join(ub['calls']) or '—'}{'  ' + ub['error'] if ub['error'] else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help="прогнать запись через бота этой рабочей копии")
+    p.add_argument('recording', help="папка с записью или отдельный файл .jsonl.gz")
+    p.add_argument('--out', default='replay.json')
+    p.add_argument('--speed', type=float, default=0, help="1 — исходный темп, 2 — вдвое быстрее, 0 — как можно быстрее")
+    p.add_argument('--latency', type=float, default=0.0, help="задержка заглушки Telegram, с")
+    p.add_argument('--data', default=str(BASE_DIR / 'data'), help="папка данных, копия которой станет исходным состоянием")
+    p.add_argument('--limit', type=int, default=0, help="только первые N апдейтов")
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser('compare', help="сравнить два прогона")
+    p.add_argument('a')
+    p.add_argument('b')
+    p.add_argument('--show', type=int, default=10, help="сколько различий показать")
+    p.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from aiohttp import ClientConnectorError
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сессия Telegram API с повторами и настроенным пулом соединений.
+#
+# Что повторяется:
+#   - 429 (RetryAfter): запрос не выполнен, ждём retry_after и повторяем любой метод;
+#   - не удалось соединиться: запрос не ушёл, повторяем любой метод;
+#   - таймаут, обрыв, 5xx: запрос мог выполниться. Повторяем только методы, повтор
+#     которых безопасен (чтение, правка, удаление, ответ на callback). Отправку
+#     нового сообщения повторяем, только если вызывающий код сам разрешил это
+#     через `with idempotent():` — лишний дубль лучше потерянного сообщения.
+#
+# Паузы растут экспоненциально (с разбросом) до max_delay, а общее время
+# повторов ограничено budget секундами, чтобы хендлер не висел бесконечно.
+
+SAFE_PREFIXES = ('get', 'edit', 'delete', 'answer', 'set', 'pin', 'unpin')
+
+_policy = ContextVar('telegram_retry_policy', default=None)
+
+
+@contextmanager
+def idempotent():
+    # Отправки внутри блока можно повторять после таймаута
+    token = _policy.set('idempotent')
+    try:
+        yield
+    finally:
+        _policy.reset(token)
+
+
+@contextmanager
+def no_retries():
+    # Для кода со своей логикой повторов (рассылки)
+    token = _policy.set('off')
+    try:
+        yield
+    finally:
+        _policy.reset(token)
+
+
+def is_safe(api_method):
+    return api_method.startswith(SAFE_PREFIXES)
+
+
+class ResilientSession(AiohttpSession):
+    def __init__(self, limit=100, keepalive_timeout=30.0, max_attempts=5, base_delay=0.5,
+                 max_delay=10.0, max_retry_after=60.0, budget=90.0, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        # Все запросы идут на один хост, поэтому лимит на хост равен общему,
+        # а соединения держим открытыми между апдейтами
+        self._connector_init.update(
+            limit_per_host=limit,
+            keepalive_timeout=keepalive_timeout,
+            enable_cleanup_closed=True,
+        )
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.budget = budget
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(
+            limit=int(os.getenv('TELEGRAM_POOL_LIMIT', '100')),
+            keepalive_timeout=float(os.getenv('TELEGRAM_KEEPALIVE', '30')),
+            max_attempts=int(os.getenv('TELEGRAM_MAX_ATTEMPTS', '5')),
+            **kwargs
+        )
+
+    def _backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _retryable(self, api_method, error):
+        if isinstance(error, TelegramRetryAfter):
+            return True
+        if isinstance(error, TelegramNetworkError) and isinstance(error.__context__, ClientConnectorError):
+            return True
+        return is_safe(api_method) or _policy.get() == 'idempotent'
+
+    async def make_request(self, bot, method, timeout=None):
+        api_method = method.__api_method__
+        if _policy.get() == 'off':
+            return await super().make_request(bot, method, timeout)
+
+        deadline = time.monotonic() + self.budget
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await super().make_request(bot, method, timeout)
+            except (TelegramRetryAfter, TelegramNetworkError, TelegramServerError) as e:
+                if attempt >= self.max_attempts or not self._retryable(api_method, e):
+                    metrics.inc('telegram_request_failures_total', method=api_method, reason=type(e).__name__)
+                    raise
+                if isinstance(e, TelegramRetryAfter):
+                    if e.retry_after > self.max_retry_after:
+                        metrics.inc('telegram_request_failures_total', method=api_method, reason=type(e).__name__)
+                        raise
+                    delay = e.retry_after
+                else:
+                    delay = self._backoff(attempt)
+                if time.monotonic() + delay > deadline:
+                    metrics.inc('telegram_request_failures_total', method=api_method, reason='budget')
+                    raise
+                metrics.inc('telegram_retries_total', method=api_method, reason=type(e).__name__)
+                logger.warning(
+                    "Повтор %s через %.1f с (попытка %d): %s", api_method, delay, attempt + 1, e
+                )
+                await asyncio.sleep(delay)
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+from datetime import datetime
+from aiogram import types
+import json_codec
+from resilient_session import idempotent
+
+logger = logging.getLogger(__name__)
+
+# Сценарии специальных категорий описаны в scenarios.json, а не в коде.
+#
+# Сценарий — список шагов. Шаг срабатывает на callback_data из "on" и показывает
+# экран через навигатор: текст, фото, кнопки. Дополнительно шаг может:
+#   frames  — кадры перед основным экраном (слайд-шоу), у кадра свой delay;
+#   delay   — пауза перед основным экраном (кнопки на время паузы убираются);
+#   notify  — уведомить админа (и панель администратора через шину событий),
+#             confirm — ключ из "confirms" для кнопки подтверждения;
+#   ask     — дождаться ответа текстом (целое число) и показать шаг "next";
+#   values  — значения для подстановки в зависимости от нажатой кнопки;
+#   needs   — ключи, которые должны быть собраны раньше (иначе показывается error);
+#   finish  — сбросить собранные данные сценария.
+# В тексты подставляются {user}, ответы из ask и values.
+#
+# При загрузке всё компилируется в словарь callback_data -> шаг с готовыми
+# клавиатурами, так что выбор шага — один поиск по словарю.
+
+DEFAULT_ERROR = "❌ Ошибка загрузки"
+CONFIRM_PREFIX = 'ok_'
+
+
+def build_markup(rows):
+    if not rows:
+        return None
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text=text, callback_data=data) for text, data in row]
+        for row in rows
+    ])
+
+
+class ScenarioEngine:
+    def __init__(self, path, navigator, bot, admin_id, input_state, events=None):
+        self.path = path
+        self.navigator = navigator
+        self.bot = bot
+        self.admin_id = admin_id
+        # Состояние FSM, в котором ждём ответа на шаг с ask
+        self.input_state = input_state
+        self.events = events
+        self.steps = {}
+        self.confirms = {}
+
+    def load(self):
+        data = json_codec.read_file(self.path)
+        steps = {}
+        for name, scenario in data['scenarios'].items():
+            for step in scenario:
+                compiled = dict(step, scenario=name, markup=build_markup(step.get('buttons')))
+                for trigger in step['on']:
+                    if trigger in steps:
+                        raise ValueError(f"callback '{trigger}' встречается в сценариях дважды")
+                    steps[trigger] = compiled
+        for step in steps.values():
+            confirm = step.get('notify', {}).get('confirm')
+            if confirm and confirm not in data['confirms']:
+                raise ValueError(f"нет подтверждения '{confirm}'")
+            if 'ask' in step and step['ask']['next'] not in steps:
+                raise ValueError(f"нет шага '{step['ask']['next']}'")
+        self.steps = steps
+        self.confirms = data['confirms']
+        logger.info("Сценарии загружены: %d шагов", len(steps))
+
+    def handles(self, data):
+        return data in self.steps
+
+    @staticmethod
+    def is_confirm(data):
+        return data.startswith(CONFIRM_PREFIX)
+
+    # ---------- шаги ----------
+
+    async def run(self, call, state):
+        step = self.steps[call.data]
+        try:
+            values = await state.get_data()
+            if any(key not in values for key in step.get('needs', ())):
+                await call.answer(step.get('error', DEFAULT_ERROR))
+                return
+            await self._show(call, step, call.data, call.from_user, values)
+            await self._after(step, state)
+        except Exception as e:
+            logger.error("Ошибка сценария %s (%s): %s", step['scenario'], call.data, e)
+            await call.answer(step.get('error', DEFAULT_ERROR))
+
+    async def receive(self, message, state):
+        # Ответ текстом на шаг с ask
+        values = await state.get_data()
+        ask_step = self.steps.get(values.get('scenario_ask'))
+        if ask_step is None:
+            await state.clear()
+            return
+        ask = ask_step['ask']
+        if not message.text or not message.text.isdigit():
+            await message.answer(ask['error'])
+            return
+        await state.update_data({ask['key']: int(message.text), 'scenario_ask': None})
+        await state.set_state(None)
+        values = await state.get_data()
+        step = self.steps[ask['next']]
+        await self._show(message, step, ask['next'], message.from_user, values)
+        await self._after(step, state)
+
+    async def _after(self, step, state):
+        if 'ask' in step:
+            await state.set_state(self.input_state)
+            await state.update_data(scenario_ask=step['on'][0])
+        elif step.get('finish'):
+            await state.clear()
+
+    async def _show(self, event, step, trigger, user, values):
+        context = dict(values, user=user.username or user.full_name)
+        context.update(step.get('values', {}).get(trigger, {}))
+        notified = False
+
+        frames = step.get('frames', []) + [step]
+        for n, frame in enumerate(frames):
+            if frame.get('delay'):
+                if n == 0:
+                    # Пока идёт пауза, старые кнопки убираем, чтобы их не нажимали
+                    await self.navigator.clear_buttons(event)
+                await asyncio.sleep(frame['delay'])
+            markup = step['markup'] if frame is step else None
+            await self.navigator.show(
+                event, frame['text'].format_map(context), reply_markup=markup, photo=frame.get('photo')
+            )
+            if not notified:
+                notified = True
+                await self._notify(step, user, context)
+
+    async def _notify(self, step, user, context):
+        notify = step.get('notify')
+        if not notify:
+            return
+        text = notify['text'].format_map(context)
+        if self.events is not None:
+            self.events.publish('special_request', {
+                'scenario': step['scenario'],
+                'user': context['user'],
+                'user_id': user.id,
+                'text': text,
+                'at': datetime.now().isoformat(),
+            })
+        if not self.admin_id:
+            return
+        markup = None
+        if notify.get('confirm'):
+            confirm = self.confirms[notify['confirm']]
+            markup = build_markup([[
+                (confirm['button'], f"{CONFIRM_PREFIX}{notify['confirm']}_{user.id}")
+            ]])
+        await self.bot.send_message(self.admin_id, text, reply_markup=markup)
+
+    # ---------- подтверждения админа ----------
+
+    async def confirm(self, call):
+        try:
+            key, user_id = call.data[len(CONFIRM_PREFIX):].rsplit('_', 1)
+            confirm = self.confirms[key]
+            with idempotent():
+                await self.bot.send_message(int(user_id), confirm['reply'])
+            await call.message.edit_text(
+                confirm['done'].format(text=call.message.text),
+                reply_markup=None
+            )
+        except Exception as e:
+            logger.error("Ошибка подтверждения %s: %s", call.data, e)
+            await call.answer("❌ Не удалось отправить подтверждение", show_alert=True)
@@ -0,0 +1,418 @@
+import random
+import string
+import sqlite3
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import json_codec
+from models import Order, load_orders, load_carts
+
+logger = logging.getLogger(__name__)
+
+# Хранилища данных бота. Интерфейс общий:
+#   load() -> (menu, orders, active_orders) — заказы и корзины как Order и Cart из models.py
+#   save(menu, orders, active_orders, order_ids=())  — order_ids: какие заказы изменились
+#   allocate_order_id(orders), fetch_order(order_id)
+#   menu_changed() / load_menu() — меню поменял другой процесс, нужно перечитать
+#   menu_signature, remember_menu(menu, signature) — какую версию menu.json процесс
+#     уже видел (чтобы menu_watcher не путал свою запись с правкой снаружи)
+#   load_users(), save_user(users, user_id) — реестр пользователей бота
+#   poll_new_orders() — заказы, которые с прошлого вызова оформили другие процессы
+#   load_stock(), save_stock(stock, levels, sold) — остатки позиций (inventory.py);
+#     save_stock возвращает остатки после записи
+
+
+# Генератор ID заказа
+def generate_order_id():
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+
+
+_MISSING = object()
+
+
+def merge_menus(base, ours, theirs, depth=1):
+    # Трёхстороннее слияние меню: base — общий предок, ours — меню процесса,
+    # theirs — menu.json, изменённый снаружи. По каждой категории, а в ней по
+    # каждой позиции берётся сторона, которая её изменила; если позицию
+    # изменили обе, остаётся правка процесса. Возвращает (меню, спорные ключи)
+    merged, conflicts = {}, []
+    for key in list(theirs) + [key for key in ours if key not in theirs]:
+        b, o, t = base.get(key, _MISSING), ours.get(key, _MISSING), theirs.get(key, _MISSING)
+        if o == b:
+            value = t
+        elif t == b or t == o:
+            value = o
+        elif depth and isinstance(o, dict) and isinstance(t, dict):
+            value, nested = merge_menus(b if isinstance(b, dict) else {}, o, t, depth - 1)
+            conflicts += [f"{key}/{inner}" for inner in nested]
+        else:
+            value = o
+            conflicts.append(key)
+        if value is not _MISSING:
+            merged[key] = value
+    return merged, conflicts
+
+
+def _read_or_empty(path):
+    try:
+        return json_codec.read_file(path)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error("Ошибка загрузки %s: %s", path.name, e)
+        return {}
+
+
+class JsonStore:
+    # Однопроцессный режим: три JSON-файла в папке данных
+    name = 'json'
+
+    def __init__(self, data_dir, compact=True, active_file='active_orders.json'):
+        self.data_dir = Path(data_dir)
+        self.compact = compact
+        self.active_file = active_file
+        # menu.json, каким процесс его последний раз прочитал или записал: подпись
+        # (mtime, размер) и меню в байтах. Меню пишется, только если изменилось,
+        # поэтому сохранение корзин не затирает правку menu.json снаружи, а
+        # правка меню в боте сливается с ней (merge_menus)
+        self.menu_signature = None
+        self._menu_encoded = None
+
+    def menu_file_signature(self):
+        try:
+            stat = (self.data_dir / 'menu.json').stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def remember_menu(self, menu, signature):
+        self._menu_encoded = json_codec.dumps(menu)
+        self.menu_signature = signature
+
+    def load(self):
+        # Подпись до чтения: если файл поменяют во время чтения, это будет видно
+        signature = self.menu_file_signature()
+        names = ('menu.json', 'orders.json', self.active_file)
+        with ThreadPoolExecutor(len(names)) as pool:
+            menu, orders, active_orders = pool.map(lambda name: _read_or_empty(self.data_dir / name), names)
+        self.remember_menu(menu, signature)
+        return menu, load_orders(orders), load_carts(active_orders)
+
+    def save_menu(self, menu):
+        encoded = json_codec.dumps(menu)
+        if encoded == self._menu_encoded:
+            return
+        if self.menu_file_signature() == self.menu_signature:
+            json_codec.write_file(self.data_dir / 'menu.json', menu, self.compact)
+            self.remember_menu(menu, self.menu_file_signature())
+            return
+        # Файл поменяли снаружи после нашего чтения: сливаем обе правки. Предок и
+        # подпись не обновляем — menu_watcher увидит новый файл и применит слияние,
+        # а до тех пор повторное слияние даёт тот же результат
+        try:
+            external = json_codec.read_file(self.data_dir / 'menu.json')
+            if not isinstance(external, dict):
+                raise ValueError("ожидался объект с категориями")
+        except Exception as e:
+            logger.error("menu.json изменён снаружи и не читается (%s): правка меню не записана", e)
+            return
+        merged, conflicts = merge_menus(json_codec.loads(self._menu_encoded or b'{}'), menu, external)
+        json_codec.write_file(self.data_dir / 'menu.json', merged, self.compact)
+        if conflicts:
+            logger.warning(
+                "menu.json изменён снаружи, правки слиты; в обеих версиях изменены %s — оставлена правка бота",
+                ', '.join(conflicts)
+            )
+        else:
+            logger.info("menu.json изменён снаружи, правки слиты")
+
+    def save(self, menu, orders, active_orders, order_ids=()):
+        self.save_menu(menu)
+        json_codec.write_file(self.data_dir / 'orders.json', orders, self.compact)
+        json_codec.write_file(self.data_dir / self.active_file, active_orders, self.compact)
+
+    def allocate_order_id(self, orders):
+        while True:
+            order_id = generate_order_id()
+            if order_id not in orders:
+                return order_id
+
+    def fetch_order(self, order_id):
+        return None
+
+    def poll_new_orders(self):
+        return {}
+
+    def menu_changed(self):
+        return False
+
+    def load_users(self):
+        return _read_or_empty(self.data_dir / 'users.json')
+
+    def save_user(self, users, user_id):
+        json_codec.write_file(self.data_dir / 'users.json', users, self.compact)
+
+    def load_stock(self):
+        return _read_or_empty(self.data_dir / 'stock.json')
+
+    def save_stock(self, stock, levels, sold):
+        # Процесс один: его остатки и есть текущие
+        json_codec.write_file(self.data_dir / 'stock.json', stock, self.compact)
+        return stock
+
+
+# Общее хранилище меню и заказов для нескольких процессов-воркеров.
+# SQLite сам держит файловые блокировки; WAL позволяет читать во время записи.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS menu (
+    cat_id TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    data BLOB
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stock (
+    item_id TEXT PRIMARY KEY,
+    level INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('menu_version', 0);
+"""
+
+
+class SqliteStore:
+    # Корзины остаются локальными для воркера и пишутся в его собственный JSON-файл
+    name = 'sqlite'
+    # menu.json здесь только источник правок для menu_watcher, сам он не пишется
+    menu_signature = None
+
+    def __init__(self, path, data_dir, compact=True, active_file='active_orders.json', timeout=30.0):
+        self.path = str(path)
+        self.data_dir = Path(data_dir)
+        self.compact = compact
+        self.active_file = active_file
+        self._local = threading.local()
+        self._timeout = timeout
+        self._menu_cache = {}
+        self.version = None
+        # Последний прочитанный rowid заказов и заглушки, которые ещё не заполнены
+        self._orders_seen = 0
+        self._orders_pending = set()
+
+    # Соединение на поток: запросы могут идти и из цикла событий, и из asyncio.to_thread
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self._timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def is_empty(self):
+        conn = self._conn()
+        has_menu = conn.execute("SELECT 1 FROM menu LIMIT 1").fetchone()
+        has_orders = conn.execute("SELECT 1 FROM orders LIMIT 1").fetchone()
+        return not has_menu and not has_orders
+
+    # ---------- меню ----------
+
+    def menu_version(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'menu_version'").fetchone()
+        return row[0]
+
+    def menu_changed(self):
+        return self.menu_version() != self.version
+
+    def remember_menu(self, menu, signature):
+        pass
+
+    def load_menu(self):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            version = conn.execute("SELECT value FROM meta WHERE key = 'menu_version'").fetchone()[0]
+            rows = conn.execute("SELECT cat_id, data FROM menu").fetchall()
+        finally:
+            conn.execute("COMMIT")
+        self._menu_cache = {cat_id: bytes(data) for cat_id, data in rows}
+        self.version = version
+        return {cat_id: json_codec.loads(data) for cat_id, data in rows}, version
+
+    def save_menu(self, menu):
+        # Пишем только изменившиеся категории; версия растёт, только если что-то поменялось
+        changed = {}
+        for cat_id, items in menu.items():
+            encoded = json_codec.dumps(items)
+            if self._menu_cache.get(cat_id) != encoded:
+                changed[cat_id] = encoded
+        removed = set(self._menu_cache) - set(menu)
+        if not changed and not removed:
+            return None
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO menu (cat_id, data) VALUES (?, ?) "
+                "ON CONFLICT(cat_id) DO UPDATE SET data = excluded.data",
+                changed.items()
+            )
+            conn.executemany("DELETE FROM menu WHERE cat_id = ?", [(c,) for c in removed])
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'menu_version'")
+            version = conn.execute("SELECT value FROM meta WHERE key = 'menu_version'").fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._menu_cache.update(changed)
+        for cat_id in removed:
+            self._menu_cache.pop(cat_id, None)
+        # Если между нашими чтением и записью меню менял кто-то ещё, версия уйдёт
+        # больше чем на единицу и menu_changed() заставит перечитать меню
+        if self.version is not None and version == self.version + 1:
+            self.version = version
+        return version
+
+    # ---------- заказы ----------
+
+    def load_orders(self):
+        rows = self._conn().execute("SELECT rowid, order_id, data FROM orders").fetchall()
+        self._orders_seen = max((row[0] for row in rows), default=0)
+        self._orders_pending = {rowid for rowid, _, data in rows if data is None}
+        return load_orders({order_id: json_codec.loads(data) for _, order_id, data in rows if data is not None})
+
+    def poll_new_orders(self):
+        # Новые строки ищем по rowid, а заглушки (ID занят, заказ ещё оформляется)
+        # перепроверяем, пока в них не появятся данные
+        pending = sorted(self._orders_pending)
+        rows = self._conn().execute(
+            "SELECT rowid, order_id, data FROM orders "
+            f"WHERE rowid > ? OR rowid IN ({','.join('?' * len(pending))})",
+            (self._orders_seen, *pending)
+        ).fetchall()
+        result = {}
+        for rowid, order_id, data in rows:
+            self._orders_seen = max(self._orders_seen, rowid)
+            if data is None:
+                self._orders_pending.add(rowid)
+            else:
+                self._orders_pending.discard(rowid)
+                result[order_id] = Order.from_dict(json_codec.loads(data))
+        return result
+
+    def fetch_order(self, order_id):
+        row = self._conn().execute(
+            "SELECT data FROM orders WHERE order_id = ? AND data IS NOT NULL", (order_id,)
+        ).fetchone()
+        return Order.from_dict(json_codec.loads(row[0])) if row else None
+
+    def reserve_order_id(self, order_id):
+        # Строка-заглушка занимает ID; второй процесс с тем же ID получит rowcount == 0
+        cursor = self._conn().execute(
+            "INSERT OR IGNORE INTO orders (order_id, data) VALUES (?, NULL)", (order_id,)
+        )
+        return cursor.rowcount == 1
+
+    def save_orders(self, orders, order_ids):
+        rows = [
+            (order_id, json_codec.dumps(orders[order_id]))
+            for order_id in order_ids if order_id in orders
+        ]
+        if not rows:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO orders (order_id, data) VALUES (?, ?) "
+                "ON CONFLICT(order_id) DO UPDATE SET data = excluded.data",
+                rows
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------- пользователи ----------
+
+    def load_users(self):
+        rows = self._conn().execute("SELECT user_id, data FROM users").fetchall()
+        return {user_id: json_codec.loads(data) for user_id, data in rows}
+
+    def save_user(self, users, user_id):
+        self._conn().execute(
+            "INSERT INTO users (user_id, data) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+            (user_id, json_codec.dumps(users[user_id]))
+        )
+
+    def allocate_order_id(self, orders):
+        while True:
+            order_id = generate_order_id()
+            if order_id not in orders and self.reserve_order_id(order_id):
+                return order_id
+
+    # ---------- остатки ----------
+
+    def load_stock(self):
+        return dict(self._conn().execute("SELECT item_id, level FROM stock").fetchall())
+
+    def save_stock(self, stock, levels, sold):
+        # Уровни, заданные админом, записываются как есть, продажи вычитаются из
+        # общего остатка: так не теряются продажи других воркеров
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO stock (item_id, level) VALUES (?, ?) "
+                "ON CONFLICT(item_id) DO UPDATE SET level = excluded.level",
+                [(item_id, level) for item_id, level in levels.items() if level is not None]
+            )
+            conn.executemany(
+                "DELETE FROM stock WHERE item_id = ?",
+                [(item_id,) for item_id, level in levels.items() if level is None]
+            )
+            conn.executemany(
+                "UPDATE stock SET level = MAX(0, level - ?) WHERE item_id = ?",
+                [(count, item_id) for item_id, count in sold.items()]
+            )
+            rows = conn.execute("SELECT item_id, level FROM stock").fetchall()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return dict(rows)
+
+    # ---------- общий интерфейс ----------
+
+    def load(self):
+        if self.is_empty():
+            # Первый запуск: переносим данные из JSON-файлов однопроцессного режима
+            menu = _read_or_empty(self.data_dir / 'menu.json')
+            orders = _read_or_empty(self.data_dir / 'orders.json')
+            users = _read_or_empty(self.data_dir / 'users.json')
+            stock = _read_or_empty(self.data_dir / 'stock.json')
+            self.save_menu(menu)
+            self.save_stock(stock, stock, {})
+            self.save_orders(orders, list(orders))
+            for user_id in users:
+                self.save_user(users, user_id)
+        menu, _ = self.load_menu()
+        return menu, self.load_orders(), load_carts(_read_or_empty(self.data_dir / self.active_file))
+
+    def save(self, menu, orders, active_orders, order_ids=()):
+        self.save_menu(menu)
+        self.save_orders(orders, order_ids)
+        json_codec.write_file(self.data_dir / self.active_file, active_orders, self.compact)
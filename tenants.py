@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import signal
+import asyncio
+import argparse
+import importlib.util
+from pathlib import Path
+from contextlib import contextmanager
+from aiohttp import web
+import metrics
+
+# Несколько кафе в одном процессе. Каждое кафе (арендатор) — свой экземпляр bot.py,
+# загруженный под своим именем модуля со своими настройками: токен, админ,
+# категории, папка данных. Поэтому меню, заказы, корзины, FSM и фото у арендаторов
+# раздельные, а общими остаются цикл событий и пул соединений к Telegram.
+# Всё, что делается для кафе (апдейты, фоновые задачи), идёт в его контексте
+# metrics.tenant: метрики и /metrics у каждого кафе свои.
+#
+#   python tenants.py run --config tenants.json
+#   python tenants.py run --config tenants.json --webhook-url https://example.com --port 8080
+#
+# tenants.json:
+#   {"tenants": [{"name": "katsulka", "token": "...", "admin_id": 1, "data_dir": "data",
+#                 "categories_file": "categories.json", "scenarios_file": "scenarios.json",
+#                 "env": {"STORE_BACKEND": "json"}}]}
+
+BASE_DIR = Path(__file__).parent
+
+# Ключ конфига арендатора -> переменная окружения, которую читает bot.py
+CONFIG_ENV = {
+    'token': 'TELEGRAM_BOT_TOKEN',
+    'admin_id': 'ADMIN_ID',
+    'data_dir': 'DATA_DIR',
+    'categories_file': 'CATEGORIES_FILE',
+    'scenarios_file': 'SCENARIOS_FILE',
+}
+
+
+def read_config(path):
+    tenants = json.loads(Path(path).read_text(encoding='utf-8'))['tenants']
+    names = [tenant['name'] for tenant in tenants]
+    if len(set(names)) != len(names):
+        raise ValueError("имена арендаторов повторяются")
+    data_dirs = [Path(tenant['data_dir']).resolve() for tenant in tenants]
+    if len(set(data_dirs)) != len(data_dirs):
+        raise ValueError("у двух арендаторов одна папка данных")
+    return tenants
+
+
+def load_tenant(tenant):
+    # bot.py читает настройки из окружения при импорте: подставляем окружение
+    # арендатора, загружаем модуль и возвращаем окружение как было
+    overrides = {env: str(tenant[key]) for key, env in CONFIG_ENV.items() if tenant.get(key) is not None}
+    overrides.update({key: str(value) for key, value in tenant.get('env', {}).items()})
+    saved = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    try:
+        if str(BASE_DIR) not in sys.path:
+            sys.path.insert(0, str(BASE_DIR))
+        spec = importlib.util.spec_from_file_location(f"tenant_{tenant['name']}", BASE_DIR / 'bot.py')
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return module
+
+
+def load_tenants(configs):
+    # Все боты ходят в Telegram через одну сессию: один пул keep-alive соединений
+    from aiogram.client.telegram import TelegramAPIServer
+    from resilient_session import ResilientSession
+
+    tenants = {tenant['name']: load_tenant(tenant) for tenant in configs}
+    api_url = os.getenv('TELEGRAM_API_URL')
+    session = ResilientSession.from_env(
+        **({'api': TelegramAPIServer.from_base(api_url)} if api_url else {})
+    )
+    for module in tenants.values():
+        module.bot.session = session
+    return tenants, session
+
+
+@contextmanager
+def tenant_context(name):
+    token = metrics.tenant.set(name)
+    try:
+        yield
+    finally:
+        metrics.tenant.reset(token)
+
+
+# ====================== ЗАПУСК ======================
+
+async def run_polling(tenants, session):
+    loop = asyncio.get_running_loop()
+
+    def stop():
+        for module in tenants.values():
+            asyncio.ensure_future(module.dp.stop_polling())
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop)
+
+    async def poll(name, module):
+        # Задача поллинга и всё, что она запускает, наследуют контекст кафе
+        metrics.tenant.set(name)
+        await module.dp.start_polling(
+            module.bot,
+            handle_signals=False,
+            close_bot_session=False,
+            tasks_concurrency_limit=(
+                module.ADMISSION_WORKERS + module.ADMISSION_QUEUE if module.ADMISSION_WORKERS else None
+            )
+        )
+
+    try:
+        await asyncio.gather(*(poll(name, module) for name, module in tenants.items()))
+    finally:
+        await session.close()
+
+
+def build_webhook_app(tenants, session, base_url, secret=None):
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+    @web.middleware
+    async def tenant_middleware(request, handler):
+        prefix, _, name = request.path.rstrip('/').rpartition('/')
+        if prefix != '/webhook' or name not in tenants:
+            return await handler(request)
+        with tenant_context(name):
+            return await handler(request)
+
+    app = web.Application(middlewares=[tenant_middleware])
+    for name, module in tenants.items():
+        SimpleRequestHandler(dispatcher=module.dp, bot=module.bot, secret_token=secret).register(
+            app, path=f"/webhook/{name}"
+        )
+
+    async def on_startup(app):
+        for name, module in tenants.items():
+            with tenant_context(name):
+                await module.dp.emit_startup(bot=module.bot)
+                await module.bot.set_webhook(f"{base_url}/webhook/{name}", secret_token=secret)
+
+    async def on_shutdown(app):
+        for name, module in tenants.items():
+            with tenant_context(name):
+                await module.dp.emit_shutdown(bot=module.bot)
+        await session.close()
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+def cmd_run(args):
+    tenants, session = load_tenants(read_config(args.config))
+    if args.webhook_url:
+        app = build_webhook_app(tenants, session, args.webhook_url.rstrip('/'), args.secret)
+        web.run_app(app, host=args.host, port=args.port)
+    else:
+        asyncio.run(run_polling(tenants, session))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Несколько кафе в одном процессе")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help="поллинг или вебхуки для всех кафе из конфига")
+    p.add_argument('--config', default='tenants.json')
+    p.add_argument('--webhook-url', help="базовый адрес; без него — поллинг")
+    p.add_argument('--secret', help="secret_token вебхуков")
+    p.add_argument('--host', default='0.0.0.0')
+    p.add_argument('--port', type=int, default=8080)
+    p.set_defaults(func=cmd_run)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
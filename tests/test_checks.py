@@ -0,0 +1,472 @@
+import os
+import shutil
+import asyncio
+from pathlib import Path
+from aiohttp import web, ClientSession
+
+# Проверки на заглушке Telegram (fake_telegram.py): кластер, сессия с повторами,
+# несколько кафе в одном процессе, модели заказов.
+#
+#   python -m pytest -q
+
+BASE_DIR = Path(__file__).parent.parent
+TOKEN = '123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+
+
+# ====================== КЛАСТЕР ======================
+
+def test_cluster(tmp_path, monkeypatch):
+    import cluster
+    import json_codec
+    from stores import SqliteStore
+    from fake_telegram import FakeTelegramServer, message_update, callback_update
+
+    workers = 3
+    admin_id = 1
+    users = list(range(100001, 100013))
+    data_dir = tmp_path
+    shutil.copytree(BASE_DIR / 'data' / 'photos', data_dir / 'photos')
+    shutil.copy(BASE_DIR / 'data' / 'menu.json', data_dir / 'menu.json')
+    monkeypatch.setenv('DATA_DIR', str(data_dir))
+
+    async def scenario():
+        telegram = await FakeTelegramServer().start()
+        env = dict(os.environ)
+        env.update({
+            'TELEGRAM_API_URL': telegram.url,
+            'TELEGRAM_BOT_TOKEN': TOKEN,
+            'ADMIN_ID': str(admin_id),
+            'LOG_LEVEL': 'WARNING',
+        })
+        cluster.migrate_store()
+        # Старые фото перенесены в блобы один раз, до запуска воркеров
+        migrated, _ = SqliteStore(data_dir / 'shared.sqlite3', data_dir).load_menu()
+        photos = [item['photo'] for items in migrated.values() for item in items.values() if item.get('photo')]
+        assert photos and all(photo.startswith('blobs/') for photo in photos)
+
+        front_port = cluster.WORKER_BASE_PORT + workers + 1
+        processes = cluster.spawn_workers(workers, env)
+        runner = None
+        try:
+            for i in range(workers):
+                await cluster.wait_ready(f"http://127.0.0.1:{cluster.WORKER_BASE_PORT + i}/health")
+            runner = web.AppRunner(cluster.build_front(workers))
+            await runner.setup()
+            await web.TCPSite(runner, '127.0.0.1', front_port).start()
+            front_url = f"http://127.0.0.1:{front_port}/webhook"
+
+            async with ClientSession() as session:
+                async def send(update):
+                    async with session.post(front_url, json=update) as resp:
+                        assert resp.status == 200, resp.status
+
+                menu = json_codec.read_file(data_dir / 'menu.json')
+                cat_id, item_id = next((c, i) for c, items in menu.items() for i in items)
+
+                # Каждый пользователь кладёт позицию дважды и оформляет заказ, параллельно
+                async def customer(user_id):
+                    await send(callback_update(user_id, f"add_{cat_id}_{item_id}", raw=True))
+                    await send(callback_update(user_id, f"add_{cat_id}_{item_id}", raw=True))
+                    await send(callback_update(user_id, "final_confirm", raw=True))
+                    await send(callback_update(user_id, f"add_{cat_id}_{item_id}", raw=True))
+
+                await asyncio.gather(*(customer(u) for u in users))
+
+                db = SqliteStore(data_dir / 'shared.sqlite3', data_dir)
+                orders = db.load_orders()
+                assert len(orders) == len(users)
+                assert all(order.items[item_id].count == 2 for order in orders.values())
+
+                # Корзины лежат только у воркера, который владеет пользователем
+                for i in range(workers):
+                    carts = json_codec.read_file(data_dir / f"active_orders.w{i}.json")
+                    assert all(cluster.shard_for(int(u), workers) == i for u in carts)
+                    assert sum(1 for u in users if cluster.shard_for(u, workers) == i) == len(carts)
+
+                # Админ добавляет позицию в своём воркере
+                for update in (
+                    message_update(admin_id, '/start', raw=True),
+                    message_update(admin_id, '➕ Добавить позицию', raw=True),
+                    callback_update(admin_id, 'admin_add_to_drinks', raw=True),
+                    message_update(admin_id, 'Чай кластерный', raw=True),
+                    message_update(admin_id, 'Проверка', raw=True),
+                    message_update(admin_id, '3', raw=True),
+                    message_update(admin_id, 'Пропустить', raw=True),
+                ):
+                    await send(update)
+
+                new_menu, _ = db.load_menu()
+                new_item = next(
+                    (i for i, item in new_menu['drinks'].items() if item['name'] == 'Чай кластерный'), None
+                )
+                assert new_item is not None, "новая позиция не попала в общее меню"
+
+                # Пользователь из другого воркера сразу видит новую позицию
+                other = next(u for u in users if cluster.shard_for(u, workers) != cluster.shard_for(admin_id, workers))
+                await send(callback_update(other, f"add_drinks_{new_item}", raw=True))
+                assert any('Чай кластерный' in str(p.get('text')) for p in telegram.calls('answerCallbackQuery'))
+
+                # Админ закрывает заказ, созданный в чужом воркере
+                order_id, order = next(
+                    (oid, o) for oid, o in orders.items()
+                    if cluster.shard_for(int(o.user_id), workers) != cluster.shard_for(admin_id, workers)
+                )
+                await send(callback_update(admin_id, f"order_done_{order_id}", raw=True))
+                assert telegram.calls('sendMessage', chat_id=order.user_id)
+                assert db.fetch_order(order_id).status == 'done'
+        finally:
+            if runner:
+                await runner.cleanup()
+            cluster.stop_workers(processes)
+            await telegram.stop()
+
+    asyncio.run(scenario())
+
+
+# ====================== СЕССИЯ С ПОВТОРАМИ ======================
+
+def test_resilient_session():
+    import time
+    from aiogram import Bot
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError
+    from fake_telegram import FakeTelegramServer
+    from resilient_session import ResilientSession, idempotent, no_retries
+
+    async def scenario():
+        telegram = await FakeTelegramServer().start()
+        session = ResilientSession(
+            api=TelegramAPIServer.from_base(telegram.url), timeout=1, base_delay=0.05, max_delay=0.2
+        )
+        bot = Bot(TOKEN, session=session)
+        sent = lambda: len(telegram.calls('sendMessage'))
+        try:
+            # 429 дважды: доставлено с третьей попытки после двух пауз retry_after
+            telegram.inject('sendMessage', 'retry_after', times=2, retry_after=1)
+            started = time.monotonic()
+            await bot.send_message(5, "после 429")
+            assert sent() == 3
+            assert 2 <= time.monotonic() - started < 4
+
+            # Таймаут правки: повторено
+            telegram.inject('editMessageText', 'timeout', times=1, delay=2)
+            await bot.edit_message_text("правка", chat_id=5, message_id=1)
+            assert len(telegram.calls('editMessageText')) == 2
+
+            # Таймаут отправки без idempotent(): ошибка без повтора
+            telegram.inject('sendMessage', 'timeout', times=1, delay=2)
+            before = sent()
+            try:
+                await bot.send_message(5, "без повтора")
+                assert False, "ожидалась TelegramNetworkError"
+            except TelegramNetworkError:
+                assert sent() == before + 1
+
+            # Таймаут отправки в idempotent(): повторено
+            telegram.inject('sendMessage', 'timeout', times=1, delay=2)
+            before = sent()
+            with idempotent():
+                await bot.send_message(5, "с повтором")
+            assert sent() == before + 2
+
+            # 5xx в idempotent(): повторено
+            telegram.inject('sendMessage', 'server_error', times=1)
+            before = sent()
+            with idempotent():
+                await bot.send_message(5, "после 500")
+            assert sent() == before + 2
+
+            # retry_after больше лимита: ошибка сразу, без повтора и без ожидания
+            telegram.inject('sendMessage', 'retry_after', times=1, retry_after=600)
+            before = sent()
+            started = time.monotonic()
+            try:
+                await bot.send_message(5, "долгий 429")
+                assert False, "ожидалась TelegramRetryAfter"
+            except TelegramRetryAfter:
+                assert sent() == before + 1
+                assert time.monotonic() - started < 5
+
+            # no_retries(): 429 отдан вызывающему
+            telegram.inject('sendMessage', 'retry_after', times=1, retry_after=1)
+            before = sent()
+            with no_retries():
+                try:
+                    await bot.send_message(5, "рассылка")
+                    assert False, "ожидалась TelegramRetryAfter"
+                except TelegramRetryAfter:
+                    assert sent() == before + 1
+
+            # Нет соединения: ошибка после ограниченного числа попыток
+            await telegram.stop()
+            started = time.monotonic()
+            try:
+                await bot.send_message(5, "сервер недоступен")
+                assert False, "ожидалась TelegramNetworkError"
+            except TelegramNetworkError:
+                assert time.monotonic() - started < 5
+        finally:
+            await session.close()
+            await telegram.stop()
+
+    asyncio.run(scenario())
+
+
+# ====================== МОДЕЛИ ======================
+
+def test_models_round_trip():
+    from models import Order, Cart, CartLine
+
+    line = {'name': 'Борщ', 'price': 7, 'count': 2}
+    samples = [
+        # короткий заказ с незнакомым ключом
+        (Order, {'items': {}, 'created_at': 'x', 'foo': 1}),
+        # полный заказ с незнакомым ключом
+        (Order, {'items': {'item_1': dict(line, category='lunchdinner')}, 'user_id': '7', 'status': 'new',
+                 'created_at': 'x', 'cooking_at': 'y', 'bar': [1]}),
+        # заказ без незнакомых ключей
+        (Order, {'items': {'item_1': line}, 'created_at': 'x'}),
+        # корзина и позиция с незнакомыми ключами
+        (Cart, {'items': {'item_1': dict(line, note='без лука')}, 'foo': 1}),
+        # позиция с незнакомым ключом
+        (CartLine, dict(line, category='drinks', foo=None)),
+    ]
+    for cls, data in samples:
+        assert cls.from_dict(data).to_dict() == data
+
+
+# ====================== НЕСКОЛЬКО КАФЕ ======================
+
+def test_tenants(tmp_path, monkeypatch):
+    import json
+    import metrics
+    from tenants import load_tenants, tenant_context
+    from fake_telegram import FakeTelegramServer, message_update, callback_update
+
+    monkeypatch.setenv('LOG_LEVEL', 'WARNING')
+    configs = []
+    for n, name in enumerate(('north', 'south'), start=1):
+        data_dir = tmp_path / name
+        shutil.copytree(BASE_DIR / 'data' / 'photos', data_dir / 'photos')
+        shutil.copy(BASE_DIR / 'data' / 'menu.json', data_dir / 'menu.json')
+        configs.append({
+            'name': name, 'token': f"{n}00000:{'AB'[n - 1] * 35}", 'admin_id': n, 'data_dir': str(data_dir)
+        })
+    # У второго кафе только завтраки и напитки
+    (tmp_path / 'south_categories.json').write_text(json.dumps({
+        'categories': {'breakfast': "Завтрак 🍳", 'drinks': "Напитки 🥤"}
+    }, ensure_ascii=False), encoding='utf-8')
+    configs[1]['categories_file'] = str(tmp_path / 'south_categories.json')
+
+    async def scenario():
+        telegram = await FakeTelegramServer().start()
+        monkeypatch.setenv('TELEGRAM_API_URL', telegram.url)
+        tenants, session = load_tenants(configs)
+        north, south = tenants['north'], tenants['south']
+
+        async def feed(module, update):
+            with tenant_context(module.__name__[len('tenant_'):]):
+                await module.dp.feed_update(module.bot, update)
+
+        try:
+            for name, module in tenants.items():
+                with tenant_context(name):
+                    await module.dp.emit_startup(bot=module.bot)
+
+            # Общая сессия, и на ней одна мидлварь ответов на кнопки
+            assert north.bot.session is south.bot.session
+            assert len(session.middleware) == 1
+            assert set(session.fast_ack_routes) == {north.bot.id, south.bot.id}
+            assert list(south.CATEGORIES) == ['breakfast', 'drinks']
+
+            # Экран категорий второго кафе — только его категории
+            await feed(south, callback_update(500, 'categories', bot=south.bot))
+            screen = telegram.calls('editMessageText', chat_id=500, _bot='200000')[-1]
+            assert 'category_drinks' in screen['reply_markup']
+            assert 'category_outdoor' not in screen['reply_markup']
+
+            # Один и тот же клиент заказывает в первом кафе и только кладёт в корзину во втором
+            cat_id = 'breakfast'
+            item_id = next(iter(north.menu[cat_id]))[len('item_'):]
+            for data in (f"add_{cat_id}_{item_id}", 'final_confirm'):
+                await feed(north, callback_update(500, data, bot=north.bot))
+            await feed(south, callback_update(500, f"add_{cat_id}_{item_id}", bot=south.bot))
+            assert len(north.orders) == 1 and not south.orders
+            assert '500' in south.active_orders and '500' not in north.active_orders
+            for module in tenants.values():
+                module.save_db(module.menu, module.orders, module.active_orders)
+            assert len(json.loads((tmp_path / 'north' / 'orders.json').read_text(encoding='utf-8'))) == 1
+            assert not json.loads((tmp_path / 'south' / 'orders.json').read_text(encoding='utf-8'))
+            # О заказе узнал админ первого кафе от бота первого кафе
+            assert telegram.calls('sendMessage', chat_id=1, _bot='100000')
+            assert not telegram.calls('sendMessage', chat_id=1, _bot='200000')
+
+            # Админ первого кафе входит в админ-панель: во втором кафе у него нет ни прав, ни состояния
+            await feed(north, message_update(1, '/start', bot=north.bot))
+            assert await north.dp.fsm.storage.get_state(north.dp.fsm.get_context(north.bot, 1, 1).key)
+            assert await south.dp.fsm.storage.get_state(south.dp.fsm.get_context(south.bot, 1, 1).key) is None
+
+            # Метрики кафе видны только в его контексте
+            with tenant_context('north'):
+                north_metrics = metrics.render()
+            with tenant_context('south'):
+                south_metrics = metrics.render()
+            assert 'tenant="north"' in north_metrics and 'tenant="south"' not in north_metrics
+            assert 'tenant="south"' in south_metrics and 'tenant="north"' not in south_metrics
+        finally:
+            for name, module in tenants.items():
+                with tenant_context(name):
+                    await module.dp.emit_shutdown(bot=module.bot)
+            await session.close()
+            await telegram.stop()
+
+    asyncio.run(scenario())
+
+
+# ====================== ОСТАТКИ ======================
+
+def test_inventory_commit_is_one_transition():
+    from inventory import Inventory
+    from models import Cart, CartLine
+
+    # Заказ забирает последние порции: наблюдатель не должен увидеть позицию снова доступной
+    seen = []
+    inventory = Inventory(on_change=lambda item_id: seen.append((item_id, inventory.sold_out(item_id))))
+    inventory.load({'item_1': 3, 'item_2': 5}, {})
+    cart = Cart(items={
+        'item_1': CartLine(name='Борщ', price=7, count=3),
+        'item_2': CartLine(name='Чай', price=2, count=2),
+    }, created_at='x')
+    for item_id, line in cart.items.items():
+        assert inventory.reserve(item_id, line.count) == line.count
+    assert seen == [('item_1', True)]
+
+    seen.clear()
+    inventory.commit_cart(cart)
+    assert seen == []
+    assert inventory.stock == {'item_1': 0, 'item_2': 3}
+    assert not inventory.reserved
+    assert inventory.sold == {'item_1': 3, 'item_2': 2}
+
+
+# ====================== РЕКОМЕНДАЦИИ ======================
+
+def test_recommender_backends_agree():
+    import pytest
+    import json_codec
+    import recommender
+    from bench import synthetic_orders
+    from models import load_orders
+
+    menu = json_codec.read_file(BASE_DIR / 'data' / 'menu.json')
+    orders = load_orders(synthetic_orders(menu, 5000))
+    extra = list(load_orders(synthetic_orders(menu, 200, seed=7)).values())
+    allowed = {item_id for items in menu.values() for item_id in items}
+    if recommender.np is None:
+        pytest.skip("NumPy не установлен или выключен RECOMMENDER_NUMPY=0")
+
+    results = []
+    for use_numpy in (False, True):
+        model = recommender.Recommender(top_k=3, use_numpy=use_numpy)
+        model.rebuild(orders, allowed)
+        for order in extra:
+            model.add(order)
+        results.append(model.suggestions)
+    assert results[0] and results[0] == results[1]
+
+
+# ====================== ИМПОРТ МЕНЮ ======================
+
+def _bundle(items, mode='replace', extra=()):
+    import io
+    import json
+    import zipfile
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('manifest.json', json.dumps({'mode': mode, 'items': items}))
+        for name, data in extra:
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _import_errors(zip_bytes, menu, tmp_path):
+    from menu_bulk import BundleError, import_bundle
+    from photo_store import PhotoStore
+    categories = {'breakfast': "Завтрак", 'drinks': "Напитки"}
+    try:
+        asyncio.run(import_bundle(zip_bytes, menu, categories, PhotoStore(tmp_path)))
+    except BundleError as e:
+        return e.errors
+    return []
+
+
+def test_bundle_rejects_oversized_archives(tmp_path):
+    import menu_bulk
+
+    row = {'category': 'drinks', 'name': 'Чай', 'price': 5}
+    # Сжатая запись мала, а без сжатия больше лимита
+    bomb = _bundle([row], extra=[('big.bin', b'\0' * (menu_bulk.MAX_ENTRY_BYTES + 1))])
+    assert len(bomb) < 1024 * 1024
+    errors = _import_errors(bomb, {}, tmp_path)
+    assert errors and 'big.bin' in errors[0]
+
+    many = _bundle([row], extra=[(f"{n}.txt", b'') for n in range(menu_bulk.MAX_ENTRIES)])
+    assert _import_errors(many, {}, tmp_path) == [f"В архиве больше {menu_bulk.MAX_ENTRIES} файлов"]
+
+
+def test_bundle_rejects_ids_of_other_categories(tmp_path):
+    menu = {
+        'breakfast': {'item_1': {'name': 'Каша', 'desc': '', 'price': 4, 'photo': None}},
+        'drinks': {'item_2': {'name': 'Чай', 'desc': '', 'price': 5, 'photo': None}},
+    }
+    row = {'category': 'drinks', 'name': 'Каша в стакане', 'price': 5, 'id': 'item_1'}
+    for mode in ('replace', 'merge'):
+        assert _import_errors(_bundle([row], mode), menu, tmp_path) == [
+            "строка 1: позиция item_1 уже есть в категории 'breakfast'"
+        ]
+    same = dict(row, id='item_2')
+    assert _import_errors(_bundle([same], 'replace'), menu, tmp_path) == []
+
+
+# ====================== MENU.JSON ======================
+
+def test_menu_edit_merges_with_external_change(tmp_path):
+    import copy
+    import json_codec
+    from stores import JsonStore
+
+    menu = {
+        'breakfast': {'item_1': {'name': 'Каша', 'desc': '', 'price': 4, 'photo': None}},
+        'drinks': {'item_2': {'name': 'Чай', 'desc': '', 'price': 5, 'photo': None}},
+    }
+    json_codec.write_file(tmp_path / 'menu.json', menu)
+    store = JsonStore(tmp_path)
+    ours, _, _ = store.load()
+
+    # Пока menu_watcher не перечитал файл, его правят снаружи, а админ меняет меню в боте
+    external = copy.deepcopy(menu)
+    external['drinks']['item_2']['price'] = 6
+    external['drinks']['item_3'] = {'name': 'Какао', 'desc': '', 'price': 7, 'photo': None}
+    json_codec.write_file(tmp_path / 'menu.json', external)
+    ours['breakfast']['item_1']['price'] = 3
+    ours['drinks']['item_4'] = {'name': 'Морс', 'desc': '', 'price': 4, 'photo': None}
+
+    for _ in range(2):
+        # Повторное сохранение до перечитывания даёт то же слияние
+        store.save_menu(ours)
+        saved = json_codec.read_file(tmp_path / 'menu.json')
+        assert saved['breakfast']['item_1']['price'] == 3
+        assert saved['drinks']['item_2']['price'] == 6
+        assert set(saved['drinks']) == {'item_2', 'item_3', 'item_4'}
+    # Файл для menu_watcher остаётся чужим: он перечитает слияние в память бота
+    assert store.menu_file_signature() != store.menu_signature
+
+    # Правку одной и той же позиции с двух сторон решает бот
+    store.remember_menu(saved, store.menu_file_signature())
+    external = copy.deepcopy(saved)
+    external['drinks']['item_2']['price'] = 9
+    json_codec.write_file(tmp_path / 'menu.json', external)
+    ours = copy.deepcopy(saved)
+    ours['drinks']['item_2']['price'] = 8
+    store.save_menu(ours)
+    assert json_codec.read_file(tmp_path / 'menu.json')['drinks']['item_2']['price'] == 8